@@ -16,6 +16,11 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     CORS(app)
 
+    # Versionar las escrituras que invalidan los índices del emparejador
+    from app.utils import version_datos
+    with app.app_context():
+        version_datos.registrar(db.engine)
+
     # Registrar blueprints
     from app.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -1,12 +1,13 @@
-from flask import jsonify, request, current_app
+from flask import jsonify, request, current_app, Response, stream_with_context
 import json
 import time  # Asegúrate de que este import esté presente
 from werkzeug.utils import secure_filename
 from app.api import bp
 from app.services.operaciones_service import OperacionesService
 from app.services import afiliados_service
-from app.services import emparejamiento_service
+from app.services import emparejamiento_service, trabajos_emparejamiento
 from app.utils.exceptions import ValidationError, ProcessingError
+from app.utils.ndjson import lineas_ndjson, MIMETYPE_NDJSON
 from functools import wraps
 from app.models.afiliado import Afiliado
 from app import db
@@ -304,8 +305,7 @@ def calcular_emparejamientos():
         # Verificar si se está solicitando el algoritmo avanzado
         usar_algoritmo_avanzado = filtros.get('usar_algoritmo_avanzado', False)
         
-        # Parámetros de paginación (límite y offset)
-        limite = filtros.get('limite', 1000)  # Límite predeterminado de resultados
+        # La paginación (limite/offset) se aplica en el servicio con selección top-K
         
         # Parámetros para cálculo de riesgo
         dias_minimos = filtros.get('dias_minimos', 1)
@@ -338,9 +338,25 @@ def calcular_emparejamientos():
         
         # Añadir tiempo de ejecución a la respuesta
         resultados['execution_time'] = execution_time
+
+        # Modo streaming: una línea JSON por emparejamiento y al final un
+        # registro 'resumen' con paginación y estadísticas. Sólo la
+        # serialización es incremental: la selección top-K necesita evaluar
+        # todas las candidatas antes de conocer el orden, así que la primera
+        # línea sale cuando el cálculo ya terminó
+        if filtros.get('formato') == 'ndjson' or MIMETYPE_NDJSON in request.headers.get('Accept', ''):
+            emparejamientos = resultados.pop('data')
+            resultados['tipo'] = 'resumen'
+            return Response(
+                stream_with_context(lineas_ndjson(emparejamientos, resultados)),
+                mimetype=MIMETYPE_NDJSON
+            )
         
         return jsonify(resultados)
         
+    except ValidationError:
+        # Filtros inválidos (limite, offset, motor, ventana_dias, semilla...): 400 en handle_errors
+        raise
     except Exception as e:
         current_app.logger.error(f"Error en calcular_emparejamientos: {str(e)}")
         import traceback
@@ -351,6 +367,73 @@ def calcular_emparejamientos():
             "message": "Se produjo un error al calcular emparejamientos"
         }), 500
 
+@bp.route('/emparejador/planificar', methods=['POST'])
+@handle_errors
+def planificar_emparejamientos():
+    """
+    Plan diario de emparejamientos: parejas de menor riesgo total en el que
+    cada afiliado aparece a lo sumo su cupo de veces
+
+    Body JSON: los filtros de /emparejador/calcular (sin limite/offset) y
+    - cupo_diario: veces por día de cada afiliado (por defecto 1)
+    - cupos: {numero_afiliado: cupo} para afiliados con otro cupo (0 lo excluye)
+    - maximo_parejas: tope de parejas del plan (opcional)
+    """
+    filtros = request.json or {}
+    current_app.logger.info(f"Planificando emparejamientos del día: {filtros}")
+    return jsonify(emparejamiento_service.planificar_emparejamientos(filtros))
+
+@bp.route('/emparejador/mejores/<afiliado>', methods=['POST'])
+@handle_errors
+def mejores_parejas(afiliado):
+    """
+    Parejas de menor riesgo de un afiliado sin calcular todas las parejas
+
+    Body JSON (opcional): los filtros de /emparejador/calcular; limite por defecto 10
+    """
+    filtros = request.get_json(silent=True) or {}
+    current_app.logger.info(f"Buscando las mejores parejas de {afiliado}: {filtros}")
+    return jsonify(emparejamiento_service.mejores_parejas(afiliado, filtros))
+
+@bp.route('/emparejador/cache', methods=['GET'])
+@handle_errors
+def estadisticas_cache_emparejador():
+    """Aciertos, fallos y ocupación de la cache de cálculos del emparejador"""
+    return jsonify({"success": True, "data": emparejamiento_service.estadisticas_cache()})
+
+@bp.route('/emparejador/cache', methods=['DELETE'])
+@handle_errors
+def limpiar_cache_emparejador():
+    """Descarta los cálculos guardados (los contadores se conservan)"""
+    emparejamiento_service.cache_resultados.limpiar()
+    return jsonify({"success": True, "message": "Cache del emparejador vaciada"})
+
+@bp.route('/emparejador/trabajos', methods=['POST'])
+@handle_errors
+def enviar_trabajo_emparejamiento():
+    """
+    Lanza /emparejador/calcular en segundo plano y devuelve el id del trabajo.
+    Un pedido idéntico a otro en curso se une a ese trabajo.
+    """
+    trabajo, nuevo = trabajos_emparejamiento.enviar(request.json or {})
+    return jsonify({
+        "success": True,
+        "data": {"id": trabajo.id, "estado": trabajo.estado, "nuevo": nuevo}
+    }), 202
+
+@bp.route('/emparejador/trabajos/<id_trabajo>', methods=['GET'])
+@handle_errors
+def consultar_trabajo_emparejamiento(id_trabajo):
+    """Estado, avance y conteos parciales; incluye el resultado al terminar"""
+    return jsonify({"success": True, "data": trabajos_emparejamiento.obtener(id_trabajo).to_dict()})
+
+@bp.route('/emparejador/trabajos/<id_trabajo>', methods=['DELETE'])
+@handle_errors
+def cancelar_trabajo_emparejamiento(id_trabajo):
+    """Cancela el trabajo; conserva los resultados parciales ya seleccionados"""
+    trabajo = trabajos_emparejamiento.cancelar(id_trabajo)
+    return jsonify({"success": True, "data": {"id": trabajo.id, "estado": trabajo.estado}})
+
 @bp.route('/emparejador/detalles/<afiliado1>/<afiliado2>', methods=['GET'])
 @handle_errors
 def obtener_detalles_emparejamiento(afiliado1, afiliado2):
@@ -360,6 +443,7 @@ def obtener_detalles_emparejamiento(afiliado1, afiliado2):
     Versión mejorada que acepta parámetros adicionales vía query string:
     - incluir_historial_completo: Si es 'true', incluye todo el historial para análisis
     - configuracion: JSON con la configuración para cálculos avanzados
+    - semilla: entero para que los montos sugeridos sean reproducibles
     """
     # Opciones extendidas (opcionales)
     opciones = {}
@@ -377,26 +461,51 @@ def obtener_detalles_emparejamiento(afiliado1, afiliado2):
             # Si hay error en el JSON, ignorar la configuración
             current_app.logger.warning(f"Error decodificando JSON de configuración: {config_str}")
     
+    if request.args.get('semilla') is not None:
+        opciones['semilla'] = request.args.get('semilla')
+    
     current_app.logger.info(f"Obteniendo detalles emparejamiento {afiliado1}-{afiliado2} con opciones: {opciones}")
     
     return jsonify(emparejamiento_service.obtener_detalles_emparejamiento(afiliado1, afiliado2, opciones))
 
+@bp.route('/emparejador/detalles', methods=['POST'])
+@handle_errors
+def obtener_detalles_emparejamientos():
+    """
+    Obtiene los detalles de varias parejas en una sola consulta
+
+    Body JSON:
+    - parejas: lista de [afiliado1, afiliado2] o {afiliado1, afiliado2}
+    - incluir_historial_completo, configuracion, semilla: igual que en el GET individual
+
+    Cada pareja tiene su entrada en 'data'; las mal formadas o desconocidas
+    llevan success False y error, con la misma forma que el GET individual.
+    """
+    datos = request.json or {}
+    opciones = {clave: datos[clave] for clave in ('incluir_historial_completo', 'configuracion', 'semilla')
+                if datos.get(clave) is not None}
+
+    current_app.logger.info(f"Obteniendo detalles de {len(datos.get('parejas') or [])} parejas con opciones: {opciones}")
+
+    return jsonify(emparejamiento_service.obtener_detalles_emparejamientos(datos.get('parejas'), opciones))
+
 @bp.route('/emparejador/analizar-patrones', methods=['POST'])
 @handle_errors
 def analizar_patrones():
     """
-    Analiza patrones de comportamiento entre afiliados
+    Analiza patrones de comportamiento entre afiliados sobre el grafo de
+    contrapartes de las operaciones
+
+    Body JSON:
+    - fecha_desde, fecha_hasta: ventana de fechas (AAAA-MM-DD, opcionales)
+    - vista: 'afiliados' (grado y volumen), 'reciprocos' (flujos en ambos
+      sentidos), 'clusters' (afiliados conectados) o 'ciclos' (flujos cíclicos)
+    - page, per_page: página de la vista (por defecto 1 y 50)
+    - cluster: en la vista 'afiliados', sólo los miembros de ese cluster
     """
-    params = request.json or {}
-    
-    # Esta función podría implementarse en el servicio para análisis más avanzados
-    # Por ahora, simulamos una respuesta
-    
-    return jsonify({
-        "success": True,
-        "mensaje": "Análisis de patrones en desarrollo",
-        "fecha_implementacion_estimada": "2023-12-31"
-    })
+    params = request.get_json(silent=True) or {}
+    current_app.logger.info(f"Analizando patrones de operaciones: {params}")
+    return jsonify(emparejamiento_service.analizar_patrones(params))
 
 @bp.route('/emparejador/exportar', methods=['POST'])
 @handle_errors
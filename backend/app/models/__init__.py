@@ -3,4 +3,5 @@ from app import db
 # Importar modelos
 from app.models.operacion import Operacion
 from app.models.afiliado import Afiliado
-from app.models.rango_afiliado import RangoAfiliado
\ No newline at end of file
+from app.models.rango_afiliado import RangoAfiliado
+from app.models.version_datos import VersionDatos
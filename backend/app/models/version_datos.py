@@ -0,0 +1,15 @@
+from app import db
+
+class VersionDatos(db.Model):
+    """
+    Versión de cada tabla que usa el emparejador (app.utils.version_datos):
+    cambia en la misma transacción que cada escritura sobre la tabla, así que
+    todos los procesos que comparten la base ven la misma versión.
+    """
+    __tablename__ = 'versiones_datos'
+
+    tabla = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f'<VersionDatos {self.tabla}: {self.version}>'
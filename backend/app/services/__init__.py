@@ -2,8 +2,10 @@ from app.services.operaciones_service import OperacionesService
 from app.services.afiliados_service import AfiliadosService
 from app.services.emparejamiento_service import EmparejamientoService
 from app.services.base_service import BaseService
+from app.services.trabajos_emparejamiento import GestorTrabajos
 
 # Crear instancias de servicios
 operaciones_service = OperacionesService()
 afiliados_service = AfiliadosService()
-emparejamiento_service = EmparejamientoService()
\ No newline at end of file
+emparejamiento_service = EmparejamientoService()
+trabajos_emparejamiento = GestorTrabajos(emparejamiento_service)
@@ -0,0 +1,127 @@
+# app/services/carga_operaciones.py
+from datetime import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import String, select, type_coerce
+from app import db
+from app.models.operacion import Operacion
+
+# Filas leídas del cursor por lote
+FILAS_POR_LOTE = 50000
+
+COLUMNAS = ('fecha', 'hora', 'nombre1', 'nombre2', 'monto', 'fecha_completa')
+
+
+def _fechas(valores):
+    """Fechas del driver (texto ISO o date) a datetime64[ns]"""
+    return np.asarray(valores, dtype='datetime64[D]').astype('datetime64[ns]')
+
+
+def _horas(valores):
+    """Horas del driver (texto 'HH:MM:SS[.ffffff]', time o timedelta) a timedelta64[ns]"""
+    if isinstance(valores[0], time):
+        valores = [valor.isoformat() for valor in valores]
+    elif isinstance(valores[0], str):
+        horas = _horas_iso(valores)
+        if horas is not None:
+            return horas
+        # 'HH:MM' sin segundos, igual que en _preparar_fechas
+        valores = [valor + ':00' if valor.count(':') == 1 else valor for valor in valores]
+    return pd.to_timedelta(pd.Index(valores)).to_numpy(dtype='timedelta64[ns]')
+
+
+def _horas_iso(valores):
+    """
+    Lee 'HH:MM:SS[.ffffff]' (formato en que SQLite guarda las horas) sobre
+    los bytes de ancho fijo de cada texto. None si algún valor no respeta el
+    formato, para usar el parser general.
+    """
+    try:
+        octetos = np.array(valores, dtype='S16')
+    except UnicodeEncodeError:
+        return None
+    octetos = octetos.view(np.uint8).reshape(len(valores), 16)
+    digitos = octetos.astype(np.int64) - ord('0')
+
+    enteros = digitos[:, [0, 1, 3, 4, 6, 7]]
+    fraccion = digitos[:, 9:15]
+    con_fraccion = octetos[:, 8] == ord('.')
+    validos = (
+        (octetos[:, 2] == ord(':')) & (octetos[:, 5] == ord(':'))
+        & ((enteros >= 0) & (enteros <= 9)).all(axis=1)
+        & (con_fraccion | (octetos[:, 8] == 0))
+        & (octetos[:, 15] == 0)
+    )
+    # Fracción de 1 a 6 dígitos; el relleno (bytes nulos) cuenta como cero
+    fraccion = np.where(octetos[:, 9:15] == 0, 0, fraccion)
+    validos &= ~con_fraccion | ((fraccion >= 0) & (fraccion <= 9)).all(axis=1)
+    if not validos.all():
+        return None
+
+    segundos = (
+        (enteros[:, 0] * 10 + enteros[:, 1]) * 3600
+        + (enteros[:, 2] * 10 + enteros[:, 3]) * 60
+        + enteros[:, 4] * 10 + enteros[:, 5]
+    )
+    microsegundos = np.where(con_fraccion, fraccion @ (10 ** np.arange(5, -1, -1)), 0)
+    return (segundos * 10**9 + microsegundos * 1000).astype('timedelta64[ns]')
+
+
+def cargar_operaciones(sesion=None, desde=None):
+    """
+    Carga la tabla de operaciones como columnas tipadas para el emparejador.
+
+    Las columnas de fecha y hora se leen como texto, sin los procesadores de
+    tipos del ORM (el driver entrega texto o date/time según el motor de base
+    de datos), y el cursor se lee por lotes de FILAS_POR_LOTE filas: cada lote
+    se convierte a arreglos NumPy (fecha y fecha_completa en datetime64[ns],
+    monto en float64, nombres como object) y al final se concatenan. No se
+    crean objetos por fila ni se vuelve a parsear texto con strftime.
+
+    El DataFrame resultante ya trae 'fecha_completa', por lo que
+    _preparar_fechas lo deja como está.
+
+    Args:
+        desde: fecha (date) mínima de las operaciones; el filtro se aplica en
+            la consulta y queda en operaciones.attrs['desde'] para que los
+            índices del emparejador distingan cada ventana
+
+    Returns:
+        pd.DataFrame: fecha, hora (timedelta64), nombre1, nombre2, monto y fecha_completa
+    """
+    sesion = sesion or db.session
+    consulta = select(
+        type_coerce(Operacion.fecha, String).label('fecha'),
+        type_coerce(Operacion.hora, String).label('hora'),
+        Operacion.nombre1,
+        Operacion.nombre2,
+        Operacion.monto
+    )
+    if desde is not None:
+        consulta = consulta.where(Operacion.fecha >= desde)
+    # Orden de la tabla: el historial de cada pareja se guarda en ese orden y
+    # los códigos de una carga se reutilizan mientras no cambien los datos
+    consulta = consulta.order_by(Operacion.id)
+
+    lotes = {columna: [] for columna in COLUMNAS}
+    resultado = sesion.connection().execution_options(stream_results=True).execute(consulta)
+    try:
+        for filas in resultado.partitions(FILAS_POR_LOTE):
+            fechas, horas, nombres1, nombres2, montos = zip(*filas)
+            fecha = _fechas(fechas)
+            hora = _horas(horas)
+            lotes['fecha'].append(fecha)
+            lotes['hora'].append(hora)
+            lotes['nombre1'].append(np.array(nombres1, dtype=object))
+            lotes['nombre2'].append(np.array(nombres2, dtype=object))
+            lotes['monto'].append(np.array(montos, dtype=np.float64))
+            lotes['fecha_completa'].append(fecha + hora)
+    finally:
+        resultado.close()
+
+    if lotes['fecha']:
+        operaciones = pd.DataFrame({columna: np.concatenate(arreglos) for columna, arreglos in lotes.items()})
+    else:
+        operaciones = pd.DataFrame(columns=list(COLUMNAS))
+    operaciones.attrs['desde'] = desde
+    return operaciones
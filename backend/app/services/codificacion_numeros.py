@@ -0,0 +1,71 @@
+# app/services/codificacion_numeros.py
+import threading
+import numpy as np
+import pandas as pd
+
+# Código de un número que no está en el diccionario (sólo en buscar)
+SIN_CODIGO = -1
+
+
+class CodificadorNumeros:
+    """
+    Diccionario compartido número de afiliado -> código int32 denso.
+
+    Los códigos se asignan en orden de aparición y nunca cambian, de modo que
+    los índices del emparejador pueden guardarse por código y actualizarse
+    incrementalmente. Las comparaciones y agrupamientos se hacen sobre enteros;
+    los números sólo se recuperan (decodificar) al armar las respuestas.
+    """
+
+    def __init__(self):
+        self._codigos = {}
+        self._numeros = []
+        self._decodificados = np.empty(0, dtype=object)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._numeros)
+
+    def codificar(self, numeros):
+        """Códigos int32 de 'numeros', asignando uno nuevo a cada número no visto"""
+        locales, unicos = pd.factorize(np.asarray(numeros, dtype=object))
+        with self._lock:
+            globales = np.fromiter(
+                (self._asignar(numero) for numero in unicos), dtype=np.int32, count=len(unicos)
+            )
+        return globales[locales]
+
+    def _asignar(self, numero):
+        codigo = self._codigos.get(numero)
+        if codigo is None:
+            codigo = len(self._numeros)
+            self._codigos[numero] = codigo
+            self._numeros.append(numero)
+        return codigo
+
+    def buscar(self, numeros):
+        """Códigos de 'numeros' sin asignar nuevos (SIN_CODIGO si no están)"""
+        locales, unicos = pd.factorize(np.asarray(numeros, dtype=object))
+        globales = np.fromiter(
+            (self._codigos.get(numero, SIN_CODIGO) for numero in unicos), dtype=np.int32, count=len(unicos)
+        )
+        return globales[locales]
+
+    def decodificar(self, codigos):
+        """Números correspondientes a un arreglo de códigos"""
+        if len(self._decodificados) != len(self._numeros):
+            with self._lock:
+                self._decodificados = np.array(self._numeros, dtype=object)
+        return self._decodificados[np.asarray(codigos, dtype=np.int64)]
+
+    def columnas(self, operaciones):
+        """
+        Códigos de nombre1 y nombre2 de un DataFrame de operaciones. Si ya trae
+        las columnas codigo1/codigo2 (EmparejamientoService._codificar_operaciones)
+        se usan sin volver a codificar.
+        """
+        if 'codigo1' in operaciones.columns:
+            return (operaciones['codigo1'].to_numpy(dtype=np.int32),
+                    operaciones['codigo2'].to_numpy(dtype=np.int32))
+        return (self.codificar(operaciones['nombre1'].to_numpy(dtype=object)),
+                self.codificar(operaciones['nombre2'].to_numpy(dtype=object)))
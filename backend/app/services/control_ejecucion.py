@@ -0,0 +1,29 @@
+# app/services/control_ejecucion.py
+import threading
+import time
+
+
+class ControlEjecucion:
+    """
+    Condición de corte de un cálculo de emparejamientos.
+
+    Reúne el presupuesto de tiempo y la cancelación pedida desde otro hilo
+    (trabajos en segundo plano). Los evaluadores consultan agotado() entre
+    parejas o bloques y, si devuelve True, dejan el resto sin evaluar.
+    """
+
+    def __init__(self, presupuesto_segundos=None):
+        self.presupuesto_segundos = presupuesto_segundos or None
+        self.fin = time.perf_counter() + presupuesto_segundos if presupuesto_segundos else None
+        self._cancelado = threading.Event()
+
+    def cancelar(self):
+        self._cancelado.set()
+
+    @property
+    def cancelado(self):
+        return self._cancelado.is_set()
+
+    def agotado(self):
+        """True si se canceló o se pasó el presupuesto de tiempo"""
+        return self._cancelado.is_set() or (self.fin is not None and time.perf_counter() > self.fin)
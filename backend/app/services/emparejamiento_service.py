@@ -1,21 +1,60 @@
 # app/services/emparejamiento_service.py
-from datetime import datetime
-import random
+from datetime import date, datetime, timedelta
+import os
+import threading
 import numpy as np
 import pandas as pd
 import json
 from flask import current_app
-from sqlalchemy import text
+from sqlalchemy import case, func, text, tuple_
 from app import db
 from app.models.afiliado import Afiliado
 from app.models.operacion import Operacion
 from app.models.rango_afiliado import RangoAfiliado
 from app.services.base_service import BaseService
+from app.services.carga_operaciones import cargar_operaciones
+from app.services.codificacion_numeros import CodificadorNumeros
+from app.services.control_ejecucion import ControlEjecucion
+from app.services.grafo_contrapartes import GrafoContrapartes, SIN_CICLO
+from app.services.indices_operaciones import (
+    IndiceDiversidad, IndiceParejas, IndicesOperaciones, LineaTiempoAfiliados
+)
+from app.services.instantanea_operaciones import InstantaneaOperaciones, columnas_de, operaciones_de
+from app.services.medicion_etapas import MedicionEtapas
+from app.services.montos_sugeridos import GeneradorMontos
+from app.services.patrones_operaciones import riesgo_patron, riesgo_patron_parejas
+from app.services.planificacion_diaria import SeleccionPlan
+from app.services.motor_emparejamiento import MotorVectorizado
+from app.services.seleccion_resultados import SeleccionTopK
+from app.utils import version_datos
+from app.utils.cache_lru import CacheLRU
 from app.utils.exceptions import ValidationError, ProcessingError
 
+MOTORES = ('clasico', 'vectorizado', 'paralelo')
+
+# Parejas por consulta de detalles en lote (acota los parámetros del IN)
+MAX_PAREJAS_DETALLES = 200
+
+# Listados de /emparejador/analizar-patrones y tamaño máximo de página
+VISTAS_PATRONES = ('afiliados', 'reciprocos', 'clusters', 'ciclos')
+MAX_POR_PAGINA_PATRONES = 500
+
+# Afiliados de mayor volumen que se muestran por cluster o ciclo
+MUESTRA_GRUPO = 5
+
 class EmparejamientoService(BaseService):
     def __init__(self):
         super().__init__(RangoAfiliado)
+        self.motor_vectorizado = MotorVectorizado(self)
+        # Los índices comparten los códigos int32 de los números de afiliado
+        self.codificador = CodificadorNumeros()
+        self._codigos_operaciones = None
+        # Conjuntos de índices por versión de los datos y ventana (obtener_indices)
+        self.cache_indices = CacheLRU()
+        self._lock_indices = threading.Lock()
+        self.instantanea = InstantaneaOperaciones()
+        self.cache_resultados = CacheLRU()
+        self.cache_patrones = CacheLRU()
     
     def get_afiliados_por_rango(self, rango_inicio, rango_fin):
         """Obtiene afiliados registrados en un rango específico"""
@@ -168,24 +207,650 @@ class EmparejamientoService(BaseService):
             current_app.logger.error(f"Error en eliminar_todos_afiliados: {str(e)}")
             raise ProcessingError(f"Error eliminando afiliados: {str(e)}")
     
-    def calcular_emparejamientos(self, filtros):
-        """Calcula emparejamientos óptimos entre afiliados"""
+    def calcular_emparejamientos(self, filtros, control=None, estadisticas=None):
+        """
+        Calcula emparejamientos óptimos entre afiliados
+
+        Args:
+            filtros: dict de filtros de /emparejador/calcular
+            control: ControlEjecucion opcional (trabajos en segundo plano); por
+                defecto se crea uno con EMPAREJADOR_PRESUPUESTO_SEGUNDOS
+            estadisticas: dict que se completa durante el cálculo, para que
+                otro hilo pueda consultar el avance (opcional)
+
+        La respuesta trae en 'perf' los tiempos por etapa y los contadores del
+        cálculo (MedicionEtapas), que también se envían al logger.
+        """
         try:
-            # Extraer valores de filtros con valores por defecto
-            dias_minimos = filtros.get('dias_minimos', 1)
-            riesgo_maximo = filtros.get('riesgo_maximo', 50)
-            monto_minimo = filtros.get('monto_minimo', 0)
-            monto_maximo = filtros.get('monto_maximo', 0)
-            usar_algoritmo_avanzado = filtros.get('usar_algoritmo_avanzado', False)
+            medicion = MedicionEtapas()
+            parametros = self._leer_filtros(filtros)
+            limite, offset = parametros['limite'], parametros['offset']
+
+            # La versión de los datos se toma antes de leerlos: una escritura
+            # concurrente deja la entrada con una versión ya vencida
+            clave = self._clave_cache(parametros)
+            self.cache_resultados.tamano_maximo = current_app.config.get('EMPAREJADOR_CACHE_TAMANO', 32)
+            k = parametros['k']
+            with medicion.etapa('cache_resultados'):
+                calculo = self.cache_resultados.obtener(
+                    clave, aceptar=lambda c: c['k'] is None or (k is not None and k <= c['k'])
+                )
+            desde_cache = calculo is not None
+
+            if calculo is None:
+                if control is None:
+                    # Presupuesto de tiempo para evaluar parejas (0 = sin límite)
+                    control = ControlEjecucion(
+                        float(current_app.config.get('EMPAREJADOR_PRESUPUESTO_SEGUNDOS') or 0)
+                    )
+                calculo = self._ejecutar_calculo(parametros, control, estadisticas, medicion)
+                # Un cálculo cortado por el presupuesto de tiempo no se reutiliza
+                if calculo['estadisticas']['completo']:
+                    self.cache_resultados.guardar(clave, calculo)
+
+            fin = offset + limite if limite is not None else None
+            self._contar_etapas(medicion, calculo)
+            current_app.logger.info(
+                f"Etapas del cálculo de emparejamientos ({parametros['motor']}"
+                f"{', desde cache' if desde_cache else ''}): {medicion.texto()}"
+            )
+            return {
+                "success": True,
+                "data": calculo['resultados'][offset:fin],
+                "paginacion": {"total": calculo['total'], "limite": limite, "offset": offset},
+                "estadisticas": calculo['estadisticas'],
+                "desde_cache": desde_cache,
+                "perf": medicion.resumen()
+            }
             
-            # Obtener ponderaciones
-            ponderaciones = filtros.get('ponderaciones', {
+        except ValidationError as e:
+            raise e
+        except Exception as e:
+            current_app.logger.error(f"Error en calcular_emparejamientos: {str(e)}")
+            raise ProcessingError(f"Error calculando emparejamientos: {str(e)}")
+
+    def planificar_emparejamientos(self, filtros):
+        """
+        Plan diario: conjunto de parejas de menor riesgo total en el que cada
+        afiliado aparece a lo sumo su cupo de veces (SeleccionPlan).
+
+        Args:
+            filtros: los de calcular_emparejamientos (sin paginación) y además
+                cupo_diario (por defecto EMPAREJADOR_CUPO_DIARIO), cupos
+                ({numero: cupo} para afiliados con otro cupo; 0 lo excluye) y
+                maximo_parejas (opcional)
+        """
+        try:
+            medicion = MedicionEtapas()
+            parametros = self._leer_filtros(dict(filtros, limite=None, offset=0))
+            cupo_diario, cupos, maximo_parejas = self._leer_cupos(filtros)
+            seleccion = SeleccionPlan(
+                parametros['monto_minimo'], parametros['monto_maximo'], cupo_diario, cupos, maximo_parejas
+            )
+            control = ControlEjecucion(float(current_app.config.get('EMPAREJADOR_PRESUPUESTO_SEGUNDOS') or 0))
+            calculo = self._ejecutar_calculo(parametros, control, None, medicion, seleccion=seleccion)
+
+            self._contar_etapas(medicion, calculo)
+            medicion.contar('asignadas', len(calculo['resultados']))
+            current_app.logger.info(
+                f"Etapas del plan diario de emparejamientos ({parametros['motor']}): {medicion.texto()}"
+            )
+            return {
+                "success": True,
+                "data": calculo['resultados'],
+                "plan": seleccion.resumen(),
+                "estadisticas": calculo['estadisticas'],
+                "perf": medicion.resumen()
+            }
+
+        except ValidationError as e:
+            raise e
+        except Exception as e:
+            current_app.logger.error(f"Error en planificar_emparejamientos: {str(e)}")
+            raise ProcessingError(f"Error planificando emparejamientos: {str(e)}")
+
+    def mejores_parejas(self, afiliado, filtros):
+        """
+        Mejores parejas de un afiliado: evalúa sólo sus N - 1 parejas con los
+        filtros de calcular_emparejamientos (motor vectorizado). Las
+        características por afiliado y los índices de historial se calculan
+        una vez por versión de los datos (MotorVectorizado.perfil_afiliados) y
+        se guardan en cache_afiliados, así que cada consulta es lineal en N.
+
+        Los riesgos y demás campos coinciden con los de calcular_emparejamientos
+        para las mismas parejas; los montos sugeridos se sortean sólo entre
+        estas parejas.
+
+        Returns:
+            dict: data (página de las parejas de menor riesgo), paginacion,
+            estadisticas, desde_cache (perfil reutilizado) y perf
+        """
+        try:
+            medicion = MedicionEtapas()
+            parametros = self._leer_filtros(dict({'limite': 10}, **filtros))
+            avanzado = bool(parametros['usar_algoritmo_avanzado'])
+            limite, offset = parametros['limite'], parametros['offset']
+
+            cache = self.motor_vectorizado.cache_afiliados
+            cache.tamano_maximo = current_app.config.get('EMPAREJADOR_CACHE_AFILIADOS', 2)
+            clave = (avanzado, parametros['ventana_dias'], tuple(sorted(version_datos.versiones().items())),
+                     datetime.now().date().isoformat())
+            with medicion.etapa('cache_resultados'):
+                perfil = cache.obtener(clave)
+            desde_cache = perfil is not None
+            if perfil is None:
+                rango_afiliados = self._cargar_rangos(medicion)
+                with medicion.etapa('carga_operaciones'):
+                    operaciones = self._cargar_operaciones(parametros['desde'])
+                if not rango_afiliados.empty:
+                    perfil = self.motor_vectorizado.perfil_afiliados(rango_afiliados, operaciones, avanzado, medicion)
+                if perfil is not None:
+                    cache.guardar(clave, perfil)
+
+            if perfil is None or afiliado not in perfil['posiciones']:
+                raise ValidationError(f"El afiliado {afiliado} no tiene rangos registrados")
+
+            estadisticas = self._nuevas_estadisticas()
+            estadisticas['ventana'] = self._ventana(parametros, perfil['operaciones'])
+            seleccion = SeleccionTopK(parametros['k'], parametros['monto_minimo'], parametros['monto_maximo'])
+            resultados = self.motor_vectorizado.mejores_parejas(
+                perfil, afiliado, parametros['dias_minimos'], parametros['riesgo_maximo'],
+                parametros['monto_minimo'], parametros['monto_maximo'], parametros['ponderaciones'],
+                avanzado=avanzado, estadisticas=estadisticas, seleccion=seleccion,
+                generador=GeneradorMontos(parametros['semilla']), medicion=medicion
+            )
+            calculo = self._cerrar_calculo(
+                {'resultados': [], 'k': parametros['k'], 'total': 0, 'estadisticas': estadisticas},
+                resultados, seleccion
+            )
+
+            self._contar_etapas(medicion, calculo)
+            fin = offset + limite if limite is not None else None
+            return {
+                "success": True,
+                "data": calculo['resultados'][offset:fin],
+                "paginacion": {"total": calculo['total'], "limite": limite, "offset": offset},
+                "estadisticas": estadisticas,
+                "desde_cache": desde_cache,
+                "perf": medicion.resumen()
+            }
+
+        except ValidationError as e:
+            raise e
+        except Exception as e:
+            current_app.logger.error(f"Error en mejores_parejas: {str(e)}")
+            raise ProcessingError(f"Error buscando las mejores parejas: {str(e)}")
+
+    def analizar_patrones(self, filtros):
+        """
+        Análisis del grafo de contrapartes de las operaciones de una ventana
+        de fechas (GrafoContrapartes): grado y volumen por afiliado, flujos
+        recíprocos, flujos cíclicos y clusters de afiliados conectados.
+
+        El análisis se guarda por ventana y versión de las operaciones (con
+        el tamaño de EMPAREJADOR_CACHE_TAMANO), así que pasar de página o de
+        vista no lo recalcula.
+
+        Args:
+            filtros: fecha_desde / fecha_hasta (AAAA-MM-DD, opcionales), vista
+                (afiliados, reciprocos, clusters o ciclos), page, per_page y,
+                en la vista afiliados, cluster para listar sólo sus miembros
+
+        Returns:
+            dict: ventana, resumen, la página de la vista (data, pagination),
+            desde_cache y perf
+        """
+        try:
+            medicion = MedicionEtapas()
+            desde = self._fecha_patrones(filtros.get('fecha_desde'), 'fecha_desde')
+            hasta = self._fecha_patrones(filtros.get('fecha_hasta'), 'fecha_hasta')
+            if desde and hasta and desde > hasta:
+                raise ValidationError("fecha_desde no puede ser posterior a fecha_hasta")
+            vista = filtros.get('vista') or 'afiliados'
+            if vista not in VISTAS_PATRONES:
+                raise ValidationError(f"vista debe ser una de: {', '.join(VISTAS_PATRONES)}")
+            try:
+                page = int(filtros.get('page', 1))
+                per_page = int(filtros.get('per_page', 50))
+                cluster = int(filtros['cluster']) if filtros.get('cluster') is not None else None
+            except (TypeError, ValueError):
+                raise ValidationError("page, per_page y cluster deben ser números enteros")
+            if page < 1 or not 1 <= per_page <= MAX_POR_PAGINA_PATRONES:
+                raise ValidationError(f"page debe ser mayor que 0 y per_page estar entre 1 y {MAX_POR_PAGINA_PATRONES}")
+
+            self.cache_patrones.tamano_maximo = current_app.config.get('EMPAREJADOR_CACHE_TAMANO', 32)
+            clave = (desde, hasta, version_datos.version('operaciones'))
+            analisis = self.cache_patrones.obtener(clave)
+            desde_cache = analisis is not None
+            if analisis is None:
+                analisis = self._analisis_patrones(desde, hasta, medicion)
+                self.cache_patrones.guardar(clave, analisis)
+
+            with medicion.etapa('serializacion'):
+                filas = analisis['orden'][vista]
+                if vista == 'afiliados' and cluster is not None:
+                    filas = filas[analisis['cluster'][filas] == cluster - 1]
+                total = len(filas)
+                pagina = filas[(page - 1) * per_page:page * per_page]
+                if vista == 'afiliados':
+                    data = self._filas_afiliados(analisis, pagina)
+                elif vista == 'reciprocos':
+                    data = self._filas_reciprocos(analisis, pagina)
+                else:
+                    data = self._filas_grupos(analisis, vista, pagina)
+
+            return {
+                "success": True,
+                "ventana": analisis['ventana'],
+                "resumen": analisis['resumen'],
+                "vista": vista,
+                "data": data,
+                "pagination": {
+                    "total": total,
+                    "page": page,
+                    "per_page": per_page,
+                    "pages": (total + per_page - 1) // per_page
+                },
+                "desde_cache": desde_cache,
+                "perf": medicion.resumen()
+            }
+
+        except ValidationError as e:
+            raise e
+        except Exception as e:
+            current_app.logger.error(f"Error en analizar_patrones: {str(e)}")
+            raise ProcessingError(f"Error analizando patrones: {str(e)}")
+
+    @staticmethod
+    def _fecha_patrones(valor, nombre):
+        """Fecha opcional AAAA-MM-DD de la ventana de analizar_patrones"""
+        if valor is None or (isinstance(valor, str) and not valor.strip()):
+            return None
+        try:
+            return date.fromisoformat(str(valor).strip())
+        except ValueError:
+            raise ValidationError(f"{nombre} debe tener el formato AAAA-MM-DD")
+
+    def _analisis_patrones(self, desde, hasta, medicion):
+        """Construye el grafo de la ventana y todos los arreglos que se paginan"""
+        with medicion.etapa('carga_operaciones'):
+            operaciones = self._codificar_operaciones(self._cargar_operaciones(desde))
+            codigo1 = operaciones['codigo1'].to_numpy()
+            codigo2 = operaciones['codigo2'].to_numpy()
+            montos = operaciones['monto'].to_numpy(dtype=np.float64)
+            if hasta is not None:
+                dentro = operaciones['fecha'].to_numpy() <= np.datetime64(hasta, 'ns')
+                codigo1, codigo2, montos = codigo1[dentro], codigo2[dentro], montos[dentro]
+
+        with medicion.etapa('grafo'):
+            grafo = GrafoContrapartes(codigo1, codigo2, montos)
+            metricas = grafo.metricas()
+            directas, inversas = grafo.reciprocas()
+        with medicion.etapa('clusters'):
+            cluster = grafo.clusters()
+        with medicion.etapa('ciclos'):
+            ciclo = grafo.ciclos()
+        medicion.contar('filas_operaciones', len(codigo1))
+        medicion.contar('aristas', len(grafo.claves))
+
+        numeros = np.array(self.codificador.decodificar(grafo.codigos).tolist(), dtype=str)
+        volumen = metricas['volumen_enviado'] + metricas['volumen_recibido']
+        metricas['volumen_total'] = volumen
+        # Desempates por número de afiliado
+        rango_numero = np.empty(len(numeros), dtype=np.int64)
+        rango_numero[np.argsort(numeros, kind='stable')] = np.arange(len(numeros))
+
+        volumen_reciproco = grafo.volumenes[directas] + grafo.volumenes[inversas]
+        internas_clusters = grafo.internas(cluster)
+        internas_ciclos = grafo.internas(ciclo)
+        en_ciclo = ciclo != SIN_CICLO
+        # Miembros de cada grupo por volumen decreciente (para las muestras)
+        miembros_cluster = np.lexsort((rango_numero, -volumen, cluster))
+        miembros_ciclo = np.flatnonzero(en_ciclo)
+        miembros_ciclo = miembros_ciclo[np.lexsort((rango_numero[miembros_ciclo], -volumen[miembros_ciclo],
+                                                    ciclo[miembros_ciclo]))]
+        clusters = len(internas_clusters['aristas'])
+        ciclos = len(internas_ciclos['aristas'])
+        tamanos_clusters = np.bincount(cluster, minlength=clusters)
+
+        return {
+            'grafo': grafo,
+            'numeros': numeros,
+            'metricas': metricas,
+            'cluster': cluster,
+            'ciclo': ciclo,
+            'reciprocas': (directas, inversas),
+            'internas': {'clusters': internas_clusters, 'ciclos': internas_ciclos},
+            'tamanos': {'clusters': tamanos_clusters,
+                        'ciclos': np.bincount(ciclo[en_ciclo], minlength=ciclos)},
+            'miembros': {
+                'clusters': (miembros_cluster, np.searchsorted(cluster[miembros_cluster], np.arange(clusters))),
+                'ciclos': (miembros_ciclo, np.searchsorted(ciclo[miembros_ciclo], np.arange(ciclos))),
+            },
+            'orden': {
+                'afiliados': np.lexsort((rango_numero, -volumen)),
+                'reciprocos': np.lexsort((np.arange(len(directas)), -volumen_reciproco)),
+                'clusters': np.arange(clusters),
+                'ciclos': np.arange(ciclos),
+            },
+            'ventana': {
+                'fecha_desde': desde.isoformat() if desde else None,
+                'fecha_hasta': hasta.isoformat() if hasta else None,
+                'operaciones': len(codigo1),
+            },
+            'resumen': {
+                'afiliados': len(grafo),
+                'aristas': len(grafo.claves),
+                'operaciones': int(grafo.conteos.sum()),
+                'operaciones_propias': grafo.propias,
+                'volumen': round(float(grafo.volumenes.sum()), 2),
+                'parejas_reciprocas': len(directas),
+                'clusters': clusters,
+                'cluster_mayor': int(tamanos_clusters.max()) if clusters else 0,
+                'ciclos': ciclos,
+                'afiliados_en_ciclos': int(en_ciclo.sum()),
+            },
+        }
+
+    def _filas_afiliados(self, analisis, nodos):
+        """Métricas por afiliado de la página"""
+        metricas, numeros = analisis['metricas'], analisis['numeros']
+        pagina = numeros[nodos].tolist()
+        nombres = {
+            numero: f"{nombre} {apellido_paterno}"
+            for numero, nombre, apellido_paterno in db.session.query(
+                Afiliado.numero, Afiliado.nombre, Afiliado.apellido_paterno
+            ).filter(Afiliado.numero.in_(pagina)).all()
+        } if pagina else {}
+        filas = []
+        for nodo, numero in zip(nodos.tolist(), pagina):
+            ciclo = int(analisis['ciclo'][nodo])
+            filas.append({
+                'numero': numero,
+                'nombre': nombres.get(numero),
+                'contrapartes': int(metricas['contrapartes'][nodo]),
+                'grado_salida': int(metricas['grado_salida'][nodo]),
+                'grado_entrada': int(metricas['grado_entrada'][nodo]),
+                'reciprocas': int(metricas['reciprocas'][nodo]),
+                'operaciones_enviadas': int(metricas['operaciones_enviadas'][nodo]),
+                'operaciones_recibidas': int(metricas['operaciones_recibidas'][nodo]),
+                'volumen_enviado': round(float(metricas['volumen_enviado'][nodo]), 2),
+                'volumen_recibido': round(float(metricas['volumen_recibido'][nodo]), 2),
+                'volumen_total': round(float(metricas['volumen_total'][nodo]), 2),
+                'cluster': int(analisis['cluster'][nodo]) + 1,
+                'ciclo': ciclo + 1 if ciclo != SIN_CICLO else None,
+            })
+        return filas
+
+    @staticmethod
+    def _filas_reciprocos(analisis, posiciones):
+        """Parejas con operaciones en ambos sentidos (afiliado1 < afiliado2)"""
+        grafo, numeros = analisis['grafo'], analisis['numeros']
+        directas, inversas = analisis['reciprocas']
+        filas = []
+        for k in posiciones.tolist():
+            ida, vuelta = int(directas[k]), int(inversas[k])
+            if numeros[grafo.origenes[ida]] > numeros[grafo.indices[ida]]:
+                ida, vuelta = vuelta, ida
+            volumen_ida, volumen_vuelta = float(grafo.volumenes[ida]), float(grafo.volumenes[vuelta])
+            filas.append({
+                'afiliado1': str(numeros[grafo.origenes[ida]]),
+                'afiliado2': str(numeros[grafo.indices[ida]]),
+                'operaciones_1a2': int(grafo.conteos[ida]),
+                'operaciones_2a1': int(grafo.conteos[vuelta]),
+                'volumen_1a2': round(volumen_ida, 2),
+                'volumen_2a1': round(volumen_vuelta, 2),
+                'balance': round(volumen_ida - volumen_vuelta, 2),
+            })
+        return filas
+
+    @staticmethod
+    def _filas_grupos(analisis, tipo, grupos):
+        """Clusters o ciclos de la página con sus totales internos y una muestra de miembros"""
+        internas, tamanos = analisis['internas'][tipo], analisis['tamanos'][tipo]
+        miembros, inicios = analisis['miembros'][tipo]
+        filas = []
+        for grupo in grupos.tolist():
+            muestra = miembros[inicios[grupo]:inicios[grupo] + min(MUESTRA_GRUPO, int(tamanos[grupo]))]
+            filas.append({
+                'id': grupo + 1,
+                'tamano': int(tamanos[grupo]),
+                'aristas': int(internas['aristas'][grupo]),
+                'operaciones': int(internas['operaciones'][grupo]),
+                'volumen': round(float(internas['volumen'][grupo]), 2),
+                'muestra': analisis['numeros'][muestra].tolist(),
+            })
+        return filas
+
+    @staticmethod
+    def _leer_cupos(filtros):
+        """Valida cupo_diario, cupos por afiliado y maximo_parejas del plan diario"""
+        cupo_diario = filtros.get('cupo_diario')
+        if cupo_diario is None:
+            cupo_diario = current_app.config.get('EMPAREJADOR_CUPO_DIARIO', 1)
+        cupos = filtros.get('cupos') or {}
+        maximo_parejas = filtros.get('maximo_parejas')
+        if not isinstance(cupos, dict):
+            raise ValidationError("cupos debe ser un objeto {numero_afiliado: cupo}")
+        try:
+            cupo_diario = int(cupo_diario)
+            cupos = {str(numero): int(cupo) for numero, cupo in cupos.items()}
+            maximo_parejas = int(maximo_parejas) if maximo_parejas is not None else None
+        except (TypeError, ValueError):
+            raise ValidationError("cupo_diario, cupos y maximo_parejas deben ser números enteros")
+        if cupo_diario < 1 or any(cupo < 0 for cupo in cupos.values()):
+            raise ValidationError("cupo_diario debe ser mayor que 0 y los cupos no negativos")
+        if maximo_parejas is not None and maximo_parejas < 1:
+            raise ValidationError("maximo_parejas debe ser mayor que 0")
+        return cupo_diario, cupos, maximo_parejas
+
+    def clave_calculo(self, filtros):
+        """
+        Identifica un pedido de cálculo: dos pedidos con la misma clave producen
+        la misma respuesta (misma clave de cache y misma página).
+        """
+        parametros = self._leer_filtros(filtros)
+        return self._clave_cache(parametros), parametros['limite'], parametros['offset']
+
+    def _leer_filtros(self, filtros):
+        """Extrae y valida los filtros de calcular_emparejamientos con sus valores por defecto"""
+        motor = filtros.get('motor') or current_app.config.get('EMPAREJADOR_MOTOR', 'clasico')
+        if motor not in MOTORES:
+            raise ValidationError(f"Motor de emparejamiento no válido: {motor}")
+
+        # Sólo se conservan los offset + limite resultados de menor riesgo
+        limite, offset = self._paginacion(filtros)
+        semilla = self._semilla(filtros.get('semilla'))
+        ventana_dias = self._ventana_dias(filtros.get('ventana_dias'))
+
+        return {
+            'dias_minimos': filtros.get('dias_minimos', 1),
+            'riesgo_maximo': filtros.get('riesgo_maximo', 50),
+            'monto_minimo': filtros.get('monto_minimo', 0),
+            'monto_maximo': filtros.get('monto_maximo', 0),
+            'usar_algoritmo_avanzado': filtros.get('usar_algoritmo_avanzado', False),
+            'motor': motor,
+            'limite': limite,
+            'offset': offset,
+            'k': offset + limite if limite is not None else None,
+            'semilla': semilla,
+            'ventana_dias': ventana_dias,
+            # Las operaciones anteriores a 'desde' no se leen
+            'desde': datetime.now().date() - timedelta(days=ventana_dias) if ventana_dias else None,
+            'ponderaciones': filtros.get('ponderaciones', {
                 'dias': 0.4,
                 'diversidad': 0.25,
                 'operaciones': 0.25,
                 'patron': 0.1
             })
-            
+        }
+
+    def _clave_cache(self, parametros):
+        """
+        Clave de cache de un cálculo: filtros normalizados (con la ventana de
+        días), versión de los datos y fecha actual (los días desde la última
+        operación y el inicio de la ventana dependen de ella).
+        El motor no forma parte de la clave porque todos devuelven lo mismo.
+        """
+        avanzado = bool(parametros['usar_algoritmo_avanzado'])
+        pesos = None
+        if avanzado:
+            ponderaciones = parametros['ponderaciones'] or {}
+            pesos = tuple(
+                float(ponderaciones.get(nombre, defecto))
+                for nombre, defecto in (('dias', 0.4), ('diversidad', 0.25), ('operaciones', 0.25), ('patron', 0.1))
+            )
+        return (
+            float(parametros['dias_minimos']), float(parametros['riesgo_maximo']),
+            float(parametros['monto_minimo'] or 0), float(parametros['monto_maximo'] or 0),
+            avanzado, pesos, parametros['semilla'], parametros['ventana_dias'],
+            tuple(sorted(version_datos.versiones().items())),
+            datetime.now().date().isoformat()
+        )
+
+    def _clave_caracteristicas(self, parametros):
+        """
+        Clave de las características por pareja de los motores vectorizados:
+        sólo lo que cambia las candidatas o sus características (modo, montos
+        mínimo y máximo, ventana, versión de los datos y fecha actual). Las
+        ponderaciones, el riesgo máximo, los días mínimos, la semilla y la
+        paginación se aplican al puntuar.
+        """
+        return (
+            bool(parametros['usar_algoritmo_avanzado']),
+            float(parametros['monto_minimo'] or 0), float(parametros['monto_maximo'] or 0),
+            parametros['ventana_dias'],
+            tuple(sorted(version_datos.versiones().items())),
+            datetime.now().date().isoformat()
+        )
+
+    @staticmethod
+    def _contar_etapas(medicion, calculo):
+        """Contadores de 'perf': filas leídas y parejas podadas en cada etapa"""
+        estadisticas = calculo['estadisticas']
+        descartadas = estadisticas['descartadas']
+        ventana = estadisticas.get('ventana') or {}
+        medicion.contar('filas_rangos', medicion.contadores.get('filas_rangos', 0))
+        medicion.contar('filas_operaciones', ventana.get('operaciones', 0))
+        medicion.contar('parejas_consideradas', estadisticas['combinaciones'])
+        medicion.contar('podadas_rango', descartadas['sin_superposicion'] + descartadas['rango_invalido'])
+        medicion.contar('podadas_canal', descartadas['canal_incompatible'])
+        medicion.contar('podadas_recencia', descartadas['dias_minimos'])
+        medicion.contar('podadas_riesgo', descartadas['riesgo_maximo'])
+        medicion.contar('podadas_monto', descartadas['monto_asignado'])
+        medicion.contar('evaluadas', estadisticas['evaluadas'])
+        medicion.contar('resultados', calculo['total'])
+
+    def _ejecutar_calculo(self, parametros, control=None, estadisticas=None, medicion=None, seleccion=None):
+        """
+        Lee los datos y evalúa las parejas conservando los k de menor riesgo
+        (o lo que decida 'seleccion', por ejemplo un SeleccionPlan).
+
+        Con los motores vectorizados, si las características de las parejas
+        para estos datos ya están en cache no se leen los datos: sólo se
+        vuelve a puntuar (por ejemplo al cambiar las ponderaciones).
+
+        Returns:
+            dict: resultados (ranking), k, total y estadisticas
+        """
+        motor = parametros['motor']
+        dias_minimos = parametros['dias_minimos']
+        riesgo_maximo = parametros['riesgo_maximo']
+        monto_minimo = parametros['monto_minimo']
+        monto_maximo = parametros['monto_maximo']
+        usar_algoritmo_avanzado = parametros['usar_algoritmo_avanzado']
+        ponderaciones = parametros['ponderaciones']
+        k = parametros['k']
+
+        if estadisticas is None:
+            estadisticas = {}
+        if medicion is None:
+            medicion = MedicionEtapas()
+        estadisticas.update(self._nuevas_estadisticas(control.presupuesto_segundos if control else None))
+        if seleccion is None:
+            seleccion = SeleccionTopK(k, monto_minimo, monto_maximo)
+        generador = GeneradorMontos(parametros['semilla'])
+        calculo = {'resultados': [], 'k': k, 'total': 0, 'estadisticas': estadisticas}
+
+        clave_caracteristicas = None
+        if motor in ('vectorizado', 'paralelo'):
+            cache = self.motor_vectorizado.cache_caracteristicas
+            cache.tamano_maximo = current_app.config.get('EMPAREJADOR_CACHE_CARACTERISTICAS', 2)
+            clave_caracteristicas = self._clave_caracteristicas(parametros)
+            caracteristicas = cache.obtener(clave_caracteristicas)
+            if caracteristicas is not None:
+                estadisticas['ventana'] = self._ventana(parametros, caracteristicas['operaciones'])
+                resultados = self.motor_vectorizado.puntuar(
+                    caracteristicas, dias_minimos, riesgo_maximo, ponderaciones,
+                    avanzado=usar_algoritmo_avanzado, estadisticas=estadisticas,
+                    control=control, seleccion=seleccion, generador=generador, medicion=medicion
+                )
+                return self._cerrar_calculo(calculo, resultados, seleccion)
+
+        rango_afiliados = self._cargar_rangos(medicion)
+
+        # Operaciones como columnas tipadas (fecha_completa ya combinada),
+        # sólo las de la ventana de días si se pidió una
+        with medicion.etapa('carga_operaciones'):
+            operaciones = self._cargar_operaciones(parametros['desde'])
+        estadisticas['ventana'] = self._ventana(parametros, len(operaciones))
+        
+        # Si no hay datos suficientes, retornar lista vacía
+        if rango_afiliados.empty or operaciones.empty:
+            return calculo
+        
+        # Calcular emparejamientos
+        if motor in ('vectorizado', 'paralelo'):
+            resultados = self.motor_vectorizado.evaluar(
+                rango_afiliados,
+                operaciones,
+                dias_minimos,
+                riesgo_maximo,
+                monto_minimo,
+                monto_maximo,
+                ponderaciones,
+                avanzado=usar_algoritmo_avanzado,
+                estadisticas=estadisticas,
+                control=control,
+                seleccion=seleccion,
+                generador=generador,
+                procesos=self._procesos_paralelos() if motor == 'paralelo' else None,
+                clave_caracteristicas=clave_caracteristicas,
+                medicion=medicion
+            )
+        elif usar_algoritmo_avanzado:
+            resultados = self._evaluar_emparejamientos_avanzado(
+                rango_afiliados,
+                operaciones,
+                dias_minimos,
+                riesgo_maximo,
+                monto_minimo,
+                monto_maximo,
+                ponderaciones,
+                estadisticas=estadisticas,
+                control=control,
+                seleccion=seleccion,
+                generador=generador,
+                medicion=medicion
+            )
+        else:
+            resultados = self._evaluar_emparejamientos(
+                rango_afiliados,
+                operaciones,
+                dias_minimos,
+                riesgo_maximo,
+                estadisticas=estadisticas,
+                control=control,
+                seleccion=seleccion,
+                generador=generador,
+                medicion=medicion
+            )
+        
+        return self._cerrar_calculo(calculo, resultados, seleccion)
+
+    def _cargar_rangos(self, medicion):
+        """Rangos de todos los afiliados con su nombre, como DataFrame"""
+        with medicion.etapa('carga_rangos'):
             # Obtener todos los afiliados con sus rangos
             rangos_query = db.session.query(
                 RangoAfiliado,
@@ -195,7 +860,7 @@ class EmparejamientoService(BaseService):
                 Afiliado,
                 RangoAfiliado.numero_afiliado == Afiliado.numero
             ).all()
-            
+
             # Convertir a DataFrame para procesamiento
             rango_afiliados = pd.DataFrame([
                 {
@@ -208,199 +873,149 @@ class EmparejamientoService(BaseService):
                 }
                 for r in rangos_query
             ])
-            
-            # Obtener todas las operaciones
-            operaciones_query = Operacion.query.with_entities(
-                Operacion.fecha,
-                Operacion.hora,
-                Operacion.nombre1,
-                Operacion.nombre2,
-                Operacion.monto
-            ).all()
-            
-            # Convertir a DataFrame
-            operaciones = pd.DataFrame([
-                {
-                    'fecha': op.fecha,
-                    'hora': op.hora,
-                    'nombre1': op.nombre1,
-                    'nombre2': op.nombre2,
-                    'monto': op.monto
-                }
-                for op in operaciones_query
-            ])
-            
-            # Si no hay datos suficientes, retornar lista vacía
-            if rango_afiliados.empty or operaciones.empty:
-                return {"success": True, "data": []}
-            
-            # Calcular emparejamientos
-            if usar_algoritmo_avanzado:
-                resultados = self._evaluar_emparejamientos_avanzado(
-                    rango_afiliados,
-                    operaciones,
-                    dias_minimos,
-                    riesgo_maximo,
-                    monto_minimo,
-                    monto_maximo,
-                    ponderaciones
-                )
-            else:
-                resultados = self._evaluar_emparejamientos(
-                    rango_afiliados,
-                    operaciones,
-                    dias_minimos,
-                    riesgo_maximo
-                )
-            
-            # Aplicar filtros de monto
-            if monto_minimo > 0 or monto_maximo > 0:
-                resultados_filtrados = []
-                for res in resultados:
-                    monto = res.get('monto_asignado', 0)
-                    if monto_minimo > 0 and monto < monto_minimo:
-                        continue
-                    if monto_maximo > 0 and monto > monto_maximo:
-                        continue
-                    resultados_filtrados.append(res)
-                resultados = resultados_filtrados
-            
-            return {
-                "success": True,
-                "data": resultados
-            }
-            
-        except Exception as e:
-            current_app.logger.error(f"Error en calcular_emparejamientos: {str(e)}")
-            raise ProcessingError(f"Error calculando emparejamientos: {str(e)}")
+        medicion.contar('filas_rangos', len(rangos_query))
+        return rango_afiliados
+
+    @staticmethod
+    def _cerrar_calculo(calculo, resultados, seleccion):
+        """Completa el cálculo con el ranking y los conteos de la selección"""
+        # El filtro de monto asignado se aplica dentro de la selección
+        calculo['estadisticas']['descartadas']['monto_asignado'] = seleccion.descartadas_monto
+        calculo.update({'resultados': resultados, 'total': seleccion.total})
+        return calculo
+
+    @staticmethod
+    def _ventana(parametros, operaciones):
+        """Estadística de la ventana de días con la cantidad de operaciones leídas"""
+        return {
+            'dias': parametros['ventana_dias'],
+            'desde': parametros['desde'].isoformat() if parametros['desde'] else None,
+            'operaciones': operaciones
+        }
+
+    def estadisticas_cache(self):
+        """Aciertos, fallos y ocupación de la cache de resultados"""
+        return self.cache_resultados.estadisticas()
     
-    def _evaluar_emparejamientos(self, rango_afiliados, operaciones, dias_minimos, riesgo_maximo):
+    def _evaluar_emparejamientos(self, rango_afiliados, operaciones, dias_minimos, riesgo_maximo,
+                                 estadisticas=None, control=None, seleccion=None, generador=None,
+                                 medicion=None):
         """
         Evalúa y genera emparejamientos entre afiliados considerando múltiples criterios.
+
+        Args:
+            estadisticas: dict de _nuevas_estadisticas a completar (opcional)
+            control: ControlEjecucion que corta la evaluación (presupuesto o cancelación)
+            seleccion: SeleccionTopK que recibe los resultados (por defecto, todos)
+            generador: GeneradorMontos para los montos sugeridos
+            medicion: MedicionEtapas con los tiempos por etapa (la evaluación y
+                la construcción de cada resultado se miden juntas)
         """
         resultados = []
-        total_parejas = 0
-        parejas_filtradas = 0
+        if estadisticas is None:
+            estadisticas = self._nuevas_estadisticas()
+        if seleccion is None:
+            seleccion = SeleccionTopK()
+        if generador is None:
+            generador = GeneradorMontos()
+        if medicion is None:
+            medicion = MedicionEtapas()
 
         try:
             # Convertir fechas y horas a datetime para cálculos
-            operaciones['fecha'] = pd.to_datetime(operaciones['fecha'])
-            if not operaciones.empty and 'hora' in operaciones.columns:
-                operaciones['hora'] = operaciones['hora'].apply(
-                    lambda x: str(x) + ':00' if len(str(x).split(':')) == 2 else str(x)
-                )
-                operaciones['fecha_completa'] = pd.to_datetime(
-                    operaciones['fecha'].dt.strftime('%Y-%m-%d') + ' ' + operaciones['hora']
-                )
+            with medicion.etapa('preparacion_fechas'):
+                self._preparar_fechas(operaciones, avanzado=False)
             fecha_actual = datetime.now().date()
 
             # Consolidar los rangos por afiliado
-            rangos_consolidados = {}
-            for _, row in rango_afiliados.iterrows():
-                afiliado = row['numero_afiliado']
-                if afiliado not in rangos_consolidados:
-                    rangos_consolidados[afiliado] = {
-                        'nombre_completo': row['nombre_completo'],
-                        'rangos': [],
-                        'recibe_en': set(),
-                        'envia_a': set()
-                    }
-                
-                rangos_consolidados[afiliado]['rangos'].append({
-                    'inicio': row['rango_inicio'],
-                    'fin': row['rango_fin']
-                })
-                rangos_consolidados[afiliado]['recibe_en'].add(row['recibe_en'])
-                rangos_consolidados[afiliado]['envia_a'].add(row['envia_a'])
+            with medicion.etapa('consolidacion_rangos'):
+                rangos_consolidados = self._consolidar_rangos(rango_afiliados, avanzado=False)
+            with medicion.etapa('indices'):
+                indices = self.obtener_indices(operaciones)
+                indice_diversidad = indices.diversidad
+                indice_parejas = indices.parejas
+                linea_tiempo = indices.linea_tiempo
 
-            # Iterar sobre todas las posibles combinaciones de afiliados
+            # Sólo las parejas con canales compatibles cuyos rangos se superponen,
+            # con el rango efectivo ya ajustado al límite de Izipay
+            with medicion.etapa('filtrado_parejas'):
+                candidatas = self.motor_vectorizado.parejas_candidatas(rangos_consolidados, avanzado=False)
+            self._registrar_candidatas(estadisticas, candidatas)
+
+            medicion.iniciar('evaluacion')
             afiliados_list = list(rangos_consolidados.items())
-            for i, (num_afiliado1, info1) in enumerate(afiliados_list):
-                for num_afiliado2, info2 in afiliados_list[i+1:]:
-                    total_parejas += 1
-                    
-                    # Evitar auto-emparejamientos
-                    if num_afiliado1 == num_afiliado2:
-                        parejas_filtradas += 1
-                        continue
+            construir_resultado = self._constructor_resultado_clasico(rangos_consolidados)
+            codigos = self.codificador.codificar(list(rangos_consolidados)).tolist()
+            for k, (i, j, inicio, fin) in enumerate(zip(
+                candidatas['i'].tolist(), candidatas['j'].tolist(),
+                candidatas['inicio'].tolist(), candidatas['fin'].tolist()
+            )):
+                if control is not None and control.agotado():
+                    self._agotar_presupuesto(estadisticas, len(candidatas['i']) - k, control)
+                    break
 
-                    # Calcular el rango efectivo
-                    rango_efectivo = self._calcular_rango_efectivo(info1['rangos'], info2['rangos'])
-                    if not rango_efectivo:
-                        parejas_filtradas += 1
-                        continue
+                num_afiliado1, info1 = afiliados_list[i]
+                num_afiliado2, info2 = afiliados_list[j]
+                codigo1, codigo2 = codigos[i], codigos[j]
+                rango_efectivo = {'inicio': inicio, 'fin': fin}
 
-                    # Ajustar el rango máximo para Izipay (límite de 800)
-                    if 'Izipay' in info1['recibe_en'] or 'Izipay' in info2['recibe_en']:
-                        rango_efectivo['fin'] = min(rango_efectivo['fin'], 800)
+                # Obtener el historial de operaciones entre la pareja
+                historial = indice_parejas.obtener(codigo1, codigo2)
 
-                    if rango_efectivo['fin'] <= rango_efectivo['inicio']:
-                        parejas_filtradas += 1
+                # Verificar el tiempo transcurrido desde la última operación
+                if historial is not None:
+                    dias_desde_ultima = (fecha_actual - historial.ultima_fecha.date()).days
+                    if dias_desde_ultima < dias_minimos:
+                        estadisticas['descartadas']['dias_minimos'] += 1
                         continue
+                else:
+                    dias_desde_ultima = float('inf')  # Sin operaciones previas
 
-                    # Obtener el historial de operaciones entre la pareja
-                    if not operaciones.empty:
-                        operaciones_pareja = operaciones[
-                            ((operaciones['nombre1'] == num_afiliado1) & (operaciones['nombre2'] == num_afiliado2)) |
-                            ((operaciones['nombre1'] == num_afiliado2) & (operaciones['nombre2'] == num_afiliado1))
-                        ]
-                    else:
-                        operaciones_pareja = pd.DataFrame()
-
-                    # Verificar el tiempo transcurrido desde la última operación
-                    if not operaciones_pareja.empty:
-                        ultima_operacion = operaciones_pareja['fecha'].max()
-                        dias_desde_ultima = (fecha_actual - ultima_operacion.date()).days
-                        if dias_desde_ultima < dias_minimos:
-                            parejas_filtradas += 1
-                            continue
-                    else:
-                        dias_desde_ultima = float('inf')  # Sin operaciones previas
+                # Calcular métricas
+                diversidad_1 = indice_diversidad.obtener(codigo1)
+                diversidad_2 = indice_diversidad.obtener(codigo2)
+                diversidad_minima = min(diversidad_1, diversidad_2)
+                afiliado_menor_diversidad = num_afiliado1 if diversidad_1 < diversidad_2 else num_afiliado2
+                
+                operaciones_minimas, codigo_menor_ops = self._calcular_total_operaciones(
+                    linea_tiempo, 
+                    codigo1, 
+                    codigo2,
+                    historial
+                )
+                afiliado_menor_ops = num_afiliado1 if codigo_menor_ops == codigo1 else num_afiliado2
 
-                    # Calcular métricas
-                    diversidad_1 = self._calcular_diversidad(operaciones, num_afiliado1)
-                    diversidad_2 = self._calcular_diversidad(operaciones, num_afiliado2)
-                    diversidad_minima = min(diversidad_1, diversidad_2)
-                    afiliado_menor_diversidad = num_afiliado1 if diversidad_1 < diversidad_2 else num_afiliado2
-                    
-                    operaciones_minimas, afiliado_menor_ops = self._calcular_total_operaciones(
-                        operaciones, 
-                        num_afiliado1, 
-                        num_afiliado2
-                    )
+                # Calcular riesgo
+                riesgo = self._calcular_riesgo(
+                    dias_desde_ultima if dias_desde_ultima != float('inf') else 1000,
+                    diversidad_minima,
+                    operaciones_minimas
+                )
+                estadisticas['evaluadas'] += 1
 
-                    # Calcular riesgo
-                    riesgo = self._calcular_riesgo(
-                        dias_desde_ultima if dias_desde_ultima != float('inf') else 1000,
-                        diversidad_minima,
-                        operaciones_minimas
-                    )
+                if riesgo > riesgo_maximo:
+                    estadisticas['descartadas']['riesgo_maximo'] += 1
+                    continue
 
-                    if riesgo > riesgo_maximo:
-                        parejas_filtradas += 1
-                        continue
+                # Calcular monto sugerido
+                monto_sugerido = generador.sugerir([rango_efectivo['inicio']], [rango_efectivo['fin']])[0]
 
-                    # Calcular monto sugerido
-                    monto_sugerido = self._calcular_monto_sugerido(
-                        operaciones_pareja, 
-                        rango_efectivo['inicio'], 
-                        rango_efectivo['fin']
-                    )
+                # Ofrecer el emparejamiento a la selección top-K (el resultado
+                # se construye sólo si queda seleccionado)
+                seleccion.agregar_pareja(
+                    (num_afiliado1, num_afiliado2), round(riesgo, 2), monto_sugerido,
+                    self._datos_resultado_clasico(
+                        dias_desde_ultima, diversidad_minima, afiliado_menor_diversidad == num_afiliado2,
+                        operaciones_minimas, afiliado_menor_ops == num_afiliado2
+                    ),
+                    construir_resultado
+                )
 
-                    # Agregar emparejamiento a resultados
-                    resultados.append({
-                        "afiliado1": info1['nombre_completo'],
-                        "afiliado2": info2['nombre_completo'],
-                        "dias_desde_ultima": dias_desde_ultima if dias_desde_ultima != float('inf') else "Sin operaciones previas",
-                        "diversidad_minima": f"{diversidad_minima} ({rangos_consolidados[afiliado_menor_diversidad]['nombre_completo']})",
-                        "operaciones_intermedias_minimas": f"{operaciones_minimas} ({rangos_consolidados[afiliado_menor_ops]['nombre_completo']})",
-                        "monto_asignado": monto_sugerido,
-                        "riesgo": round(riesgo, 2),
-                        "pareja": [num_afiliado1, num_afiliado2]
-                    })
+            medicion.terminar('evaluacion')
 
-            # Ordenar por nivel de riesgo
-            resultados.sort(key=lambda x: x['riesgo'])
+            # Resultados conservados, ordenados por nivel de riesgo
+            with medicion.etapa('serializacion'):
+                resultados = seleccion.resultados()
 
         except Exception as e:
             current_app.logger.error(f"Error evaluando emparejamientos: {str(e)}")
@@ -409,7 +1024,9 @@ class EmparejamientoService(BaseService):
         return resultados
 
     def _evaluar_emparejamientos_avanzado(self, rango_afiliados, operaciones, dias_minimos, riesgo_maximo, 
-                                        monto_minimo, monto_maximo, ponderaciones):
+                                        monto_minimo, monto_maximo, ponderaciones,
+                                        estadisticas=None, control=None, seleccion=None, generador=None,
+                                        medicion=None):
         """
         Versión avanzada del evaluador de emparejamientos con ponderaciones personalizadas
         y análisis de patrones de comportamiento.
@@ -422,14 +1039,24 @@ class EmparejamientoService(BaseService):
             monto_minimo: Monto mínimo para filtrar resultados (opcional)
             monto_maximo: Monto máximo para filtrar resultados (opcional)
             ponderaciones: Dict con ponderaciones para el cálculo de riesgo
+            estadisticas: dict de _nuevas_estadisticas a completar (opcional)
+            control: ControlEjecucion que corta la evaluación (presupuesto o cancelación)
+            seleccion: SeleccionTopK que recibe los resultados (por defecto, todos)
+            generador: GeneradorMontos para los montos sugeridos
+            medicion: MedicionEtapas con los tiempos por etapa
             
         Returns:
             list: Lista de resultados de emparejamiento
         """
         resultados = []
-        total_parejas = 0
-        parejas_filtradas = 0
-        max_parejas_procesar = 10000  # Límite de seguridad para evitar bucles infinitos
+        if estadisticas is None:
+            estadisticas = self._nuevas_estadisticas()
+        if seleccion is None:
+            seleccion = SeleccionTopK()
+        if generador is None:
+            generador = GeneradorMontos()
+        if medicion is None:
+            medicion = MedicionEtapas()
 
         try:
             # Validamos que los DataFrames no estén vacíos
@@ -438,247 +1065,151 @@ class EmparejamientoService(BaseService):
                 return resultados
                 
             # Convertir fechas y horas a datetime para cálculos
-            if not operaciones.empty:
-                try:
-                    operaciones['fecha'] = pd.to_datetime(operaciones['fecha'], errors='coerce')
-                    
-                    if 'hora' in operaciones.columns:
-                        # Aseguramos formato consistente para la hora
-                        operaciones['hora'] = operaciones['hora'].apply(
-                            lambda x: str(x) + ':00' if x and len(str(x).split(':')) == 2 else str(x) if x else '00:00:00'
-                        )
-                        
-                        # Combinamos fecha y hora
-                        operaciones['fecha_completa'] = pd.to_datetime(
-                            operaciones['fecha'].dt.strftime('%Y-%m-%d') + ' ' + operaciones['hora'],
-                            errors='coerce'
-                        )
-                    else:
-                        # Si no hay columna hora, usamos solo la fecha
-                        operaciones['fecha_completa'] = operaciones['fecha']
-                except Exception as e:
-                    current_app.logger.error(f"Error procesando fechas: {str(e)}")
-                    # Creamos columnas vacías para evitar errores posteriores
-                    operaciones['fecha_completa'] = None
-            
+            with medicion.etapa('preparacion_fechas'):
+                self._preparar_fechas(operaciones, avanzado=True)
             fecha_actual = datetime.now().date()
 
             # Consolidar los rangos por afiliado
-            rangos_consolidados = {}
-            for _, row in rango_afiliados.iterrows():
-                afiliado = row['numero_afiliado']
-                if afiliado not in rangos_consolidados:
-                    rangos_consolidados[afiliado] = {
-                        'nombre_completo': row['nombre_completo'],
-                        'rangos': [],
-                        'recibe_en': set(),
-                        'envia_a': set()
-                    }
-                
-                rangos_consolidados[afiliado]['rangos'].append({
-                    'inicio': row['rango_inicio'],
-                    'fin': row['rango_fin']
-                })
-                
-                # Aseguramos que recibe_en y envia_a sean strings antes de añadirlos al set
-                if row['recibe_en']:
-                    rangos_consolidados[afiliado]['recibe_en'].add(str(row['recibe_en']))
-                if row['envia_a']:
-                    rangos_consolidados[afiliado]['envia_a'].add(str(row['envia_a']))
+            with medicion.etapa('consolidacion_rangos'):
+                rangos_consolidados = self._consolidar_rangos(rango_afiliados, avanzado=True)
+            with medicion.etapa('indices'):
+                indices = self.obtener_indices(operaciones)
+                indice_diversidad = indices.diversidad
+                indice_parejas = indices.parejas
+                patrones = indice_parejas.riesgos_patron()
+                linea_tiempo = indices.linea_tiempo
 
             # Verificamos que tengamos al menos dos afiliados para emparejar
             if len(rangos_consolidados) < 2:
                 current_app.logger.warning("Se necesitan al menos 2 afiliados para calcular emparejamientos")
                 return resultados
 
-            # Iterar sobre todas las posibles combinaciones de afiliados
+            # Sólo las parejas con canales compatibles cuyos rangos se superponen,
+            # con el rango efectivo ya ajustado al límite de Izipay y a los montos
+            # mínimo y máximo
+            with medicion.etapa('filtrado_parejas'):
+                candidatas = self.motor_vectorizado.parejas_candidatas(
+                    rangos_consolidados, avanzado=True, monto_minimo=monto_minimo,
+                    monto_maximo=monto_maximo
+                )
+            self._registrar_candidatas(estadisticas, candidatas)
+
+            medicion.iniciar('evaluacion')
             afiliados_list = list(rangos_consolidados.items())
-            for i, (num_afiliado1, info1) in enumerate(afiliados_list):
-                # Control de límite de combinaciones para evitar bucles infinitos
-                if total_parejas >= max_parejas_procesar:
-                    current_app.logger.warning(f"Se alcanzó el límite de {max_parejas_procesar} parejas a procesar")
+            construir_resultado = self._constructor_resultado_clasico(rangos_consolidados)
+            codigos = self.codificador.codificar(list(rangos_consolidados)).tolist()
+            for k, (i, j, inicio, fin) in enumerate(zip(
+                candidatas['i'].tolist(), candidatas['j'].tolist(),
+                candidatas['inicio'].tolist(), candidatas['fin'].tolist()
+            )):
+                if control is not None and control.agotado():
+                    self._agotar_presupuesto(estadisticas, len(candidatas['i']) - k, control)
                     break
-                    
-                for num_afiliado2, info2 in afiliados_list[i+1:]:
-                    total_parejas += 1
-                    
-                    # Control de límite por pareja
-                    if total_parejas >= max_parejas_procesar:
-                        break
-                    
-                    # Evitar auto-emparejamientos
-                    if num_afiliado1 == num_afiliado2:
-                        parejas_filtradas += 1
-                        continue
 
-                    # Calcular el rango efectivo con manejo de errores
-                    try:
-                        rango_efectivo = self._calcular_rango_efectivo(info1['rangos'], info2['rangos'])
-                        if not rango_efectivo:
-                            parejas_filtradas += 1
+                num_afiliado1, info1 = afiliados_list[i]
+                num_afiliado2, info2 = afiliados_list[j]
+                codigo1, codigo2 = codigos[i], codigos[j]
+                rango_efectivo = {'inicio': inicio, 'fin': fin}
+
+                # Obtener el historial de operaciones entre la pareja
+                posicion = indice_parejas.posicion(codigo1, codigo2)
+                historial = indice_parejas.en(posicion) if posicion is not None else None
+
+                # Verificar el tiempo transcurrido desde la última operación
+                dias_desde_ultima = float('inf')  # Sin operaciones previas
+                try:
+                    # La última fecha ignora fechas inválidas (NaT)
+                    if historial is not None and pd.notnull(historial.ultima_fecha):
+                        dias_desde_ultima = (fecha_actual - historial.ultima_fecha.date()).days
+                        
+                        # Filtrar por días mínimos
+                        if dias_desde_ultima < dias_minimos:
+                            estadisticas['descartadas']['dias_minimos'] += 1
                             continue
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando rango efectivo para {num_afiliado1}-{num_afiliado2}: {str(e)}")
-                        parejas_filtradas += 1
-                        continue
+                except Exception as e:
+                    current_app.logger.error(f"Error calculando días desde última operación: {str(e)}")
+                    dias_desde_ultima = float('inf')
 
-                    # Ajustar el rango máximo para Izipay (límite de 800)
-                    recibe_izipay = False
-                    try:
-                        if 'Izipay' in info1.get('recibe_en', set()) or 'Ambos' in info1.get('recibe_en', set()) or \
-                        'Izipay' in info2.get('recibe_en', set()) or 'Ambos' in info2.get('recibe_en', set()):
-                            recibe_izipay = True
-                            rango_efectivo['fin'] = min(rango_efectivo['fin'], 800)
-                    except Exception as e:
-                        current_app.logger.error(f"Error verificando Izipay para {num_afiliado1}-{num_afiliado2}: {str(e)}")
-                    
-                    # Aplicar filtros de monto al rango efectivo
-                    if monto_minimo and monto_minimo > 0:
-                        rango_efectivo['inicio'] = max(rango_efectivo['inicio'], monto_minimo)
-                    if monto_maximo and monto_maximo > 0:
-                        rango_efectivo['fin'] = min(rango_efectivo['fin'], monto_maximo)
-
-                    if rango_efectivo['fin'] <= rango_efectivo['inicio']:
-                        parejas_filtradas += 1
-                        continue
+                # Calcular métricas con manejo seguro de errores
+                try:
+                    diversidad_1 = indice_diversidad.obtener(codigo1)
+                    diversidad_2 = indice_diversidad.obtener(codigo2)
+                    diversidad_minima = min(diversidad_1, diversidad_2)
+                    afiliado_menor_diversidad = num_afiliado1 if diversidad_1 < diversidad_2 else num_afiliado2
+                except Exception as e:
+                    current_app.logger.error(f"Error calculando diversidad: {str(e)}")
+                    diversidad_minima = 0
+                    afiliado_menor_diversidad = num_afiliado1
+                
+                try:
+                    operaciones_minimas, codigo_menor_ops = self._calcular_total_operaciones(
+                        linea_tiempo, 
+                        codigo1, 
+                        codigo2,
+                        historial
+                    )
+                    afiliado_menor_ops = num_afiliado1 if codigo_menor_ops == codigo1 else num_afiliado2
+                except Exception as e:
+                    current_app.logger.error(f"Error calculando total operaciones: {str(e)}")
+                    operaciones_minimas = 0
+                    afiliado_menor_ops = num_afiliado1
+                
+                # Análisis de patrones de comportamiento, precalculado para todas
+                # las parejas (riesgo_patron_parejas)
+                patron_riesgo = float(patrones[posicion]) if posicion is not None else 50
 
-                    # Obtener el historial de operaciones entre la pareja con manejo de errores
-                    try:
-                        if not operaciones.empty:
-                            operaciones_pareja = operaciones[
-                                ((operaciones['nombre1'] == num_afiliado1) & (operaciones['nombre2'] == num_afiliado2)) |
-                                ((operaciones['nombre1'] == num_afiliado2) & (operaciones['nombre2'] == num_afiliado1))
-                            ]
-                        else:
-                            operaciones_pareja = pd.DataFrame()
-                    except Exception as e:
-                        current_app.logger.error(f"Error filtrando operaciones para {num_afiliado1}-{num_afiliado2}: {str(e)}")
-                        operaciones_pareja = pd.DataFrame()
-
-                    # Verificar el tiempo transcurrido desde la última operación
-                    dias_desde_ultima = float('inf')  # Sin operaciones previas
-                    try:
-                        if not operaciones_pareja.empty and 'fecha' in operaciones_pareja.columns:
-                            # Asegurar que tengamos fechas válidas
-                            fechas_validas = operaciones_pareja['fecha'].dropna()
-                            if not fechas_validas.empty:
-                                ultima_operacion = fechas_validas.max()
-                                if pd.notnull(ultima_operacion):
-                                    dias_desde_ultima = (fecha_actual - ultima_operacion.date()).days
-                                    
-                                    # Filtrar por días mínimos
-                                    if dias_desde_ultima < dias_minimos:
-                                        parejas_filtradas += 1
-                                        continue
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando días desde última operación: {str(e)}")
-                        dias_desde_ultima = float('inf')
-
-                    # Calcular métricas con manejo seguro de errores
-                    try:
-                        diversidad_1 = self._calcular_diversidad(operaciones, num_afiliado1)
-                        diversidad_2 = self._calcular_diversidad(operaciones, num_afiliado2)
-                        diversidad_minima = min(diversidad_1, diversidad_2)
-                        afiliado_menor_diversidad = num_afiliado1 if diversidad_1 < diversidad_2 else num_afiliado2
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando diversidad: {str(e)}")
-                        diversidad_minima = 0
-                        afiliado_menor_diversidad = num_afiliado1
-                    
-                    try:
-                        operaciones_minimas, afiliado_menor_ops = self._calcular_total_operaciones(
-                            operaciones, 
-                            num_afiliado1, 
-                            num_afiliado2
-                        )
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando total operaciones: {str(e)}")
-                        operaciones_minimas = 0
-                        afiliado_menor_ops = num_afiliado1
-                    
-                    # Análisis de patrones de comportamiento con manejo de errores
-                    try:
-                        patron_riesgo = self._evaluar_patron_operaciones({
-                            'historial_operaciones': operaciones_pareja.to_dict('records') if not operaciones_pareja.empty else [],
-                            'afiliado1': num_afiliado1,
-                            'afiliado2': num_afiliado2
-                        })
-                    except Exception as e:
-                        current_app.logger.error(f"Error evaluando patrón: {str(e)}")
-                        patron_riesgo = 50  # Valor neutral por defecto
-
-                    # Calcular riesgo con algoritmo avanzado
-                    try:
-                        riesgo = self._calcular_riesgo_mejorado(
-                            {
-                                'dias_desde_ultima': dias_desde_ultima if dias_desde_ultima != float('inf') else 1000,
-                                'diversidad_minima': diversidad_minima,
-                                'operaciones_intermedias': operaciones_minimas,
-                                'patron_riesgo': patron_riesgo,
-                                'historial_operaciones': operaciones_pareja.to_dict('records') if not operaciones_pareja.empty else []
-                            },
-                            {
-                                'ponderacion_dias': ponderaciones.get('dias', 0.4),
-                                'ponderacion_diversidad': ponderaciones.get('diversidad', 0.25),
-                                'ponderacion_operaciones': ponderaciones.get('operaciones', 0.25),
-                                'ponderacion_patron': ponderaciones.get('patron', 0.1)
-                            }
-                        )
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando riesgo: {str(e)}")
-                        riesgo = 100  # Valor de máximo riesgo por defecto
-
-                    # Filtrar por riesgo máximo
-                    if riesgo > riesgo_maximo:
-                        parejas_filtradas += 1
-                        continue
+                # Calcular riesgo con algoritmo avanzado
+                try:
+                    riesgo = self._calcular_riesgo_mejorado(
+                        {
+                            'dias_desde_ultima': dias_desde_ultima if dias_desde_ultima != float('inf') else 1000,
+                            'diversidad_minima': diversidad_minima,
+                            'operaciones_intermedias': operaciones_minimas,
+                            'patron_riesgo': patron_riesgo
+                        },
+                        {
+                            'ponderacion_dias': ponderaciones.get('dias', 0.4),
+                            'ponderacion_diversidad': ponderaciones.get('diversidad', 0.25),
+                            'ponderacion_operaciones': ponderaciones.get('operaciones', 0.25),
+                            'ponderacion_patron': ponderaciones.get('patron', 0.1)
+                        }
+                    )
+                except Exception as e:
+                    current_app.logger.error(f"Error calculando riesgo: {str(e)}")
+                    riesgo = 100  # Valor de máximo riesgo por defecto
+                estadisticas['evaluadas'] += 1
 
-                    # Calcular monto sugerido mejorado con manejo de errores
-                    try:
-                        monto_sugerido = self._calcular_monto_sugerido_mejorado(
-                            operaciones_pareja, 
-                            rango_efectivo['inicio'], 
-                            rango_efectivo['fin'],
-                            patron_riesgo
-                        )
-                        
-                        # Si no se pudo calcular un monto sugerido, usar el método tradicional
-                        if monto_sugerido is None:
-                            monto_sugerido = self._calcular_monto_sugerido(
-                                operaciones_pareja, 
-                                rango_efectivo['inicio'], 
-                                rango_efectivo['fin']
-                            )
-                            
-                        # Si aún es None, usar un valor por defecto dentro del rango
-                        if monto_sugerido is None:
-                            monto_sugerido = (rango_efectivo['inicio'] + rango_efectivo['fin']) / 2
-                    except Exception as e:
-                        current_app.logger.error(f"Error calculando monto sugerido: {str(e)}")
-                        # Usar promedio del rango como fallback
-                        monto_sugerido = (rango_efectivo['inicio'] + rango_efectivo['fin']) / 2
-
-                    # Formatear el valor de días desde la última operación para la visualización
-                    dias_display = dias_desde_ultima
-                    if dias_desde_ultima == float('inf'):
-                        dias_display = "Sin operaciones previas"
-
-                    # Agregar emparejamiento a resultados
-                    resultados.append({
-                        "afiliado1": info1['nombre_completo'],
-                        "afiliado2": info2['nombre_completo'],
-                        "dias_desde_ultima": dias_display,
-                        "diversidad_minima": f"{diversidad_minima} ({rangos_consolidados[afiliado_menor_diversidad]['nombre_completo']})",
-                        "operaciones_intermedias_minimas": f"{operaciones_minimas} ({rangos_consolidados[afiliado_menor_ops]['nombre_completo']})",
-                        "monto_asignado": monto_sugerido,
-                        "riesgo": round(riesgo, 2),
-                        "pareja": [num_afiliado1, num_afiliado2]
-                    })
+                # Filtrar por riesgo máximo
+                if riesgo > riesgo_maximo:
+                    estadisticas['descartadas']['riesgo_maximo'] += 1
+                    continue
 
-            # Ordenar por nivel de riesgo
-            resultados.sort(key=lambda x: x['riesgo'])
+                # Calcular monto sugerido mejorado con manejo de errores
+                monto_sugerido = generador.sugerir(
+                    [rango_efectivo['inicio']],
+                    [rango_efectivo['fin']],
+                    [historial.montos if historial else []],
+                    [patron_riesgo]
+                )[0]
+
+                # Ofrecer el emparejamiento a la selección top-K (el resultado
+                # se construye sólo si queda seleccionado)
+                seleccion.agregar_pareja(
+                    (num_afiliado1, num_afiliado2), round(riesgo, 2), monto_sugerido,
+                    self._datos_resultado_clasico(
+                        dias_desde_ultima, diversidad_minima, afiliado_menor_diversidad == num_afiliado2,
+                        operaciones_minimas, afiliado_menor_ops == num_afiliado2
+                    ),
+                    construir_resultado
+                )
+
+            medicion.terminar('evaluacion')
+
+            # Resultados conservados, ordenados por nivel de riesgo
+            with medicion.etapa('serializacion'):
+                resultados = seleccion.resultados()
             
-            current_app.logger.info(f"Emparejamiento completado: {len(resultados)} resultados de {total_parejas} combinaciones posibles")
+            current_app.logger.info(f"Emparejamiento completado: {seleccion.total} resultados de {estadisticas['combinaciones']} combinaciones posibles")
 
         except Exception as e:
             current_app.logger.error(f"Error general en evaluación de emparejamientos: {str(e)}")
@@ -688,63 +1219,391 @@ class EmparejamientoService(BaseService):
 
         return resultados
 
-    def _calcular_diversidad(self, operaciones, afiliado):
-        """Calcula la diversidad de contrapartes para un afiliado"""
-        if operaciones.empty:
-            return 0
-            
-        ops_afiliado = operaciones[
-            (operaciones['nombre1'] == afiliado) | 
-            (operaciones['nombre2'] == afiliado)
-        ]
-        
-        if ops_afiliado.empty:
-            return 0
+    @staticmethod
+    def _procesos_paralelos():
+        """Procesos del motor paralelo (EMPAREJADOR_PROCESOS; 0 = todos los núcleos)"""
+        procesos = int(current_app.config.get('EMPAREJADOR_PROCESOS') or 0)
+        return procesos if procesos > 0 else (os.cpu_count() or 1)
+
+    @staticmethod
+    def _paginacion(filtros):
+        """Valida limite (None = todos) y offset de la página de resultados"""
+        limite = filtros.get('limite', 1000)
+        offset = filtros.get('offset', 0) or 0
+        try:
+            limite = int(limite) if limite is not None else None
+            offset = int(offset)
+        except (TypeError, ValueError):
+            raise ValidationError("limite y offset deben ser números enteros")
+        if (limite is not None and limite < 1) or offset < 0:
+            raise ValidationError("limite debe ser mayor que 0 y offset no negativo")
+        return limite, offset
+
+    @staticmethod
+    def _semilla(semilla):
+        """Valida la semilla de los montos sugeridos (None = no reproducible)"""
+        if semilla is None:
+            return None
+        try:
+            semilla = int(semilla)
+        except (TypeError, ValueError):
+            raise ValidationError("semilla debe ser un número entero")
+        if semilla < 0:
+            raise ValidationError("semilla no puede ser negativa")
+        return semilla
+
+    @staticmethod
+    def _ventana_dias(ventana_dias):
+        """
+        Valida la ventana de días de historial (None = EMPAREJADOR_VENTANA_DIAS,
+        0 = todo el historial)
+        """
+        if ventana_dias is None:
+            ventana_dias = current_app.config.get('EMPAREJADOR_VENTANA_DIAS', 0)
+        try:
+            ventana_dias = int(ventana_dias)
+        except (TypeError, ValueError):
+            raise ValidationError("ventana_dias debe ser un número entero")
+        if ventana_dias < 0:
+            raise ValidationError("ventana_dias no puede ser negativo")
+        return ventana_dias
+
+    @staticmethod
+    def _nuevas_estadisticas(presupuesto_segundos=None):
+        """
+        Conteos de la evaluación que acompañan a la respuesta.
+
+        combinaciones = descartadas (sin_superposicion + canal_incompatible
+                        + rango_invalido + dias_minimos) + evaluadas + sin_evaluar
+        Las descartadas por riesgo_maximo y monto_asignado salen de las evaluadas.
+        """
+        return {
+            'combinaciones': 0,
+            'evaluadas': 0,
+            'sin_evaluar': 0,
+            'completo': True,
+            'cancelado': False,
+            'presupuesto_segundos': presupuesto_segundos,
+            'ventana': None,
+            'descartadas': {
+                'sin_superposicion': 0,
+                'canal_incompatible': 0,
+                'rango_invalido': 0,
+                'dias_minimos': 0,
+                'riesgo_maximo': 0,
+                'monto_asignado': 0
+            }
+        }
+
+    @staticmethod
+    def _registrar_candidatas(estadisticas, candidatas):
+        """Suma los descartes de la etapa de rangos (parejas_candidatas)"""
+        estadisticas['combinaciones'] += candidatas['total']
+        estadisticas['descartadas']['sin_superposicion'] += candidatas['sin_superposicion']
+        estadisticas['descartadas']['canal_incompatible'] += candidatas['canal_incompatible']
+        estadisticas['descartadas']['rango_invalido'] += candidatas['rango_invalido']
+
+    @staticmethod
+    def _agotar_presupuesto(estadisticas, pendientes, control=None):
+        """Marca la evaluación como incompleta por falta de tiempo o cancelación"""
+        estadisticas['sin_evaluar'] += pendientes
+        estadisticas['completo'] = False
+        if control is not None and control.cancelado:
+            estadisticas['cancelado'] = True
+            current_app.logger.info(f"Cálculo cancelado: {pendientes} parejas sin evaluar")
+            return
+        current_app.logger.warning(
+            f"Presupuesto de tiempo agotado: {pendientes} parejas sin evaluar"
+        )
+
+    def _preparar_fechas(self, operaciones, avanzado=False):
+        """
+        Normaliza las columnas fecha/hora y agrega 'fecha_completa' in-place.
+
+        El modo avanzado tolera fechas u horas inválidas (quedan como NaT);
+        el modo estándar propaga el error. Las operaciones de
+        cargar_operaciones ya traen 'fecha_completa' y no se modifican.
+        """
+        if 'fecha_completa' in operaciones.columns:
+            return operaciones
+
+        if not avanzado:
+            operaciones['fecha'] = pd.to_datetime(operaciones['fecha'])
+            if not operaciones.empty and 'hora' in operaciones.columns:
+                operaciones['hora'] = operaciones['hora'].apply(
+                    lambda x: str(x) + ':00' if len(str(x).split(':')) == 2 else str(x)
+                )
+                operaciones['fecha_completa'] = pd.to_datetime(
+                    operaciones['fecha'].dt.strftime('%Y-%m-%d') + ' ' + operaciones['hora']
+                )
+            return operaciones
+
+        if not operaciones.empty:
+            try:
+                operaciones['fecha'] = pd.to_datetime(operaciones['fecha'], errors='coerce')
+                
+                if 'hora' in operaciones.columns:
+                    # Aseguramos formato consistente para la hora
+                    operaciones['hora'] = operaciones['hora'].apply(
+                        lambda x: str(x) + ':00' if x and len(str(x).split(':')) == 2 else str(x) if x else '00:00:00'
+                    )
+                    
+                    # Combinamos fecha y hora
+                    operaciones['fecha_completa'] = pd.to_datetime(
+                        operaciones['fecha'].dt.strftime('%Y-%m-%d') + ' ' + operaciones['hora'],
+                        errors='coerce'
+                    )
+                else:
+                    # Si no hay columna hora, usamos solo la fecha
+                    operaciones['fecha_completa'] = operaciones['fecha']
+            except Exception as e:
+                current_app.logger.error(f"Error procesando fechas: {str(e)}")
+                # Creamos columnas vacías para evitar errores posteriores
+                operaciones['fecha_completa'] = None
+        return operaciones
+
+    def _consolidar_rangos(self, rango_afiliados, avanzado=False):
+        """
+        Agrupa los rangos por afiliado conservando el orden de aparición.
+
+        Returns:
+            dict: numero_afiliado -> {nombre_completo, rangos, recibe_en, envia_a}
+        """
+        rangos_consolidados = {}
+        for _, row in rango_afiliados.iterrows():
+            afiliado = row['numero_afiliado']
+            if afiliado not in rangos_consolidados:
+                rangos_consolidados[afiliado] = {
+                    'nombre_completo': row['nombre_completo'],
+                    'rangos': [],
+                    'recibe_en': set(),
+                    'envia_a': set()
+                }
             
-        contrapartes = set()
-        for _, op in ops_afiliado.iterrows():
-            contrapartes.add(op['nombre2'] if op['nombre1'] == afiliado else op['nombre1'])
+            rangos_consolidados[afiliado]['rangos'].append({
+                'inicio': row['rango_inicio'],
+                'fin': row['rango_fin']
+            })
             
-        return len(contrapartes)
+            if not avanzado:
+                rangos_consolidados[afiliado]['recibe_en'].add(row['recibe_en'])
+                rangos_consolidados[afiliado]['envia_a'].add(row['envia_a'])
+                continue
+            
+            # Aseguramos que recibe_en y envia_a sean strings antes de añadirlos al set
+            if row['recibe_en']:
+                rangos_consolidados[afiliado]['recibe_en'].add(str(row['recibe_en']))
+            if row['envia_a']:
+                rangos_consolidados[afiliado]['envia_a'].add(str(row['envia_a']))
+        return rangos_consolidados
+
+    @staticmethod
+    def _version_indices(operaciones):
+        """
+        Versión con la que se guardan los índices: la de la tabla de
+        operaciones y, si se cargó una ventana de días, también su inicio
+        (los índices de una ventana no sirven para otra ni para el historial
+        completo, y no se actualizan incrementalmente). Para las operaciones
+        de _cargar_operaciones es la versión leída antes de cargarlas, así
+        una escritura concurrente no queda bajo una versión que no incluye.
+        """
+        version = operaciones.attrs.get('version')
+        if version is None:
+            version = version_datos.version('operaciones')
+        desde = operaciones.attrs.get('desde')
+        return version if desde is None else (version, desde)
+
+    def _cargar_operaciones(self, desde=None):
+        """
+        Operaciones del cálculo. Con EMPAREJADOR_INSTANTANEA_DIR se leen de la
+        instantánea en disco (mmap) mientras esté al día, recortando la
+        ventana sobre sus arreglos. Si no lo está, un pedido con ventana lee
+        sólo la ventana de la base (la instantánea, que es de toda la tabla,
+        se rehace en el próximo pedido sin ventana o en la próxima carga) y
+        uno sin ventana lee la tabla completa y reescribe la instantánea. Sin
+        directorio se lee la base con la ventana en la consulta.
+        """
+        version = version_datos.version('operaciones')
+        directorio = current_app.config.get('EMPAREJADOR_INSTANTANEA_DIR')
+        columnas = None
+        if directorio:
+            self.instantanea.configurar(directorio)
+            columnas = self.instantanea.vigente(version, self.codificador)
+            if columnas is None and desde is None:
+                operaciones = self._codificar_operaciones(cargar_operaciones())
+                columnas = columnas_de(operaciones)
+                try:
+                    self.instantanea.escribir(columnas, self.codificador, version)
+                except OSError as e:
+                    current_app.logger.error(f"Error escribiendo la instantánea de operaciones: {str(e)}")
+
+        if columnas is None:
+            operaciones = cargar_operaciones(desde=desde)
+        else:
+            operaciones = operaciones_de(columnas, desde)
+        operaciones.attrs['version'] = version
+        return operaciones
+
+    def _codificar_operaciones(self, operaciones):
+        """
+        Agrega in-place los códigos int32 de nombre1/nombre2 (codigo1, codigo2).
+
+        Los arreglos de códigos de una carga de cargar_operaciones (filas en
+        orden de id) se guardan por versión de los datos y ventana, así una
+        nueva carga de la misma versión no vuelve a codificar los números.
+        """
+        if 'codigo1' in operaciones.columns:
+            return operaciones
+
+        cargada = 'desde' in operaciones.attrs
+        clave = (self._version_indices(operaciones), len(operaciones))
+        guardados = self._codigos_operaciones
+        if cargada and guardados is not None and guardados[0] == clave:
+            codigo1, codigo2 = guardados[1]
+        else:
+            codigo1, codigo2 = self.codificador.columnas(operaciones)
+            if cargada:
+                self._codigos_operaciones = (clave, (codigo1, codigo2))
+        operaciones['codigo1'] = codigo1
+        operaciones['codigo2'] = codigo2
+        return operaciones
+
+    def obtener_indices(self, operaciones):
+        """
+        Índices (IndicesOperaciones) de 'operaciones', que debe venir preparado
+        con _preparar_fechas (usan fecha y fecha_completa).
+
+        Cada conjunto se arma completo y recién entonces se publica en
+        cache_indices bajo su versión (la de los datos y la ventana), así que
+        un cálculo nunca ve índices a medio construir ni los de otra ventana,
+        y alternar ventanas no obliga a reconstruirlos. Los conjuntos
+        publicados no se modifican: el lock sólo evita que dos cálculos
+        construyan a la vez el mismo.
+        """
+        version = self._version_indices(operaciones)
+        self.cache_indices.tamano_maximo = current_app.config.get('EMPAREJADOR_CACHE_INDICES', 2)
+        indices = self.cache_indices.obtener(version)
+        if indices is not None:
+            return indices
+
+        with self._lock_indices:
+            indices = self.cache_indices.obtener(version)
+            if indices is None:
+                self._codificar_operaciones(operaciones)
+                indices = IndicesOperaciones(
+                    version,
+                    IndiceDiversidad(self.codificador).construir(operaciones, version),
+                    IndiceParejas(self.codificador).construir(operaciones, version),
+                    LineaTiempoAfiliados(self.codificador).construir(operaciones, version),
+                )
+                self.cache_indices.guardar(version, indices)
+        return indices
+
+    def registrar_operaciones(self, nuevas, version_previa, version):
+        """
+        Actualiza incrementalmente los índices tras insertar operaciones: si
+        los del historial completo estaban al día con version_previa, publica
+        bajo 'version' un conjunto nuevo con las filas agregadas a copias de
+        ellos (los cálculos que usan el anterior no se ven afectados).
+
+        Args:
+            nuevas: DataFrame (fecha, hora, nombre1, nombre2, monto) de las filas insertadas
+            version_previa: versión de 'operaciones' antes de la inserción; los
+                índices que no estaban al día en ese punto se dejan para reconstruir
+            version: versión que dejó la inserción (leída antes del commit, así
+                no incluye escrituras posteriores de otros procesos)
+        """
+        if nuevas.empty:
+            return
+
+        self._codificar_operaciones(nuevas)
+        with self._lock_indices:
+            previos = self.cache_indices.obtener(version_previa)
+            if previos is not None:
+                self._preparar_fechas(nuevas, avanzado=True)
+                self.cache_indices.guardar(version, IndicesOperaciones(
+                    version,
+                    previos.diversidad.copia().agregar(nuevas, version),
+                    previos.parejas.copia().agregar(nuevas, version),
+                    previos.linea_tiempo.copia().agregar(nuevas, version),
+                ))
+
+        self._refrescar_instantanea(nuevas, version_previa, version)
+
+    def _refrescar_instantanea(self, nuevas, version_previa, version):
+        """
+        Tras una carga de operaciones, agrega las filas nuevas a la instantánea
+        si estaba al día o la reescribe desde la tabla si no lo estaba
+        """
+        directorio = current_app.config.get('EMPAREJADOR_INSTANTANEA_DIR')
+        if not directorio:
+            return
+        self.instantanea.configurar(directorio)
+        try:
+            if self.instantanea.vigente(version_previa, self.codificador) is not None:
+                self._preparar_fechas(nuevas, avanzado=True)
+                self.instantanea.agregar(columnas_de(nuevas), self.codificador, version)
+                return
+            operaciones = self._codificar_operaciones(cargar_operaciones())
+            self.instantanea.escribir(columnas_de(operaciones), self.codificador, version)
+        except OSError as e:
+            current_app.logger.error(f"Error actualizando la instantánea de operaciones: {str(e)}")
     
-    def _calcular_total_operaciones(self, operaciones, afiliado1, afiliado2):
-        """Calcula el número de operaciones desde la última operación mutua"""
-        if operaciones.empty:
-            return 0, afiliado1
-            
-        # Encontrar última operación entre ambos afiliados
-        ops_mutuas = operaciones[
-            ((operaciones['nombre1'] == afiliado1) & (operaciones['nombre2'] == afiliado2)) |
-            ((operaciones['nombre1'] == afiliado2) & (operaciones['nombre2'] == afiliado1))
-        ]
-        
-        if ops_mutuas.empty:
+    @staticmethod
+    def _datos_resultado_clasico(dias_desde_ultima, diversidad_minima, menor_diversidad_es_2,
+                                 operaciones_minimas, menor_ops_es_2):
+        """
+        Datos enteros de un resultado del motor clásico para la selección
+        (días -1 si no hubo operaciones previas)
+        """
+        return (
+            -1 if dias_desde_ultima == float('inf') else int(dias_desde_ultima),
+            int(diversidad_minima), int(menor_diversidad_es_2),
+            int(operaciones_minimas), int(menor_ops_es_2),
+        )
+
+    @staticmethod
+    def _constructor_resultado_clasico(rangos_consolidados):
+        """
+        Función que arma un resultado del motor clásico a partir de la pareja,
+        el riesgo, el monto y los datos de _datos_resultado_clasico
+        """
+        def construir(pareja, riesgo, monto, datos):
+            dias, diversidad_minima, menor_diversidad, operaciones_minimas, menor_ops = datos
+            nombre1 = rangos_consolidados[pareja[0]]['nombre_completo']
+            nombre2 = rangos_consolidados[pareja[1]]['nombre_completo']
+            return {
+                "afiliado1": nombre1,
+                "afiliado2": nombre2,
+                "dias_desde_ultima": dias if dias >= 0 else "Sin operaciones previas",
+                "diversidad_minima": f"{diversidad_minima} ({nombre2 if menor_diversidad else nombre1})",
+                "operaciones_intermedias_minimas": f"{operaciones_minimas} ({nombre2 if menor_ops else nombre1})",
+                "monto_asignado": monto,
+                "riesgo": riesgo,
+                "pareja": list(pareja)
+            }
+        return construir
+
+    def _calcular_total_operaciones(self, linea_tiempo, afiliado1, afiliado2, historial=None):
+        """
+        Calcula el número de operaciones desde la última operación mutua
+
+        Args:
+            linea_tiempo: LineaTiempoAfiliados vigente
+            afiliado1, afiliado2: códigos (CodificadorNumeros) de los afiliados;
+                se devuelve el del que tiene menos operaciones
+            historial: HistorialPareja de la pareja (None si nunca operaron juntos)
+        """
+        if historial is None:
             # Si no hay operaciones mutuas previas, contar todas
-            ops_a1 = len(operaciones[
-                (operaciones['nombre1'] == afiliado1) | 
-                (operaciones['nombre2'] == afiliado1)
-            ])
-            ops_a2 = len(operaciones[
-                (operaciones['nombre1'] == afiliado2) | 
-                (operaciones['nombre2'] == afiliado2)
-            ])
+            ops_a1 = linea_tiempo.total(afiliado1)
+            ops_a2 = linea_tiempo.total(afiliado2)
         else:
-            # Usar fecha_completa para comparación
-            ultima_op_mutua = ops_mutuas['fecha_completa'].max()
-            
-            # Operaciones posteriores
-            ops_posteriores = operaciones[operaciones['fecha_completa'] > ultima_op_mutua]
-            
-            ops_a1 = len(ops_posteriores[
-                (ops_posteriores['nombre1'] == afiliado1) | 
-                (ops_posteriores['nombre2'] == afiliado1)
-            ])
-            
-            ops_a2 = len(ops_posteriores[
-                (ops_posteriores['nombre1'] == afiliado2) | 
-                (ops_posteriores['nombre2'] == afiliado2)
-            ])
-        
+            # Operaciones posteriores a la última mutua (búsqueda binaria)
+            ultima_op_mutua = historial.ultima_completa
+            ops_a1 = linea_tiempo.contar_desde(afiliado1, ultima_op_mutua)
+            ops_a2 = linea_tiempo.contar_desde(afiliado2, ultima_op_mutua)
+
         # Determinar cuál tiene menos operaciones
         if ops_a1 <= ops_a2:
             return ops_a1, afiliado1
@@ -841,260 +1700,6 @@ class EmparejamientoService(BaseService):
             current_app.logger.error(f"Error en _calcular_riesgo_mejorado: {str(e)}")
             return 50  # Valor neutral por defecto en caso de error
 
-    def _evaluar_patron_operaciones(self, datos_pareja):
-        """
-        Analiza patrones en las operaciones para detectar comportamientos inusuales
-        """
-        try:
-            # Verificar que tengamos datos válidos
-            historial = datos_pareja.get('historial_operaciones', [])
-            
-            if not historial or len(historial) < 2:
-                return 50  # Valor neutro para historial escaso
-            
-            # Extraer montos válidos del historial
-            montos = []
-            for op in historial:
-                if isinstance(op, dict) and 'monto' in op:
-                    monto = op.get('monto')
-                    if monto is not None and isinstance(monto, (int, float)) and monto > 0:
-                        montos.append(monto)
-            
-            # Si no hay suficientes montos válidos, retornar valor neutro
-            if len(montos) < 2:
-                return 50
-                
-            # Analizar regularidad de montos (desviación estándar)
-            media = sum(montos) / len(montos)
-            if media <= 0:
-                return 50
-                
-            # Calcular varianza y desviación estándar
-            varianza = sum((x - media) ** 2 for x in montos) / len(montos)
-            desviacion = varianza ** 0.5
-                
-            # Calcular coeficiente de variación (menor variación = más sospechoso)
-            coef_var = desviacion / media
-            
-            # Invertir para obtener riesgo (menor variación = mayor riesgo)
-            riesgo_variacion = 100 * (1 - min(1, coef_var))
-                
-            # Analizar regularidad temporal
-            riesgo_temporal = self._analizar_regularidad_temporal(historial)
-                
-            # Combinar indicadores
-            return (riesgo_variacion * 0.6) + (riesgo_temporal * 0.4)
-        except Exception as e:
-            current_app.logger.error(f"Error en _evaluar_patron_operaciones: {str(e)}")
-            # En caso de error, devolver valor neutro
-            return 50
-
-    def _analizar_regularidad_temporal(self, historial):
-        """
-        Analiza la regularidad temporal de las operaciones
-        Operaciones muy regulares pueden indicar comportamiento sospechoso
-        """
-        try:
-            # Verificar datos de entrada
-            if not historial or len(historial) < 2:
-                return 50
-                
-            # Convertir fechas a objetos datetime
-            import datetime
-            fechas = []
-            
-            for op in historial:
-                if not isinstance(op, dict) or 'fecha' not in op:
-                    continue
-                    
-                fecha_str = op.get('fecha')
-                if not fecha_str:
-                    continue
-                    
-                # Procesar según el tipo de dato
-                try:
-                    if isinstance(fecha_str, datetime.date):
-                        fechas.append(datetime.datetime.combine(fecha_str, datetime.datetime.min.time()))
-                    elif isinstance(fecha_str, str):
-                        for fmt in ['%Y-%m-%d', '%d/%m/%Y']:
-                            try:
-                                fecha = datetime.datetime.strptime(fecha_str, fmt)
-                                fechas.append(fecha)
-                                break
-                            except ValueError:
-                                continue
-                except Exception:
-                    # Ignorar fechas que no se pueden procesar
-                    pass
-            
-            # Si no hay suficientes fechas válidas, retornar valor neutro
-            if len(fechas) < 2:
-                return 50
-            
-            # Ordenar fechas
-            fechas.sort()
-            
-            # Calcular diferencias entre fechas consecutivas (en días)
-            diferencias = []
-            for i in range(len(fechas) - 1):
-                if fechas[i+1] > fechas[i]:  # Asegurar que la diferencia es positiva
-                    diferencias.append((fechas[i+1] - fechas[i]).days)
-            
-            # Si no hay suficientes diferencias válidas, retornar valor neutro
-            if not diferencias:
-                return 50
-                
-            # Calcular estadísticas de las diferencias
-            media_dif = sum(diferencias) / len(diferencias)
-            if media_dif <= 0:
-                return 50
-                
-            # Calcular varianza y desviación estándar
-            varianza_dif = sum((x - media_dif) ** 2 for x in diferencias) / len(diferencias)
-            desviacion_dif = varianza_dif ** 0.5
-                
-            # Calcular coeficiente de variación temporal
-            coef_var_temp = desviacion_dif / media_dif
-                
-            # Menor variación temporal = mayor riesgo (más regular = más sospechoso)
-            # Dividir por 2 para ser menos estricto
-            return 100 * (1 - min(1, coef_var_temp / 2))
-        
-        except Exception as e:
-            current_app.logger.error(f"Error en _analizar_regularidad_temporal: {str(e)}")
-            return 50  # Valor neutro en caso de error
-
-    def _calcular_monto_sugerido(self, operaciones_pareja, rango_inicio, rango_fin, montos_excluir=None):
-        """Calcula monto sugerido para una operación"""
-        montos_excluir = montos_excluir or set()
-        if not isinstance(montos_excluir, set):
-            montos_excluir = set(montos_excluir)
-
-        # Dividir el rango en tercios para priorizar montos más altos
-        rango_size = rango_fin - rango_inicio
-        tercio = rango_size / 3
-
-        # Si el rango comienza en 0, priorizamos el último tercio
-        if rango_inicio == 0:
-            rango_inicio = max(rango_inicio, rango_fin - tercio)
-        
-        # Generamos puntos en el rango
-        num_puntos = min(50, int(rango_size))
-        montos_posibles = []
-        
-        # Distribuir con preferencia por valores más altos
-        for i in range(num_puntos):
-            factor = (i / num_puntos) ** 0.5  # Favorece valores altos
-            monto = rango_inicio + (rango_fin - rango_inicio) * factor
-            monto_redondeado = round(monto)
-            if monto_redondeado not in montos_excluir:
-                montos_posibles.append(monto_redondeado)
-
-        if not montos_posibles:
-            return None
-
-        # Usar weights que favorecen montos más altos
-        weights = [i + 1 for i in range(len(montos_posibles))]
-        return random.choices(montos_posibles, weights=weights, k=1)[0]
-    
-    def _calcular_monto_sugerido_mejorado(self, operaciones_pareja, rango_inicio, rango_fin, factor_riesgo=50, montos_excluir=None):
-        """
-        Versión mejorada del cálculo de monto sugerido que tiene en cuenta el historial y el factor de riesgo
-        """
-        montos_excluir = montos_excluir or set()
-        if not isinstance(montos_excluir, set):
-            montos_excluir = set(montos_excluir)
-        
-        rango_size = rango_fin - rango_inicio
-        
-        # Si hay historial de operaciones, considerar los montos previos
-        if not operaciones_pareja.empty:
-            # Obtener montos previos
-            montos_previos = operaciones_pareja['monto'].tolist()
-            
-            # Calcular estadísticas de montos
-            if montos_previos:
-                monto_medio = sum(montos_previos) / len(montos_previos)
-                monto_desv = (sum((m - monto_medio) ** 2 for m in montos_previos) / len(montos_previos)) ** 0.5
-                
-                # Ajustar rango en función del historial y el riesgo
-                # Si el riesgo es bajo, priorizar montos similares a los previos
-                # Si el riesgo es alto, diversificar más el rango
-                if factor_riesgo < 30:  # Riesgo bajo
-                    # Centrar el rango alrededor del monto medio con un margen que depende de la desviación
-                    nuevo_inicio = max(rango_inicio, monto_medio - 2 * monto_desv)
-                    nuevo_fin = min(rango_fin, monto_medio + 2 * monto_desv)
-                    
-                    # Evitar que el rango sea demasiado pequeño
-                    if nuevo_fin - nuevo_inicio < rango_size * 0.2:
-                        margin = rango_size * 0.1
-                        nuevo_inicio = max(rango_inicio, monto_medio - margin)
-                        nuevo_fin = min(rango_fin, monto_medio + margin)
-                    
-                    rango_inicio, rango_fin = nuevo_inicio, nuevo_fin
-        
-        # Número de puntos a generar
-        num_puntos = min(50, int(rango_size))
-        montos_posibles = []
-        
-        # Ajustar la distribución según el factor de riesgo
-        # Con riesgo bajo (< 30), preferir valores cercanos a la media
-        # Con riesgo medio (30-70), distribución uniforme
-        # Con riesgo alto (> 70), preferir valores extremos
-        if factor_riesgo < 30:
-            # Distribución centrada (preferencia por valores medios del rango)
-            for i in range(num_puntos):
-                # Usar distribución beta centrada
-                factor = 0.5 + (i / num_puntos - 0.5) * 0.8  # Se concentra cerca de 0.5
-                monto = rango_inicio + (rango_fin - rango_inicio) * factor
-                monto_redondeado = round(monto)
-                if monto_redondeado not in montos_excluir:
-                    montos_posibles.append(monto_redondeado)
-        elif factor_riesgo > 70:
-            # Distribución bimodal (preferencia por extremos)
-            for i in range(num_puntos):
-                # Usar distribución que prefiere valores extremos
-                if i < num_puntos / 2:
-                    factor = (i / (num_puntos / 2)) * 0.3  # Cercanos al inicio
-                else:
-                    factor = 0.7 + ((i - num_puntos / 2) / (num_puntos / 2)) * 0.3  # Cercanos al fin
-                monto = rango_inicio + (rango_fin - rango_inicio) * factor
-                monto_redondeado = round(monto)
-                if monto_redondeado not in montos_excluir:
-                    montos_posibles.append(monto_redondeado)
-        else:
-            # Distribución uniforme con ligera preferencia por valores altos
-            for i in range(num_puntos):
-                factor = (i / num_puntos) ** 0.6  # Ligera preferencia por valores altos
-                monto = rango_inicio + (rango_fin - rango_inicio) * factor
-                monto_redondeado = round(monto)
-                if monto_redondeado not in montos_excluir:
-                    montos_posibles.append(monto_redondeado)
-
-        if not montos_posibles:
-            # Si no hay montos posibles, usar el método tradicional
-            return self._calcular_monto_sugerido(
-                operaciones_pareja, 
-                rango_inicio, 
-                rango_fin,
-                montos_excluir
-            )
-
-        # Elegir un monto con pesos apropiados según la distribución
-        if factor_riesgo < 30:
-            # Para riesgo bajo, dar más peso a los montos centrales
-            mid_idx = len(montos_posibles) // 2
-            weights = [max(1, mid_idx - abs(i - mid_idx)) for i in range(len(montos_posibles))]
-        elif factor_riesgo > 70:
-            # Para riesgo alto, dar más peso a los extremos
-            mid_idx = len(montos_posibles) // 2
-            weights = [max(1, abs(i - mid_idx)) for i in range(len(montos_posibles))]
-        else:
-            # Para riesgo medio, pesos equilibrados con preferencia por valores altos
-            weights = [i + 1 for i in range(len(montos_posibles))]
-        
-        return random.choices(montos_posibles, weights=weights, k=1)[0]
-    
     def _calcular_rango_efectivo(self, rangos1, rangos2):
         """Calcula el rango efectivo entre dos conjuntos de rangos"""
         superposiciones = []
@@ -1195,51 +1800,19 @@ class EmparejamientoService(BaseService):
             # Calcular patrón de riesgo si tenemos historial
             patron_riesgo = 0
             if historial:
-                patron_riesgo = self._evaluar_patron_operaciones({
-                    'historial_operaciones': historial,
-                    'afiliado1': afiliado1,
-                    'afiliado2': afiliado2
-                })
-            
-            # Generar montos sugeridos adicionales
-            montos_recientes = set(op.monto for op in operaciones)
-            montos_sugeridos = []
-            intentos = 0
-            max_intentos = 20
-            
-            # Convertir a DataFrame para usar función existente
-            df_ops = pd.DataFrame([{
-                'fecha': op.fecha,
-                'hora': op.hora,
-                'nombre1': op.nombre1,
-                'nombre2': op.nombre2,
-                'monto': op.monto
-            } for op in operaciones])
-            
-            # Usar cálculo mejorado si hay configuración
-            if configuracion:
-                while len(montos_sugeridos) < 5 and intentos < max_intentos:
-                    monto = self._calcular_monto_sugerido_mejorado(
-                        df_ops,
-                        rango_inicio,
-                        rango_fin,
-                        patron_riesgo,
-                        montos_excluir=set(montos_sugeridos + list(montos_recientes))
-                    )
-                    if monto is not None:
-                        montos_sugeridos.append(monto)
-                    intentos += 1
-            else:
-                while len(montos_sugeridos) < 5 and intentos < max_intentos:
-                    monto = self._calcular_monto_sugerido(
-                        df_ops,
-                        rango_inicio,
-                        rango_fin,
-                        montos_excluir=set(montos_sugeridos + list(montos_recientes))
-                    )
-                    if monto is not None:
-                        montos_sugeridos.append(monto)
-                    intentos += 1
+                patron_riesgo = riesgo_patron(historial)
+            
+            # Cinco montos sugeridos distintos de los recientes, en una sola llamada
+            montos_pareja = [op.monto for op in operaciones]
+            generador = GeneradorMontos(self._semilla(opciones.get('semilla')))
+            montos_sugeridos = generador.sugerir_distintos(
+                [rango_inicio],
+                [rango_fin],
+                [montos_pareja],
+                [patron_riesgo] if configuracion else None,
+                [set(montos_pareja)],
+                cantidad=5
+            )[0]
             
             return {
                 "success": True,
@@ -1256,4 +1829,180 @@ class EmparejamientoService(BaseService):
             return {
                 "success": False,
                 "error": f"Error obteniendo detalles: {str(e)}"
-            }
\ No newline at end of file
+            }
+
+    def obtener_detalles_emparejamientos(self, parejas, opciones=None):
+        """
+        Detalles de varias parejas con una cantidad fija de consultas.
+
+        Equivale a llamar a obtener_detalles_emparejamiento por cada pareja
+        (historial, patrón de riesgo, Izipay y montos sugeridos) pero con una
+        consulta de rangos y una de operaciones para todo el lote, sin importar
+        cuántas parejas se pidan. Los montos sugeridos de todas las parejas se
+        generan en una sola llamada al GeneradorMontos.
+
+        Args:
+            parejas: lista de [afiliado1, afiliado2] o de
+                {'afiliado1': ..., 'afiliado2': ...}
+            opciones: incluir_historial_completo, configuracion y semilla,
+                igual que en obtener_detalles_emparejamiento
+
+        Returns:
+            dict: una entrada por pareja, en el orden recibido. Una pareja mal
+            formada o sin afiliados conocidos tiene su propia entrada con
+            success False y error, como la respuesta de la consulta individual;
+            un error al consultar la base devuelve {'success': False, 'error'}
+            para todo el lote, también como la consulta individual
+        """
+        opciones = opciones or {}
+        parejas = self._leer_parejas(parejas)
+        incluir_historial_completo = opciones.get('incluir_historial_completo', False)
+        configuracion = opciones.get('configuracion', {})
+        generador = GeneradorMontos(self._semilla(opciones.get('semilla')))
+        bien_formadas = [(afiliado1, afiliado2) for afiliado1, afiliado2, error in parejas if error is None]
+
+        try:
+            afiliados = sorted({a for pareja in bien_formadas for a in pareja})
+            rangos = {}
+            for numero, inicio, fin, recibe_en in db.session.query(
+                RangoAfiliado.numero_afiliado,
+                RangoAfiliado.rango_inicio,
+                RangoAfiliado.rango_fin,
+                RangoAfiliado.recibe_en
+            ).filter(RangoAfiliado.numero_afiliado.in_(afiliados)):
+                rangos.setdefault(numero, []).append({'inicio': inicio, 'fin': fin, 'recibe_en': recibe_en})
+
+            historiales = {}
+            if bien_formadas:
+                historiales = self._historiales_parejas(bien_formadas, None if incluir_historial_completo else 10)
+        except Exception as e:
+            current_app.logger.error(f"Error en obtener_detalles_emparejamientos: {str(e)}")
+            return {
+                "success": False,
+                "error": f"Error obteniendo detalles: {str(e)}"
+            }
+
+        resultados = []
+        validas = []
+        for afiliado1, afiliado2, error in parejas:
+            detalle = {'afiliado1': afiliado1, 'afiliado2': afiliado2}
+            resultados.append(detalle)
+            if error is not None:
+                detalle.update(success=False, error=error)
+                continue
+            rangos1 = rangos.get(afiliado1, [])
+            rangos2 = rangos.get(afiliado2, [])
+            if not rangos1 and not rangos2:
+                detalle.update(success=False, error="No se encontraron los afiliados")
+                continue
+
+            usa_izipay = any(
+                'Izipay' in r['recibe_en'] or r['recibe_en'] == 'Ambos'
+                for r in rangos1 + rangos2
+            )
+            rango_efectivo = self._calcular_rango_efectivo(rangos1, rangos2)
+            if not rango_efectivo:
+                detalle.update(success=False, error="No hay rangos compatibles para estos afiliados")
+                continue
+
+            rango_fin = float(rango_efectivo['fin'])
+            if usa_izipay:
+                rango_fin = min(rango_fin, 800)
+
+            operaciones = historiales.get(self._clave_pareja(afiliado1, afiliado2), [])
+            detalle.update(
+                success=True,
+                historial=[{
+                    'fecha': fecha.strftime('%Y-%m-%d'),
+                    'hora': hora.strftime('%H:%M'),
+                    'monto': monto
+                } for fecha, hora, monto in operaciones],
+                usa_izipay=usa_izipay
+            )
+            validas.append((detalle, float(rango_efectivo['inicio']), rango_fin, operaciones))
+
+        # Patrón de riesgo agrupado (0 sin historial, como en la consulta individual)
+        riesgos = riesgo_patron_parejas(
+            [np.array([monto for _, _, monto in ops], dtype=np.float64) for _, _, _, ops in validas],
+            [np.array([fecha for fecha, _, _ in ops], dtype='datetime64[D]') for _, _, _, ops in validas]
+        )
+        for (detalle, _, _, operaciones), riesgo in zip(validas, riesgos.tolist()):
+            detalle['patron_riesgo'] = riesgo if operaciones else 0
+
+        montos_pareja = [[monto for _, _, monto in ops] for _, _, _, ops in validas]
+        sugeridos = generador.sugerir_distintos(
+            [inicio for _, inicio, _, _ in validas],
+            [fin for _, _, fin, _ in validas],
+            montos_pareja,
+            [detalle['patron_riesgo'] for detalle, _, _, _ in validas] if configuracion else None,
+            [set(montos) for montos in montos_pareja],
+            cantidad=5
+        )
+        for (detalle, _, _, _), montos in zip(validas, sugeridos):
+            detalle['montos_sugeridos'] = montos
+
+        return {
+            "success": True,
+            "data": resultados
+        }
+
+    def _leer_parejas(self, parejas):
+        """
+        Valida la lista de parejas del lote y la normaliza a tuplas
+        (afiliado1, afiliado2, error); error es None si la pareja está bien
+        formada y, si no, el mensaje para su entrada en la respuesta
+        """
+        if not isinstance(parejas, list) or not parejas:
+            raise ValidationError("parejas debe ser una lista no vacía")
+        if len(parejas) > MAX_PAREJAS_DETALLES:
+            raise ValidationError(f"Se permiten como máximo {MAX_PAREJAS_DETALLES} parejas por consulta")
+
+        normalizadas = []
+        for pareja in parejas:
+            if isinstance(pareja, dict):
+                pareja = (pareja.get('afiliado1'), pareja.get('afiliado2'))
+            elif not isinstance(pareja, (list, tuple)):
+                pareja = ()
+            if len(pareja) != 2 or not all(pareja):
+                afiliado1, afiliado2 = (list(pareja) + [None, None])[:2]
+                normalizadas.append((afiliado1, afiliado2, "Cada pareja debe indicar afiliado1 y afiliado2"))
+                continue
+            normalizadas.append((str(pareja[0]), str(pareja[1]), None))
+        return normalizadas
+
+    @staticmethod
+    def _clave_pareja(afiliado1, afiliado2):
+        """Clave sin orden de una pareja"""
+        return (afiliado1, afiliado2) if afiliado1 <= afiliado2 else (afiliado2, afiliado1)
+
+    def _historiales_parejas(self, parejas, limite=None):
+        """
+        Operaciones de todas las parejas en una consulta: (fecha, hora, monto)
+        por pareja, de la más reciente a la más antigua. Con 'limite' se
+        numeran las filas de cada pareja (ROW_NUMBER) y se cortan en SQL.
+        """
+        claves = sorted({self._clave_pareja(a1, a2) for a1, a2 in parejas})
+        sentidos = claves + [(a2, a1) for a1, a2 in claves if a1 != a2]
+        menor = case((Operacion.nombre1 <= Operacion.nombre2, Operacion.nombre1), else_=Operacion.nombre2)
+        mayor = case((Operacion.nombre1 <= Operacion.nombre2, Operacion.nombre2), else_=Operacion.nombre1)
+
+        consulta = db.session.query(
+            menor.label('menor'),
+            mayor.label('mayor'),
+            Operacion.fecha,
+            Operacion.hora,
+            Operacion.monto,
+            func.row_number().over(
+                partition_by=(menor, mayor),
+                order_by=(Operacion.fecha.desc(), Operacion.hora)
+            ).label('posicion')
+        ).filter(tuple_(Operacion.nombre1, Operacion.nombre2).in_(sentidos)).subquery()
+
+        filas = db.session.query(consulta)
+        if limite is not None:
+            filas = filas.filter(consulta.c.posicion <= limite)
+
+        historiales = {}
+        for fila in filas.order_by(consulta.c.menor, consulta.c.mayor, consulta.c.posicion):
+            historiales.setdefault((fila.menor, fila.mayor), []).append((fila.fecha, fila.hora, fila.monto))
+        return historiales
@@ -0,0 +1,216 @@
+# app/services/evaluacion_paralela.py
+import itertools
+import math
+import multiprocessing
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+# Arreglos que necesitan los procesos para MotorVectorizado._caracteristicas_bloque
+CLAVES_CANDIDATAS = ('i', 'j', 'inicio', 'fin')
+CLAVES_INDICES = ('diversidad', 'claves_pareja', 'ultima_fecha', 'ultima_completa', 'patron_pareja')
+PREFIJO_LINEA_TIEMPO = 'linea_tiempo.'
+
+
+class ArreglosCompartidos:
+    """
+    Copia un dict de arreglos de NumPy a bloques de memoria compartida.
+
+    Los procesos los adjuntan por nombre y los leen sin copiarlos ni recibirlos
+    serializados en cada tarea. La memoria se libera al salir del contexto.
+    """
+
+    def __init__(self, arreglos):
+        self.memorias = []
+        self.descriptores = {}
+        for nombre, arreglo in arreglos.items():
+            arreglo = np.ascontiguousarray(arreglo)
+            memoria = shared_memory.SharedMemory(create=True, size=max(1, arreglo.nbytes))
+            np.ndarray(arreglo.shape, dtype=arreglo.dtype, buffer=memoria.buf)[...] = arreglo
+            self.memorias.append(memoria)
+            self.descriptores[nombre] = (memoria.name, arreglo.shape, arreglo.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+    def liberar(self):
+        for memoria in self.memorias:
+            memoria.close()
+            memoria.unlink()
+        self.memorias = []
+
+
+# Estado de cada proceso: el último contexto adjuntado se reutiliza entre
+# tareas. Cada cálculo publica su propio contexto; los procesos del pool
+# ejecutan una tarea a la vez, así que pasar al contexto de otro cálculo
+# nunca cierra una memoria que una tarea todavía lee.
+_adjunto = {'id': None, 'memorias': [], 'arreglos': None}
+
+
+def _adjuntar(id_contexto, descriptores):
+    """Adjunta (una sola vez por contexto) los arreglos compartidos en el proceso"""
+    if _adjunto['id'] == id_contexto:
+        return _adjunto['arreglos']
+
+    _adjunto['arreglos'] = None
+    for memoria in _adjunto['memorias']:
+        try:
+            memoria.close()
+        except BufferError:
+            pass
+
+    memorias, arreglos = [], {}
+    for nombre, (nombre_memoria, forma, tipo) in descriptores.items():
+        memoria = shared_memory.SharedMemory(name=nombre_memoria)
+        memorias.append(memoria)
+        arreglos[nombre] = np.ndarray(forma, dtype=np.dtype(tipo), buffer=memoria.buf)
+
+    _adjunto.update({'id': id_contexto, 'memorias': memorias, 'arreglos': arreglos})
+    return arreglos
+
+
+def _evaluar_fragmento(id_contexto, descriptores, desde, hasta, parametros):
+    """Tarea de un proceso: características de las candidatas [desde, hasta)"""
+    from app.services.motor_emparejamiento import MotorVectorizado
+
+    arreglos = _adjuntar(id_contexto, descriptores)
+    indices = {clave: arreglos[clave] for clave in CLAVES_INDICES}
+    indices['linea_tiempo'] = {
+        nombre[len(PREFIJO_LINEA_TIEMPO):]: arreglo
+        for nombre, arreglo in arreglos.items() if nombre.startswith(PREFIJO_LINEA_TIEMPO)
+    }
+    bloque = slice(desde, hasta)
+    return MotorVectorizado(None)._caracteristicas_bloque(
+        arreglos['i'][bloque], arreglos['j'][bloque],
+        arreglos['inicio'][bloque], arreglos['fin'][bloque],
+        indices, parametros
+    )
+
+
+class EvaluadorParalelo:
+    """
+    Evalúa los bloques de MotorVectorizado en un ProcessPoolExecutor.
+
+    Las candidatas y los índices se publican una vez en memoria compartida y
+    cada tarea recibe sólo su rango [desde, hasta). Los bloques se devuelven en
+    el orden del doble bucle para que la serialización (y los montos sugeridos
+    aleatorios) sea idéntica a la evaluación en serie. El pool se conserva
+    entre cálculos.
+
+    Cada cálculo publica sus arreglos en su propia memoria compartida y la
+    libera al terminar. El pool es compartido por los cálculos simultáneos
+    (pedidos y trabajos en segundo plano): se crea, se reemplaza y se
+    cierra bajo un lock, y no se reemplaza ni se cierra mientras otro
+    cálculo lo esté usando. Un cálculo que pide otra cantidad de procesos
+    mientras tanto usa el pool existente (el resultado no depende de ella).
+    """
+
+    def __init__(self, min_parejas=50000):
+        # Por debajo de este número de candidatas no compensa repartir el trabajo
+        self.min_parejas = min_parejas
+        self._executor = None
+        self._procesos = None
+        self._usos = 0
+        self._cerrar_al_liberar = False
+        self._lock = threading.Lock()
+
+    def _tomar_executor(self, procesos):
+        """Pool para un cálculo; se devuelve con _liberar_executor"""
+        with self._lock:
+            if self._executor is not None and self._procesos != procesos and not self._usos:
+                self._apagar()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=procesos, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._procesos = procesos
+            self._usos += 1
+            return self._executor
+
+    def _liberar_executor(self, executor, roto=False):
+        with self._lock:
+            if executor is not self._executor:
+                return
+            self._usos -= 1
+            # Un pool roto no sirve a nadie: se descarta aunque otros lo usen
+            if roto or (self._cerrar_al_liberar and not self._usos):
+                self._apagar()
+
+    def _apagar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._procesos = None
+        self._usos = 0
+        self._cerrar_al_liberar = False
+
+    def cerrar(self):
+        """
+        Detiene el pool de procesos (se recrea en el próximo cálculo); si hay
+        cálculos usándolo, se detiene cuando termina el último
+        """
+        with self._lock:
+            if self._usos:
+                self._cerrar_al_liberar = True
+            else:
+                self._apagar()
+
+    def bloques(self, motor, candidatas, indices, parametros, procesos, control=None):
+        """
+        Genera, en orden, los bloques evaluados por los procesos.
+
+        Se mantienen a lo sumo 2 tareas por proceso en vuelo para acotar la
+        memoria de resultados pendientes. Si el control (ControlEjecucion) indica
+        que se agotó el presupuesto o se canceló, se deja de generar y se
+        cancelan las tareas restantes.
+        """
+        total = len(candidatas['i'])
+        tam_bloque = max(1, min(motor.tam_bloque, math.ceil(total / (procesos * 4))))
+
+        arreglos = {clave: candidatas[clave] for clave in CLAVES_CANDIDATAS}
+        arreglos.update({clave: indices[clave] for clave in CLAVES_INDICES})
+        arreglos.update({
+            PREFIJO_LINEA_TIEMPO + nombre: arreglo
+            for nombre, arreglo in indices['linea_tiempo'].items()
+        })
+
+        id_contexto = uuid.uuid4().hex
+        desdes = iter(range(0, total, tam_bloque))
+        pendientes = deque()
+        executor = self._tomar_executor(procesos)
+        roto = False
+        try:
+            with ArreglosCompartidos(arreglos) as compartidos:
+                def enviar(desde):
+                    pendientes.append(executor.submit(
+                        _evaluar_fragmento, id_contexto, compartidos.descriptores,
+                        desde, desde + tam_bloque, parametros
+                    ))
+
+                try:
+                    for desde in itertools.islice(desdes, procesos * 2):
+                        enviar(desde)
+
+                    while pendientes:
+                        if control is not None and control.agotado():
+                            return
+                        evaluado = pendientes.popleft().result()
+                        siguiente = next(desdes, None)
+                        if siguiente is not None:
+                            enviar(siguiente)
+                        yield evaluado
+                finally:
+                    for futuro in pendientes:
+                        futuro.cancel()
+        except BrokenProcessPool:
+            roto = True
+            raise
+        finally:
+            self._liberar_executor(executor, roto)
@@ -0,0 +1,202 @@
+# app/services/grafo_contrapartes.py
+import numpy as np
+
+# Etiqueta de los afiliados que no forman parte de un flujo cíclico
+SIN_CICLO = -1
+
+
+def componentes_conexas(n, origenes, destinos):
+    """
+    Componentes conexas (sin dirección) por unión de árboles con saltos de
+    puntero: en cada ronda cada arista cuelga la raíz mayor de la menor y
+    luego se comprimen los caminos, todo con arreglos. Cada ronda es lineal
+    en aristas y el número de rondas crece como el logaritmo del tamaño de
+    las componentes en grafos como estos.
+
+    Returns:
+        np.ndarray: por nodo, el menor nodo de su componente
+    """
+    padre = np.arange(n, dtype=np.int64)
+    while True:
+        raiz1, raiz2 = padre[origenes], padre[destinos]
+        distintas = raiz1 != raiz2
+        if not distintas.any():
+            return padre
+        np.minimum.at(padre, np.maximum(raiz1, raiz2)[distintas], np.minimum(raiz1, raiz2)[distintas])
+        while True:
+            abuelo = padre[padre]
+            if np.array_equal(abuelo, padre):
+                break
+            padre = abuelo
+
+
+def componentes_fuertes(indptr, indices):
+    """
+    Componentes fuertemente conexas de un grafo dirigido en CSR por coloreo,
+    todo con arreglos sobre las aristas:
+
+    1. Se podan (repitiendo hasta que no cambie) los nodos sin aristas de
+       entrada o de salida entre los que quedan: forman su propia componente.
+    2. Cada nodo restante toma como color el menor nodo que lo alcanza
+       (propagación de mínimos hacia adelante hasta el punto fijo).
+    3. Los nodos cuyo color son ellos mismos son raíces; la componente de
+       cada raíz son los nodos de su color que llegan a ella por aristas de
+       ese color (alcance hacia atrás desde todas las raíces a la vez).
+
+    Las componentes encontradas se quitan y se repite con el resto.
+
+    Returns:
+        np.ndarray: por nodo, el menor nodo de su componente
+    """
+    n = len(indptr) - 1
+    origenes = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    destinos = np.asarray(indices, dtype=np.int64)
+    componente = np.arange(n, dtype=np.int64)
+    activos = np.ones(n, dtype=bool)
+
+    while True:
+        while True:
+            vivas = activos[origenes] & activos[destinos]
+            origenes, destinos = origenes[vivas], destinos[vivas]
+            podados = activos & ((np.bincount(origenes, minlength=n) == 0) | (np.bincount(destinos, minlength=n) == 0))
+            if not podados.any():
+                break
+            activos &= ~podados
+        if not len(origenes):
+            return componente
+
+        color = np.arange(n, dtype=np.int64)
+        while True:
+            nuevo = color.copy()
+            np.minimum.at(nuevo, destinos, color[origenes])
+            if np.array_equal(nuevo, color):
+                break
+            color = nuevo
+
+        mismo_color = color[origenes] == color[destinos]
+        atras_desde, atras_hasta = destinos[mismo_color], origenes[mismo_color]
+        alcanzados = activos & (color == np.arange(n))
+        while True:
+            nuevos = alcanzados[atras_desde] & ~alcanzados[atras_hasta]
+            if not nuevos.any():
+                break
+            alcanzados[atras_hasta[nuevos]] = True
+        componente[alcanzados] = color[alcanzados]
+        activos &= ~alcanzados
+
+
+class GrafoContrapartes:
+    """
+    Grafo dirigido de contrapartes: una arista nombre1 -> nombre2 por cada
+    pareja ordenada que operó, con la cantidad de operaciones y el volumen.
+
+    Los nodos son los códigos de afiliado (CodificadorNumeros) presentes en
+    las operaciones, renumerados de 0 a n - 1; las aristas se guardan en
+    formato CSR (indptr / indices ordenados por origen y destino), de modo
+    que los grados, volúmenes y aristas recíprocas se obtienen con
+    bincount y searchsorted sin recorrer operaciones en Python. Las
+    operaciones de un número consigo mismo no forman aristas.
+    """
+
+    def __init__(self, codigo1, codigo2, montos):
+        codigo1 = np.asarray(codigo1, dtype=np.int64)
+        codigo2 = np.asarray(codigo2, dtype=np.int64)
+        montos = np.asarray(montos, dtype=np.float64)
+        distintos = codigo1 != codigo2
+        self.propias = int((~distintos).sum())
+        codigo1, codigo2, montos = codigo1[distintos], codigo2[distintos], montos[distintos]
+
+        self.codigos, nodos = np.unique(np.concatenate([codigo1, codigo2]), return_inverse=True)
+        self.n = n = len(self.codigos)
+        origenes, destinos = nodos[:len(codigo1)], nodos[len(codigo1):]
+
+        claves, aristas, self.conteos = np.unique(origenes * n + destinos, return_inverse=True, return_counts=True)
+        self.volumenes = np.bincount(aristas, weights=montos, minlength=len(claves))
+        self.claves = claves
+        self.origenes = claves // n if n else claves
+        self.indices = claves % n if n else claves
+        self.indptr = np.searchsorted(self.origenes, np.arange(n + 1))
+
+    def __len__(self):
+        return self.n
+
+    def reciprocas(self):
+        """
+        Aristas u -> v con u < v cuya inversa v -> u también existe.
+
+        Returns:
+            (np.ndarray, np.ndarray): posiciones de la arista directa y de la inversa
+        """
+        directas = np.flatnonzero(self.origenes < self.indices)
+        inversas = self.indices[directas] * self.n + self.origenes[directas]
+        pos = np.minimum(np.searchsorted(self.claves, inversas), max(len(self.claves) - 1, 0))
+        encontradas = self.claves[pos] == inversas if len(self.claves) else np.zeros(0, dtype=bool)
+        return directas[encontradas], pos[encontradas]
+
+    def metricas(self):
+        """Grados, operaciones y volumen enviados/recibidos por nodo"""
+        n = self.n
+        directas, inversas = self.reciprocas()
+        reciprocas = (np.bincount(self.origenes[directas], minlength=n)
+                      + np.bincount(self.indices[directas], minlength=n))
+        grado_salida = np.diff(self.indptr)
+        grado_entrada = np.bincount(self.indices, minlength=n)
+        return {
+            'grado_salida': grado_salida,
+            'grado_entrada': grado_entrada,
+            'contrapartes': grado_salida + grado_entrada - reciprocas,
+            'reciprocas': reciprocas,
+            'operaciones_enviadas': np.bincount(self.origenes, weights=self.conteos, minlength=n).astype(np.int64),
+            'operaciones_recibidas': np.bincount(self.indices, weights=self.conteos, minlength=n).astype(np.int64),
+            'volumen_enviado': np.bincount(self.origenes, weights=self.volumenes, minlength=n),
+            'volumen_recibido': np.bincount(self.indices, weights=self.volumenes, minlength=n),
+        }
+
+    def clusters(self):
+        """
+        Componentes conexas sin dirección numeradas por tamaño decreciente
+        (a igual tamaño, por su primer nodo).
+
+        Returns:
+            np.ndarray: número de cluster por nodo
+        """
+        return self._numerar(componentes_conexas(self.n, self.origenes, self.indices))
+
+    def ciclos(self):
+        """
+        Flujos cíclicos: componentes fuertemente conexas de al menos dos
+        nodos, en las que lo enviado por cada afiliado puede volver a él a
+        través de los demás. Numeradas como clusters.
+
+        Returns:
+            np.ndarray: número de ciclo por nodo (SIN_CICLO si no está en ninguno)
+        """
+        etiquetas = self._numerar(componentes_fuertes(self.indptr, self.indices))
+        tamanos = np.bincount(etiquetas, minlength=self.n)
+        etiquetas[tamanos[etiquetas] < 2] = SIN_CICLO
+        return etiquetas
+
+    def internas(self, etiquetas):
+        """Por grupo de 'etiquetas': aristas, operaciones y volumen entre sus miembros"""
+        grupos = int(etiquetas.max()) + 1 if len(etiquetas) else 0
+        grupo = etiquetas[self.origenes]
+        dentro = (grupo == etiquetas[self.indices]) & (grupo >= 0)
+        grupo = grupo[dentro]
+        return {
+            'aristas': np.bincount(grupo, minlength=grupos),
+            'operaciones': np.bincount(grupo, weights=self.conteos[dentro], minlength=grupos).astype(np.int64),
+            'volumen': np.bincount(grupo, weights=self.volumenes[dentro], minlength=grupos),
+        }
+
+    @staticmethod
+    def _numerar(etiquetas):
+        """Renumera las etiquetas por tamaño de grupo decreciente y luego por primer nodo"""
+        if not len(etiquetas):
+            return etiquetas
+        grupos, primeros, inversa, tamanos = np.unique(
+            etiquetas, return_index=True, return_inverse=True, return_counts=True
+        )
+        orden = np.lexsort((primeros, -tamanos))
+        numero = np.empty(len(grupos), dtype=np.int64)
+        numero[orden] = np.arange(len(grupos))
+        return numero[inversa]
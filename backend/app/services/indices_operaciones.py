@@ -0,0 +1,409 @@
+# app/services/indices_operaciones.py
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from app.services.codificacion_numeros import CodificadorNumeros
+from app.services.patrones_operaciones import riesgo_patron_segmentos
+
+NAT = np.iinfo(np.int64).min
+MASCARA_CODIGO = (1 << 32) - 1
+
+class HistorialPareja(namedtuple(
+    'HistorialPareja',
+    ['cantidad', 'ultima_fecha', 'ultima_completa', 'montos', 'fechas']
+)):
+    """Historial mutuo de una pareja tal como lo guarda IndiceParejas"""
+    __slots__ = ()
+
+    def registros(self):
+        """Historial como lista de dicts {fecha, monto} (formato de patrones_operaciones.riesgo_patron)"""
+        fechas = self.fechas.astype('datetime64[us]').tolist()
+        return [
+            {'fecha': fecha, 'monto': monto}
+            for fecha, monto in zip(fechas, self.montos.tolist())
+        ]
+
+
+class IndicesOperaciones(namedtuple(
+    'IndicesOperaciones',
+    ['version', 'diversidad', 'parejas', 'linea_tiempo']
+)):
+    """
+    Los tres índices de una misma carga de operaciones (versión de los
+    datos y ventana). Una vez publicado el conjunto no se modifica: las
+    actualizaciones arman uno nuevo (ver copia en cada índice).
+    """
+    __slots__ = ()
+
+
+def a_ns(columna, longitud):
+    """Convierte una columna de fechas a int64 (ns); NaT queda como NAT"""
+    if columna is None:
+        return np.full(longitud, NAT, dtype=np.int64)
+    valores = pd.to_datetime(columna, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    return valores.view(np.int64)
+
+
+def a_timestamp(valor):
+    """Convierte un instante en ns (o NAT) a pd.Timestamp / pd.NaT"""
+    return pd.NaT if valor == NAT else pd.Timestamp(int(valor))
+
+
+class IndiceDiversidad:
+    """
+    Índice de diversidad de contrapartes por afiliado.
+
+    Trabaja sobre los códigos de CodificadorNumeros: las aristas (afiliado,
+    contraparte) distintas se guardan como claves int64 ordenadas
+    (codigo << 32 | contraparte) y los conteos en un arreglo indexado por
+    código. Admite actualizaciones incrementales al cargar operaciones.
+    """
+
+    def __init__(self, codificador=None):
+        self.codificador = codificador if codificador is not None else CodificadorNumeros()
+        self.version = None
+        self.conteos = np.zeros(0, dtype=np.int64)
+        self._aristas = np.empty(0, dtype=np.int64)
+
+    def _aristas_de(self, operaciones):
+        """Claves de las aristas dirigidas distintas en ambos sentidos de cada operación"""
+        codigo1, codigo2 = self.codificador.columnas(operaciones)
+        a = np.concatenate([codigo1, codigo2]).astype(np.int64)
+        b = np.concatenate([codigo2, codigo1]).astype(np.int64)
+        return np.unique((a << 32) | b)
+
+    def construir(self, operaciones, version=None):
+        """Índice nuevo con todas las operaciones de un DataFrame (éste no cambia)"""
+        return type(self)(self.codificador).agregar(operaciones, version)
+
+    def copia(self):
+        """Copia sobre la que agregar no modifica este índice"""
+        copia = type(self)(self.codificador)
+        copia.version = self.version
+        copia.conteos = self.conteos.copy()
+        copia._aristas = self._aristas
+        return copia
+
+    def agregar(self, operaciones, version=None):
+        """Incorpora operaciones nuevas contando sólo las contrapartes no vistas"""
+        aristas = self._aristas_de(operaciones)
+        nuevas = np.setdiff1d(aristas, self._aristas, assume_unique=True)
+
+        conteos = np.bincount(nuevas >> 32, minlength=len(self.codificador))
+        if len(conteos) > len(self.conteos):
+            self.conteos = np.concatenate([self.conteos, np.zeros(len(conteos) - len(self.conteos), dtype=np.int64)])
+        self.conteos[:len(conteos)] += conteos
+        self._aristas = np.union1d(self._aristas, nuevas)
+        self.version = version
+        return self
+
+    def obtener(self, codigo):
+        """Cantidad de contrapartes distintas de un afiliado (por código)"""
+        return int(self.conteos[codigo]) if 0 <= codigo < len(self.conteos) else 0
+
+    def contar(self, codigos):
+        """Cantidades de contrapartes distintas para un arreglo de códigos"""
+        codigos = np.asarray(codigos, dtype=np.int64)
+        conocidos = (codigos >= 0) & (codigos < len(self.conteos))
+        cantidades = np.zeros(len(codigos), dtype=np.int64)
+        cantidades[conocidos] = self.conteos[codigos[conocidos]]
+        return cantidades
+
+
+class Segmentos:
+    """
+    Arreglos de cada entrada guardados uno detrás de otro: el de la entrada
+    k es valores[limites[k]:limites[k + 1]] (una vista, sin copiar)
+    """
+    __slots__ = ('valores', 'limites')
+
+    def __init__(self, valores, limites):
+        self.valores = valores
+        self.limites = limites
+
+    def __getitem__(self, pos):
+        return self.valores[self.limites[pos]:self.limites[pos + 1]]
+
+    def __len__(self):
+        return len(self.limites) - 1
+
+
+class IndiceParejas:
+    """
+    Historial de operaciones mutuas por pareja no ordenada.
+
+    La clave es min(código) << 32 | max(código) (CodificadorNumeros). El
+    índice es columnar: las claves ordenadas y, en la misma posición, la
+    cantidad de operaciones, la última fecha y el último instante
+    (fecha_completa) de cada pareja; los montos y fechas de todas las parejas
+    van concatenados por pareja (en el orden original) con sus límites. Se
+    construye y se actualiza con ordenamientos y searchsorted, sin recorrer
+    las parejas en Python. Las posiciones valen para esta instancia: agregar
+    inserta parejas nuevas en el orden de las claves.
+    """
+
+    def __init__(self, codificador=None):
+        self.codificador = codificador if codificador is not None else CodificadorNumeros()
+        self.version = None
+        self.claves = np.zeros(0, dtype=np.int64)
+        self.cantidades = np.zeros(0, dtype=np.int64)
+        self.ultimas_fechas = np.zeros(0, dtype=np.int64)
+        self.ultimas_completas = np.zeros(0, dtype=np.int64)
+        self.limites = np.zeros(1, dtype=np.int64)
+        self.montos = Segmentos(np.zeros(0, dtype=np.float64), self.limites)
+        self.fechas = Segmentos(np.zeros(0, dtype='datetime64[ns]'), self.limites)
+        self._arreglos = None
+        self._patrones = None
+
+    @staticmethod
+    def clave(codigo1, codigo2):
+        """Clave canónica (int) de una pareja de códigos sin importar el orden"""
+        codigo1, codigo2 = int(codigo1), int(codigo2)
+        if codigo1 > codigo2:
+            codigo1, codigo2 = codigo2, codigo1
+        return (codigo1 << 32) | codigo2
+
+    def construir(self, operaciones, version=None):
+        """Índice nuevo con todas las operaciones de un DataFrame (éste no cambia)"""
+        return type(self)(self.codificador).agregar(operaciones, version)
+
+    def copia(self):
+        """
+        Copia sobre la que agregar no modifica este índice: agregar reemplaza
+        los arreglos en lugar de modificarlos, así que se comparten
+        """
+        copia = type(self)(self.codificador)
+        copia.__dict__.update(self.__dict__)
+        return copia
+
+    def agregar(self, operaciones, version=None):
+        """
+        Incorpora operaciones en una sola fusión: las filas nuevas de cada
+        pareja se añaden después de las existentes, igual que en la tabla.
+        """
+        codigo1, codigo2 = self.codificador.columnas(operaciones)
+        distintos = np.flatnonzero(codigo1 != codigo2)
+
+        if len(distintos):
+            codigo1 = codigo1[distintos].astype(np.int64)
+            codigo2 = codigo2[distintos].astype(np.int64)
+            claves = (np.minimum(codigo1, codigo2) << 32) | np.maximum(codigo1, codigo2)
+            orden = np.argsort(claves, kind='stable')
+            claves = claves[orden]
+            fecha = a_ns(operaciones['fecha'], len(operaciones))[distintos][orden]
+            completa = a_ns(operaciones.get('fecha_completa'), len(operaciones))[distintos][orden]
+            monto = operaciones['monto'].to_numpy(dtype=np.float64)[distintos][orden]
+
+            # Parejas de las filas nuevas (grupos contiguos tras el ordenamiento)
+            inicios = np.flatnonzero(np.concatenate([[True], claves[1:] != claves[:-1]]))
+            nuevas = claves[inicios]
+            cantidad_nueva = np.diff(np.append(inicios, len(claves)))
+
+            # Posición de cada pareja (previa o nueva) en las claves fusionadas
+            todas = np.union1d(self.claves, nuevas)
+            destino_previas = np.searchsorted(todas, self.claves)
+            destino_nuevas = np.searchsorted(todas, nuevas)
+
+            cantidades = np.zeros(len(todas), dtype=np.int64)
+            cantidades[destino_previas] = self.cantidades
+            previas_por_destino = cantidades.copy()
+            cantidades[destino_nuevas] += cantidad_nueva
+            limites = np.concatenate([[0], np.cumsum(cantidades)])
+
+            # Cada valor previo conserva su desplazamiento dentro de la pareja y
+            # los nuevos van a continuación, en el orden de las filas
+            previos = np.arange(self.limites[-1])
+            pareja_previa = np.repeat(np.arange(len(self.claves)), self.cantidades)
+            destino_valores_previos = limites[destino_previas][pareja_previa] + \
+                (previos - self.limites[:-1][pareja_previa])
+            grupo_nuevo = np.repeat(np.arange(len(nuevas)), cantidad_nueva)
+            destino_valores_nuevos = limites[destino_nuevas][grupo_nuevo] + \
+                previas_por_destino[destino_nuevas][grupo_nuevo] + \
+                (np.arange(len(claves)) - inicios[grupo_nuevo])
+
+            montos = np.empty(limites[-1], dtype=np.float64)
+            montos[destino_valores_previos] = self.montos.valores
+            montos[destino_valores_nuevos] = monto
+            fechas = np.empty(limites[-1], dtype='datetime64[ns]')
+            fechas[destino_valores_previos] = self.fechas.valores
+            fechas[destino_valores_nuevos] = fecha.view('datetime64[ns]')
+
+            # Últimas fechas: máximo de lo previo y de las filas nuevas (NAT es el mínimo)
+            ultimas_fechas = np.full(len(todas), NAT, dtype=np.int64)
+            ultimas_fechas[destino_previas] = self.ultimas_fechas
+            ultimas_fechas[destino_nuevas] = np.maximum(ultimas_fechas[destino_nuevas],
+                                                        np.maximum.reduceat(fecha, inicios))
+            ultimas_completas = np.full(len(todas), NAT, dtype=np.int64)
+            ultimas_completas[destino_previas] = self.ultimas_completas
+            ultimas_completas[destino_nuevas] = np.maximum(ultimas_completas[destino_nuevas],
+                                                           np.maximum.reduceat(completa, inicios))
+
+            self.claves = todas
+            self.cantidades = cantidades
+            self.ultimas_fechas = ultimas_fechas
+            self.ultimas_completas = ultimas_completas
+            self.limites = limites
+            self.montos = Segmentos(montos, limites)
+            self.fechas = Segmentos(fechas, limites)
+            self._arreglos = None
+            self._patrones = None
+
+        self.version = version
+        return self
+
+    def posicion(self, codigo1, codigo2):
+        """Posición de la entrada de una pareja (búsqueda binaria), o None si nunca operaron juntos"""
+        clave = self.clave(codigo1, codigo2)
+        pos = int(np.searchsorted(self.claves, clave))
+        if pos < len(self.claves) and self.claves[pos] == clave:
+            return pos
+        return None
+
+    def obtener(self, codigo1, codigo2):
+        """Historial de la pareja en O(log P), o None si nunca operaron juntos"""
+        pos = self.posicion(codigo1, codigo2)
+        return None if pos is None else self.en(pos)
+
+    def en(self, pos):
+        """Historial de la entrada en la posición dada"""
+        return HistorialPareja(
+            cantidad=int(self.cantidades[pos]),
+            ultima_fecha=a_timestamp(self.ultimas_fechas[pos]),
+            ultima_completa=a_timestamp(self.ultimas_completas[pos]),
+            montos=self.montos[pos],
+            fechas=self.fechas[pos]
+        )
+
+    def riesgos_patron(self):
+        """
+        Riesgo de patrón (riesgo_patron_segmentos) de todas las entradas,
+        calculado en una pasada agrupada y cacheado hasta el próximo cambio
+        """
+        if self._patrones is None:
+            self._patrones = riesgo_patron_segmentos(self.montos.valores, self.fechas.valores, self.cantidades)
+        return self._patrones
+
+    def arreglos(self):
+        """Vista columnar de todas las entradas (se cachea hasta el próximo cambio)"""
+        if self._arreglos is None:
+            self._arreglos = {
+                'menores': (self.claves >> 32).astype(np.int32),
+                'mayores': (self.claves & MASCARA_CODIGO).astype(np.int32),
+                'cantidades': self.cantidades,
+                'ultimas_fechas': self.ultimas_fechas,
+                'ultimas_completas': self.ultimas_completas,
+            }
+        return self._arreglos
+
+
+class LineaTiempoAfiliados:
+    """
+    Línea de tiempo ordenada por afiliado.
+
+    Guarda, por código de afiliado (CodificadorNumeros), un arreglo ordenado
+    de instantes (fecha_completa en ns, sin NaT) y el total de operaciones en
+    que participa; "operaciones desde la última mutua" se resuelve con
+    searchsorted en O(log M) por consulta.
+    """
+
+    def __init__(self, codificador=None):
+        self.codificador = codificador if codificador is not None else CodificadorNumeros()
+        self.version = None
+        self.tiempos = {}
+        self.totales = {}
+        self._vista = None
+
+    def _participaciones(self, operaciones):
+        """(código, instante) por afiliado y operación; cada fila cuenta una vez por afiliado"""
+        codigo1, codigo2 = self.codificador.columnas(operaciones)
+        completa = a_ns(operaciones.get('fecha_completa'), len(operaciones))
+        distintos = codigo1 != codigo2
+        codigos = np.concatenate([codigo1, codigo2[distintos]]).astype(np.int64)
+        instantes = np.concatenate([completa, completa[distintos]])
+        return codigos, instantes
+
+    def construir(self, operaciones, version=None):
+        """Líneas de tiempo nuevas de todas las operaciones con un solo ordenamiento (éstas no cambian)"""
+        return type(self)(self.codificador).agregar(operaciones, version)
+
+    def copia(self):
+        """Copia sobre la que agregar no modifica estas líneas (los arreglos se reemplazan, no se modifican)"""
+        copia = type(self)(self.codificador)
+        copia.version = self.version
+        copia.tiempos = dict(self.tiempos)
+        copia.totales = dict(self.totales)
+        copia._vista = self._vista
+        return copia
+
+    def agregar(self, operaciones, version=None):
+        """Incorpora operaciones nuevas fusionándolas en las líneas afectadas"""
+        codigos, instantes = self._participaciones(operaciones)
+        if len(codigos):
+            orden = np.lexsort((instantes, codigos))
+            limites = np.flatnonzero(np.diff(codigos[orden])) + 1
+            for grupo in np.split(orden, limites):
+                codigo = int(codigos[grupo[0]])
+                nuevos = instantes[grupo]
+                self.totales[codigo] = self.totales.get(codigo, 0) + len(nuevos)
+                nuevos = nuevos[nuevos != NAT]
+                previos = self.tiempos.get(codigo)
+                if previos is not None and len(previos):
+                    nuevos = np.sort(np.concatenate([previos, nuevos]), kind='mergesort')
+                self.tiempos[codigo] = nuevos
+            self._vista = None
+
+        self.version = version
+        return self
+
+    def total(self, codigo):
+        """Operaciones en las que participa el afiliado (por código)"""
+        return self.totales.get(int(codigo), 0)
+
+    def contar_desde(self, codigo, instante):
+        """Operaciones del afiliado con fecha_completa estrictamente posterior al instante"""
+        tiempos = self.tiempos.get(int(codigo))
+        if tiempos is None or instante is None or pd.isnull(instante):
+            return 0
+        instante = pd.Timestamp(instante).value
+        return len(tiempos) - int(np.searchsorted(tiempos, instante, side='right'))
+
+    def vista(self, afiliados):
+        """
+        Vista CSR para consultas vectorizadas sobre un arreglo de códigos de afiliado.
+
+        Los instantes se reemplazan por su rango entre los instantes únicos y se
+        combinan con la posición del afiliado en una sola clave ordenada, de modo
+        que contar_posteriores responde muchas consultas con un searchsorted.
+        Se cachea mientras no cambien los datos ni la lista de afiliados.
+        """
+        afiliados = np.asarray(afiliados, dtype=np.int64).tolist()
+        clave = tuple(afiliados)
+        if self._vista is not None and self._vista[0] == clave:
+            return self._vista[1]
+
+        vacio = np.empty(0, dtype=np.int64)
+        arreglos = [self.tiempos.get(a, vacio) for a in afiliados]
+        longitudes = np.fromiter((len(t) for t in arreglos), dtype=np.int64, count=len(afiliados))
+        tiempos = np.concatenate(arreglos) if arreglos else vacio
+        unicos = np.unique(tiempos)
+        posiciones = np.repeat(np.arange(len(afiliados), dtype=np.int64), longitudes)
+        # Cada segmento ya está ordenado, así que la clave compuesta también
+        compuesto = posiciones * (len(unicos) + 1) + np.searchsorted(unicos, tiempos)
+
+        vista = {
+            'tiempos_unicos': unicos,
+            'linea_tiempo': compuesto,
+            'fin_afiliado': np.cumsum(longitudes),
+            'total_ops': np.fromiter((self.totales.get(a, 0) for a in afiliados), dtype=np.int64, count=len(afiliados)),
+        }
+        self._vista = (clave, vista)
+        return vista
+
+    @staticmethod
+    def contar_posteriores(vista, posiciones, instantes):
+        """Versión vectorizada de contar_desde sobre posiciones de la vista"""
+        unicos = vista['tiempos_unicos']
+        umbral = np.searchsorted(unicos, instantes, side='right')
+        objetivo = posiciones.astype(np.int64) * (len(unicos) + 1) + umbral
+        inicio = np.searchsorted(vista['linea_tiempo'], objetivo, side='left')
+        return vista['fin_afiliado'][posiciones] - inicio
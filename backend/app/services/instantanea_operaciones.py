@@ -0,0 +1,191 @@
+# app/services/instantanea_operaciones.py
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from flask import current_app
+from app.utils import version_datos
+
+# Arreglos de la instantánea: códigos int32, instantes int64 (ns) y montos float64
+COLUMNAS = {
+    'codigo1': np.int32,
+    'codigo2': np.int32,
+    'fecha': np.int64,
+    'fecha_completa': np.int64,
+    'monto': np.float64,
+}
+
+# Archivo con el nombre del subdirectorio vigente (se reemplaza de forma atómica)
+ARCHIVO_ACTUAL = 'ACTUAL'
+
+
+def columnas_de(operaciones):
+    """Arreglos de la instantánea a partir de un DataFrame preparado y codificado"""
+    return {
+        'codigo1': operaciones['codigo1'].to_numpy(dtype=np.int32),
+        'codigo2': operaciones['codigo2'].to_numpy(dtype=np.int32),
+        'fecha': operaciones['fecha'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+        'fecha_completa': operaciones['fecha_completa'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+        'monto': operaciones['monto'].to_numpy(dtype=np.float64),
+    }
+
+
+def operaciones_de(columnas, desde=None):
+    """
+    DataFrame de operaciones del emparejador sobre los arreglos de la
+    instantánea, sin copiarlos (salvo al recortar la ventana 'desde').
+    Trae codigo1/codigo2 y fecha_completa, por lo que no se vuelve a
+    codificar ni a preparar.
+    """
+    if desde is not None:
+        filas = np.flatnonzero(columnas['fecha'] >= np.datetime64(desde, 'ns').astype(np.int64))
+        columnas = {nombre: arreglo[filas] for nombre, arreglo in columnas.items()}
+
+    operaciones = pd.DataFrame({
+        'fecha': columnas['fecha'].view('datetime64[ns]'),
+        'fecha_completa': columnas['fecha_completa'].view('datetime64[ns]'),
+        'codigo1': columnas['codigo1'],
+        'codigo2': columnas['codigo2'],
+        'monto': columnas['monto'],
+    }, copy=False)
+    operaciones.attrs['desde'] = desde
+    return operaciones
+
+
+class InstantaneaOperaciones:
+    """
+    Copia columnar en disco de la tabla de operaciones para el emparejador.
+
+    Cada escritura crea un subdirectorio con un .npy por columna (COLUMNAS),
+    los números de afiliado de los códigos (numeros.npy) y meta.json con la
+    firma: la versión de 'operaciones' (version_datos) de los datos copiados;
+    ACTUAL apunta al vigente. Los .npy
+    se abren con np.load(mmap_mode='r'): tras un reinicio no hay que volver a
+    leer la base y todos los procesos de la aplicación que abren la misma
+    instantánea comparten las páginas del sistema operativo en lugar de
+    tener cada uno su copia.
+
+    La instantánea es válida mientras su firma coincida con la versión
+    actual de la tabla. Esa versión está guardada en la base y cambia con
+    cada escritura confirmada (también UPDATE y DELETE, de cualquier
+    proceso), así que se compara en cada uso, también con la ya abierta.
+    """
+
+    def __init__(self):
+        self.directorio = None
+        self.columnas = None
+        self.meta = None
+        self._lock = threading.Lock()
+
+    def configurar(self, directorio):
+        """Fija el directorio; al cambiarlo se olvida la instantánea abierta"""
+        if directorio != self.directorio:
+            self.directorio = directorio
+            self.columnas = None
+            self.meta = None
+
+    def vigente(self, version, codificador):
+        """
+        Columnas de la instantánea si su firma es 'version' (la versión
+        actual de 'operaciones', recién leída), o None.
+
+        Al abrirla, los números de afiliado se registran en 'codificador'; si
+        el codificador ya tenía otros códigos las columnas de códigos se
+        traducen (y dejan de ser compartidas).
+        """
+        with self._lock:
+            if self.columnas is not None and self.meta['firma'] == version:
+                return self.columnas
+
+            abierta = self._abrir()
+            if abierta is None:
+                return None
+            columnas, numeros, meta = abierta
+            if meta['firma'] != version:
+                return None
+
+            mapa = codificador.codificar(numeros.tolist())
+            if not np.array_equal(mapa, np.arange(len(numeros))):
+                columnas = dict(columnas, codigo1=mapa[columnas['codigo1']], codigo2=mapa[columnas['codigo2']])
+
+            self.columnas, self.meta = columnas, meta
+            return columnas
+
+    def escribir(self, columnas, codificador, version):
+        """
+        Escribe una instantánea nueva con 'columnas' (todas las operaciones en
+        orden de id, leídas con la versión 'version' de la tabla) y la deja
+        vigente. No escribe nada si la tabla ya cambió de versión.
+
+        Returns:
+            bool: True si se escribió
+        """
+        if version_datos.version('operaciones') != version:
+            current_app.logger.info("La tabla de operaciones cambió; no se escribe la instantánea")
+            return False
+
+        with self._lock:
+            nombre = f"{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+            destino = os.path.join(self.directorio, nombre)
+            os.makedirs(destino)
+            for columna, tipo in COLUMNAS.items():
+                np.save(os.path.join(destino, f"{columna}.npy"), np.asarray(columnas[columna], dtype=tipo))
+            numeros = codificador.decodificar(np.arange(len(codificador)))
+            np.save(os.path.join(destino, 'numeros.npy'), np.array(numeros.tolist(), dtype=str))
+            meta = {'firma': version, 'filas': len(columnas['monto']), 'creada': datetime.now().isoformat()}
+            with open(os.path.join(destino, 'meta.json'), 'w') as archivo:
+                json.dump(meta, archivo)
+
+            temporal = os.path.join(self.directorio, f"{ARCHIVO_ACTUAL}.{nombre}")
+            with open(temporal, 'w') as archivo:
+                archivo.write(nombre)
+            os.replace(temporal, os.path.join(self.directorio, ARCHIVO_ACTUAL))
+            self._descartar_anteriores(nombre)
+
+            abierta = self._abrir()
+            self.columnas, self.meta = abierta[0], abierta[2]
+        current_app.logger.info(f"Instantánea de operaciones escrita: {nombre} ({meta['filas']} filas)")
+        return True
+
+    def agregar(self, columnas, codificador, version):
+        """Escribe una instantánea con las columnas vigentes seguidas de 'columnas'"""
+        previas = self.columnas
+        return self.escribir(
+            {nombre: np.concatenate([previas[nombre], columnas[nombre]]) for nombre in COLUMNAS},
+            codificador,
+            version
+        )
+
+    def _abrir(self):
+        """(columnas, numeros, meta) de la instantánea vigente en disco, o None"""
+        try:
+            with open(os.path.join(self.directorio, ARCHIVO_ACTUAL)) as archivo:
+                origen = os.path.join(self.directorio, archivo.read().strip())
+            with open(os.path.join(origen, 'meta.json')) as archivo:
+                meta = json.load(archivo)
+            columnas = {
+                columna: np.load(os.path.join(origen, f"{columna}.npy"), mmap_mode='r')
+                for columna in COLUMNAS
+            }
+            numeros = np.load(os.path.join(origen, 'numeros.npy'), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                current_app.logger.warning(f"No se pudo abrir la instantánea de operaciones: {str(e)}")
+            return None
+        return columnas, numeros, meta
+
+    def _descartar_anteriores(self, vigente):
+        """
+        Borra las instantáneas anteriores a la vigente (los nombres empiezan
+        con la fecha, así no se toca una más nueva que otro proceso esté
+        escribiendo). Quien todavía las tenga abiertas con mmap las sigue
+        leyendo hasta cerrarlas.
+        """
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre < vigente and os.path.isdir(ruta):
+                shutil.rmtree(ruta, ignore_errors=True)
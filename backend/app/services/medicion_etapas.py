@@ -0,0 +1,56 @@
+# app/services/medicion_etapas.py
+import time
+from contextlib import contextmanager
+
+
+class MedicionEtapas:
+    """
+    Tiempos por etapa y contadores de un cálculo de emparejamientos.
+
+    Cada etapa se mide con perf_counter y se acumula si se repite (por
+    ejemplo, una etapa dentro de un bucle). El resumen se devuelve en el
+    bloque 'perf' de la respuesta y se envía al logger.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.contadores = {}
+        self._abiertas = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        """Mide el bloque 'with' y lo suma a la etapa 'nombre'"""
+        desde = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + time.perf_counter() - desde
+
+    def iniciar(self, nombre):
+        """Empieza a medir 'nombre' (para bloques largos que no van en un 'with')"""
+        self._abiertas[nombre] = time.perf_counter()
+
+    def terminar(self, nombre):
+        """Suma a 'nombre' el tiempo desde iniciar"""
+        desde = self._abiertas.pop(nombre)
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + time.perf_counter() - desde
+
+    def contar(self, nombre, cantidad):
+        """Fija el contador 'nombre'"""
+        self.contadores[nombre] = int(cantidad)
+
+    def resumen(self):
+        """Tiempos en milisegundos (por etapa y total) y contadores"""
+        return {
+            'etapas_ms': {nombre: round(segundos * 1000, 2) for nombre, segundos in self.etapas.items()},
+            'total_ms': round((time.perf_counter() - self.inicio) * 1000, 2),
+            'contadores': dict(self.contadores),
+        }
+
+    def texto(self):
+        """Resumen en una línea para el log"""
+        resumen = self.resumen()
+        etapas = ', '.join(f"{nombre}={ms}ms" for nombre, ms in resumen['etapas_ms'].items())
+        contadores = ', '.join(f"{nombre}={valor}" for nombre, valor in resumen['contadores'].items())
+        return f"total={resumen['total_ms']}ms; {etapas}; {contadores}"
@@ -0,0 +1,244 @@
+# app/services/montos_sugeridos.py
+import numpy as np
+
+# Puntos de la grilla de montos candidatos por pareja
+PUNTOS_GRILLA = 50
+
+
+class GeneradorMontos:
+    """
+    Montos sugeridos para muchas parejas en una sola llamada.
+
+    Para cada pareja arma la grilla de montos candidatos del rango efectivo
+    (distribución tradicional o avanzada según el riesgo de patrón), quita los
+    montos excluidos y elige uno con pesos, todo con arreglos (parejas x 50).
+    Usa un numpy.random.Generator y consume exactamente un número aleatorio por
+    pareja y ronda, de modo que el resultado no depende de cómo se agrupen las
+    parejas en lotes: con la misma semilla y el mismo orden de parejas se
+    obtienen los mismos montos (auditorías y pruebas).
+    """
+
+    def __init__(self, semilla=None):
+        self.semilla = semilla
+        self.rng = np.random.default_rng(semilla)
+
+    def reservar(self, cantidad):
+        """
+        Números aleatorios de las próximas 'cantidad' parejas. Con ellos
+        (sugerir(..., aleatorios=...)) se pueden sugerir los montos de sólo
+        algunas de esas parejas y obtener lo mismo que sugiriendo todas.
+        """
+        return self.rng.random(cantidad)
+
+    def sugerir(self, inicios, fines, montos_pareja=None, riesgos=None, excluir=None, respaldo=True,
+                aleatorios=None):
+        """
+        Un monto sugerido por pareja.
+
+        Args:
+            inicios, fines: rango efectivo de cada pareja
+            montos_pareja: lista con los montos previos de cada pareja
+            riesgos: riesgo de patrón por pareja; si se indica se usa la
+                distribución avanzada (_calcular_monto_sugerido_mejorado),
+                si no, la tradicional
+            excluir: montos a evitar, un conjunto común o uno por pareja
+            respaldo: en modo avanzado, si la grilla queda vacía se prueba el
+                rango completo sin exclusiones y luego el punto medio
+            aleatorios: números de reservar para estas parejas (por defecto se
+                toman del generador)
+
+        Returns:
+            list: monto por pareja (int de la grilla, float del punto medio o
+            None si no hay candidatos)
+        """
+        inicios = np.asarray(inicios, dtype=np.float64)
+        fines = np.asarray(fines, dtype=np.float64)
+        cantidad = len(inicios)
+        if aleatorios is None:
+            aleatorios = self.rng.random(cantidad)
+        if cantidad == 0:
+            return []
+
+        if riesgos is None:
+            elegidos = self._elegir(self._grilla_tradicional(inicios, fines), excluir, aleatorios)
+            return self._a_lista(elegidos)
+
+        riesgos = np.asarray(riesgos, dtype=np.float64)
+        if montos_pareja is None:
+            montos_pareja = [()] * cantidad
+        desde, hasta = self._rango_por_historial(inicios, fines, montos_pareja, riesgos)
+        elegidos = self._elegir(self._grilla_avanzada(desde, hasta, fines - inicios, riesgos), excluir, aleatorios)
+
+        # Grilla vacía: método tradicional sobre el mismo rango y exclusiones
+        vacias = np.isnan(elegidos)
+        if vacias.any():
+            elegidos[vacias] = self._elegir(
+                self._grilla_tradicional(desde[vacias], hasta[vacias]),
+                self._filas(excluir, vacias), aleatorios[vacias]
+            )
+
+        vacias = np.isnan(elegidos)
+        if respaldo and vacias.any():
+            elegidos[vacias] = self._elegir(
+                self._grilla_tradicional(inicios[vacias], fines[vacias]), None, aleatorios[vacias]
+            )
+            medios = np.isnan(elegidos)
+            resultado = self._a_lista(elegidos)
+            for k in np.flatnonzero(medios):
+                resultado[k] = float(inicios[k] + fines[k]) / 2
+            return resultado
+        return self._a_lista(elegidos)
+
+    def sugerir_distintos(self, inicios, fines, montos_pareja=None, riesgos=None, excluir=None, cantidad=5):
+        """
+        Hasta 'cantidad' montos distintos por pareja: en cada ronda el monto
+        elegido se suma a las exclusiones de su pareja.
+
+        Returns:
+            list: lista de montos por pareja
+        """
+        parejas = len(inicios)
+        if isinstance(excluir, (list, tuple)):
+            exclusiones = [set(e or ()) for e in excluir]
+        else:
+            exclusiones = [set(excluir or ()) for _ in range(parejas)]
+        sugeridos = [[] for _ in range(parejas)]
+        activas = np.arange(parejas)
+
+        for _ in range(cantidad):
+            if not len(activas):
+                break
+            montos = self.sugerir(
+                np.asarray(inicios, dtype=np.float64)[activas],
+                np.asarray(fines, dtype=np.float64)[activas],
+                [montos_pareja[k] for k in activas] if montos_pareja is not None else None,
+                np.asarray(riesgos, dtype=np.float64)[activas] if riesgos is not None else None,
+                [exclusiones[k] for k in activas],
+                respaldo=False
+            )
+            siguen = []
+            for k, monto in zip(activas, montos):
+                if monto is not None:
+                    sugeridos[k].append(monto)
+                    exclusiones[k].add(monto)
+                    siguen.append(k)
+            activas = np.array(siguen, dtype=np.int64)
+        return sugeridos
+
+    @staticmethod
+    def _filas(excluir, mascara):
+        """Exclusiones de las filas seleccionadas (comunes o por pareja)"""
+        if isinstance(excluir, (list, tuple)):
+            return [excluir[k] for k in np.flatnonzero(mascara)]
+        return excluir
+
+    @staticmethod
+    def _columnas(puntos):
+        """Índice de columna (0..49) y máscara de columnas válidas por fila"""
+        columnas = np.arange(PUNTOS_GRILLA, dtype=np.float64)
+        return columnas, columnas[None, :] < puntos[:, None]
+
+    def _grilla_tradicional(self, inicios, fines):
+        """Grilla de _calcular_monto_sugerido con preferencia por montos altos"""
+        tamano = fines - inicios
+        # Si el rango comienza en 0 se prioriza el último tercio
+        desde = np.where(inicios == 0, np.maximum(inicios, fines - tamano / 3), inicios)
+        puntos = np.minimum(PUNTOS_GRILLA, np.trunc(tamano))
+        columnas, validas = self._columnas(puntos)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.sqrt(columnas[None, :] / puntos[:, None])
+        montos = np.round(desde[:, None] + (fines - desde)[:, None] * factor)
+        return montos, validas, None
+
+    def _grilla_avanzada(self, desde, hasta, tamano, riesgos):
+        """
+        Grilla de _calcular_monto_sugerido_mejorado: centrada con riesgo bajo
+        (< 30), bimodal con riesgo alto (> 70) y casi uniforme en el resto
+        """
+        puntos = np.minimum(PUNTOS_GRILLA, np.trunc(tamano))
+        columnas, validas = self._columnas(puntos)
+        bajo = (riesgos < 30)[:, None]
+        alto = (riesgos > 70)[:, None]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proporcion = columnas[None, :] / puntos[:, None]
+            mitad = (puntos / 2)[:, None]
+            bimodal = np.where(
+                columnas[None, :] < mitad,
+                (columnas[None, :] / mitad) * 0.3,
+                0.7 + ((columnas[None, :] - mitad) / mitad) * 0.3
+            )
+            factor = np.where(bajo, 0.5 + (proporcion - 0.5) * 0.8,
+                              np.where(alto, bimodal, proporcion ** 0.6))
+        montos = np.round(desde[:, None] + (hasta - desde)[:, None] * factor)
+        return montos, validas, (bajo, alto)
+
+    @staticmethod
+    def _rango_por_historial(inicios, fines, montos_pareja, riesgos):
+        """Con riesgo bajo e historial, acota el rango alrededor del monto medio"""
+        desde, hasta = inicios.copy(), fines.copy()
+        largos = np.fromiter(map(len, montos_pareja), dtype=np.int64, count=len(montos_pareja))
+        ajustar = np.flatnonzero((riesgos < 30) & (largos > 0))
+        if not len(ajustar):
+            return desde, hasta
+
+        previos = np.concatenate([np.asarray(montos_pareja[k], dtype=np.float64) for k in ajustar])
+        grupo = np.repeat(np.arange(len(ajustar)), largos[ajustar])
+        medio = np.bincount(grupo, weights=previos) / largos[ajustar]
+        desviacion = np.sqrt(np.bincount(grupo, weights=(previos - medio[grupo]) ** 2) / largos[ajustar])
+
+        tamano = fines[ajustar] - inicios[ajustar]
+        nuevo_desde = np.maximum(inicios[ajustar], medio - 2 * desviacion)
+        nuevo_hasta = np.minimum(fines[ajustar], medio + 2 * desviacion)
+        # Evitar que el rango quede demasiado chico
+        angosto = nuevo_hasta - nuevo_desde < tamano * 0.2
+        margen = tamano * 0.1
+        nuevo_desde = np.where(angosto, np.maximum(inicios[ajustar], medio - margen), nuevo_desde)
+        nuevo_hasta = np.where(angosto, np.minimum(fines[ajustar], medio + margen), nuevo_hasta)
+
+        desde[ajustar], hasta[ajustar] = nuevo_desde, nuevo_hasta
+        return desde, hasta
+
+    @staticmethod
+    def _elegir(grilla, excluir, aleatorios):
+        """
+        Elige un monto por fila con random.choices-equivalente (búsqueda del
+        aleatorio * total en los pesos acumulados). NaN si no quedan candidatos.
+        """
+        montos, validas, distribucion = grilla
+        filas = len(montos)
+        if not filas:
+            return np.empty(0)
+
+        validas = validas.copy()
+        if isinstance(excluir, (list, tuple)):
+            for k, excluidos in enumerate(excluir):
+                if excluidos:
+                    validas[k] &= ~np.isin(montos[k], np.fromiter(excluidos, dtype=np.float64))
+        elif excluir:
+            validas &= ~np.isin(montos, np.fromiter(excluir, dtype=np.float64))
+
+        # Posición de cada candidato entre los que quedan (0..m-1)
+        posicion = np.cumsum(validas, axis=1) - 1
+        candidatos = validas.sum(axis=1)
+        if isinstance(distribucion, tuple):
+            bajo, alto = distribucion
+            medio = (candidatos // 2)[:, None]
+            distancia = np.abs(posicion - medio)
+            pesos = np.where(bajo, np.maximum(1, medio - distancia),
+                             np.where(alto, np.maximum(1, distancia), posicion + 1))
+        else:
+            pesos = posicion + 1
+        pesos = np.where(validas, pesos, 0).astype(np.float64)
+
+        acumulados = np.cumsum(pesos, axis=1)
+        objetivo = aleatorios * acumulados[:, -1]
+        indice = np.minimum((acumulados <= objetivo[:, None]).sum(axis=1), PUNTOS_GRILLA - 1)
+        elegidos = montos[np.arange(filas), indice]
+        return np.where(candidatos > 0, elegidos, np.nan)
+
+    @staticmethod
+    def _a_lista(elegidos):
+        """Montos de la grilla como int (igual que round()); None si no hubo candidatos"""
+        return [None if np.isnan(m) else int(m) for m in elegidos.tolist()]
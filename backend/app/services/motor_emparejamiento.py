@@ -0,0 +1,704 @@
+# app/services/motor_emparejamiento.py
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from flask import current_app
+from app.services.indices_operaciones import NAT, LineaTiempoAfiliados
+from app.services.evaluacion_paralela import EvaluadorParalelo
+from app.services.medicion_etapas import MedicionEtapas
+from app.services.montos_sugeridos import GeneradorMontos
+from app.services.seleccion_resultados import SeleccionTopK
+from app.utils.cache_lru import CacheLRU
+
+LIMITE_IZIPAY = 800
+
+# Arreglos por pareja candidata que produce MotorVectorizado.extraer
+CARACTERISTICAS = (
+    'i', 'j', 'inicio', 'fin', 'con_historial', 'con_fecha', 'pos', 'dias',
+    'diversidad_minima', 'menor_diversidad', 'operaciones_minimas', 'menor_ops', 'patron',
+)
+
+# Canales de RangoAfiliado.recibe_en / envia_a como bits; 'Ambos' es la unión
+CANAL_IZIPAY = 1
+CANAL_IZIYA = 2
+BITS_CANAL = {'Izipay': CANAL_IZIPAY, 'Iziya': CANAL_IZIYA, 'Ambos': CANAL_IZIPAY | CANAL_IZIYA}
+TODOS_LOS_CANALES = CANAL_IZIPAY | CANAL_IZIYA
+
+
+def mascara_canales(canales):
+    """Máscara de bits de un conjunto de canales; sin canales registrados, todos"""
+    mascara = 0
+    for canal in canales:
+        mascara |= BITS_CANAL.get(canal, 0)
+    return mascara or TODOS_LOS_CANALES
+
+
+def tabla_compatibilidad():
+    """
+    Matriz (16 x 16) de compatibilidad entre perfiles de canal, con perfil =
+    envia << 2 | recibe. Dos afiliados son compatibles si cada uno envía a
+    alguno de los canales en que recibe el otro.
+    """
+    perfiles = np.arange(16)
+    envia, recibe = perfiles >> 2, perfiles & 3
+    envia_a_otro = (envia[:, None] & recibe[None, :]) != 0
+    return envia_a_otro & envia_a_otro.T
+
+
+TABLA_COMPATIBILIDAD = tabla_compatibilidad()
+
+
+class MotorVectorizado:
+    """
+    Motor vectorizado de emparejamientos.
+
+    Construye una sola vez los arreglos de características por afiliado
+    (rangos, diversidad, línea de tiempo) y por pareja (historial mutuo),
+    extrae por bloques las características de todas las parejas candidatas
+    y las puntúa con operaciones de NumPy. La extracción no depende de las
+    ponderaciones, así que puede reutilizarse (cache_caracteristicas).
+    Devuelve el mismo esquema y los mismos valores de riesgo que los
+    evaluadores iterativos de EmparejamientoService.
+    """
+
+    def __init__(self, servicio, tam_bloque=250000):
+        self.servicio = servicio
+        self.tam_bloque = tam_bloque
+        self.paralelo = EvaluadorParalelo()
+        # Características por clave de datos (EmparejamientoService._clave_caracteristicas):
+        # cambiar ponderaciones, riesgo máximo o días mínimos sólo vuelve a puntuar
+        self.cache_caracteristicas = CacheLRU(0)
+        # Perfiles por afiliado (perfil_afiliados) por modo, ventana y versión de los datos
+        self.cache_afiliados = CacheLRU(0)
+
+    def evaluar(self, rango_afiliados, operaciones, dias_minimos, riesgo_maximo,
+                monto_minimo=0, monto_maximo=0, ponderaciones=None, avanzado=False,
+                estadisticas=None, control=None, seleccion=None, procesos=None,
+                generador=None, clave_caracteristicas=None, medicion=None):
+        """
+        Evalúa todas las parejas de afiliados: extrae las características de
+        las candidatas (extraer) y las puntúa (puntuar).
+
+        Args:
+            estadisticas: dict de EmparejamientoService._nuevas_estadisticas a completar
+            control: ControlEjecucion; cuando se agota o se cancela no se
+                evalúan más bloques
+            seleccion: SeleccionTopK que recibe los resultados (por defecto, todos)
+            generador: GeneradorMontos para los montos sugeridos
+            procesos: si es mayor que 1, los bloques se evalúan en paralelo
+                (EvaluadorParalelo) con ese número de procesos
+            clave_caracteristicas: si se indica, las características completas
+                se guardan en cache_caracteristicas con esa clave
+            medicion: MedicionEtapas con los tiempos por etapa
+
+        Returns:
+            list: Resultados conservados por la selección, ordenados por riesgo,
+            con el esquema de _evaluar_emparejamientos / _evaluar_emparejamientos_avanzado
+        """
+        if medicion is None:
+            medicion = MedicionEtapas()
+        caracteristicas = self.extraer(
+            rango_afiliados, operaciones, monto_minimo, monto_maximo, avanzado, control, procesos, medicion
+        )
+        if caracteristicas is None:
+            return []
+        if clave_caracteristicas is not None and caracteristicas['completas']:
+            self.cache_caracteristicas.guardar(clave_caracteristicas, caracteristicas)
+
+        return self.puntuar(
+            caracteristicas, dias_minimos, riesgo_maximo, ponderaciones, avanzado,
+            estadisticas=estadisticas, control=control, seleccion=seleccion, generador=generador,
+            medicion=medicion
+        )
+
+    def extraer(self, rango_afiliados, operaciones, monto_minimo=0, monto_maximo=0, avanzado=False,
+                control=None, procesos=None, medicion=None):
+        """
+        Características de cada pareja candidata, independientes de las
+        ponderaciones, del riesgo máximo y de los días mínimos: días desde la
+        última operación mutua, diversidad mínima, operaciones intermedias
+        mínimas y (en modo avanzado) riesgo de patrón, con los afiliados que
+        aportan cada mínimo.
+
+        Returns:
+            dict: arreglos por candidata (en el orden del doble bucle) más
+            numeros, nombres, candidatas (conteos), procesadas y completas;
+            None si hay menos de 2 afiliados
+        """
+        if medicion is None:
+            medicion = MedicionEtapas()
+        with medicion.etapa('preparacion_fechas'):
+            self.servicio._preparar_fechas(operaciones, avanzado=avanzado)
+        with medicion.etapa('consolidacion_rangos'):
+            rangos_consolidados = self.servicio._consolidar_rangos(rango_afiliados, avanzado=avanzado)
+
+        if len(rangos_consolidados) < 2:
+            if avanzado:
+                current_app.logger.warning("Se necesitan al menos 2 afiliados para calcular emparejamientos")
+            return None
+
+        numeros = list(rangos_consolidados.keys())
+        with medicion.etapa('filtrado_parejas'):
+            candidatas = self.parejas_candidatas(rangos_consolidados, avanzado, monto_minimo, monto_maximo)
+        with medicion.etapa('indices'):
+            indices = self._indexar_operaciones(operaciones, numeros, avanzado)
+
+        parametros = {
+            'n': len(numeros),
+            'hoy': np.datetime64(datetime.now().date(), 'D'),
+            'avanzado': avanzado,
+        }
+        with medicion.etapa('caracteristicas'):
+            if procesos and procesos > 1 and len(candidatas['i']) >= self.paralelo.min_parejas:
+                bloques = self.paralelo.bloques(self, candidatas, indices, parametros, procesos, control)
+            else:
+                bloques = self._bloques_en_serie(candidatas, indices, parametros, control)
+
+            bloques = list(bloques)
+            if not bloques:
+                bloques = [self._caracteristicas_bloque(
+                    *(candidatas[clave][:0] for clave in ('i', 'j', 'inicio', 'fin')), indices, parametros
+                )]
+            caracteristicas = {
+                clave: np.concatenate([bloque[clave] for bloque in bloques])
+                for clave in CARACTERISTICAS if bloques[0][clave] is not None
+            }
+        procesadas = len(caracteristicas['i'])
+
+        caracteristicas.update({
+            'numeros': numeros,
+            'nombres': [info['nombre_completo'] for info in rangos_consolidados.values()],
+            # Montos previos por pareja (entrada de IndiceParejas) para los montos sugeridos
+            'montos_pareja': indices['parejas'].montos,
+            'entrada_pareja': indices['entrada_pareja'],
+            'candidatas': {clave: candidatas[clave] for clave in
+                           ('total', 'sin_superposicion', 'canal_incompatible', 'rango_invalido')},
+            'pendientes': len(candidatas['i']) - procesadas,
+            'completas': procesadas == len(candidatas['i']),
+            'operaciones': len(operaciones),
+        })
+        return caracteristicas
+
+    def perfil_afiliados(self, rango_afiliados, operaciones, avanzado=False, medicion=None):
+        """
+        Características por afiliado para evaluar a uno contra todos
+        (mejores_parejas): arreglos de rangos y canales, diversidad, línea de
+        tiempo e historial por pareja. No depende de las ponderaciones ni de
+        los filtros de la consulta, así que se guarda por versión de los datos
+        (cache_afiliados).
+
+        Returns:
+            dict: numeros, nombres, posiciones (numero -> posición), afiliados,
+            indices y operaciones; None si hay menos de 2 afiliados
+        """
+        if medicion is None:
+            medicion = MedicionEtapas()
+        with medicion.etapa('preparacion_fechas'):
+            self.servicio._preparar_fechas(operaciones, avanzado=avanzado)
+        with medicion.etapa('consolidacion_rangos'):
+            rangos_consolidados = self.servicio._consolidar_rangos(rango_afiliados, avanzado=avanzado)
+        if len(rangos_consolidados) < 2:
+            return None
+
+        numeros = list(rangos_consolidados.keys())
+        with medicion.etapa('indices'):
+            afiliados = self._arreglos_afiliados(rangos_consolidados, avanzado)
+            indices = self._indexar_operaciones(operaciones, numeros, avanzado)
+        return {
+            'numeros': numeros,
+            'nombres': [info['nombre_completo'] for info in rangos_consolidados.values()],
+            'posiciones': {numero: pos for pos, numero in enumerate(numeros)},
+            'afiliados': afiliados,
+            'indices': indices,
+            'operaciones': len(operaciones),
+        }
+
+    def mejores_parejas(self, perfil, numero, dias_minimos, riesgo_maximo, monto_minimo=0, monto_maximo=0,
+                        ponderaciones=None, avanzado=False, estadisticas=None, seleccion=None,
+                        generador=None, medicion=None):
+        """
+        Evalúa al afiliado 'numero' contra todos los demás con el perfil
+        precalculado: sólo las N - 1 parejas que lo incluyen, con las mismas
+        características y el mismo riesgo que en evaluar.
+
+        Returns:
+            list: Resultados conservados por la selección, ordenados por riesgo
+        """
+        if medicion is None:
+            medicion = MedicionEtapas()
+        indices = perfil['indices']
+        with medicion.etapa('filtrado_parejas'):
+            candidatas = self.parejas_de(perfil['afiliados'], perfil['posiciones'][numero],
+                                         avanzado, monto_minimo, monto_maximo)
+        with medicion.etapa('caracteristicas'):
+            caracteristicas = self._caracteristicas_bloque(
+                candidatas['i'], candidatas['j'], candidatas['inicio'], candidatas['fin'], indices, {
+                    'n': len(perfil['numeros']),
+                    'hoy': np.datetime64(datetime.now().date(), 'D'),
+                    'avanzado': avanzado,
+                }
+            )
+        caracteristicas.update({
+            'numeros': perfil['numeros'],
+            'nombres': perfil['nombres'],
+            'montos_pareja': indices['parejas'].montos,
+            'entrada_pareja': indices['entrada_pareja'],
+            'candidatas': {clave: candidatas[clave] for clave in
+                           ('total', 'sin_superposicion', 'canal_incompatible', 'rango_invalido')},
+            'pendientes': 0,
+            'completas': True,
+            'operaciones': perfil['operaciones'],
+        })
+        return self.puntuar(
+            caracteristicas, dias_minimos, riesgo_maximo, ponderaciones, avanzado,
+            estadisticas=estadisticas, seleccion=seleccion, generador=generador, medicion=medicion
+        )
+
+    def puntuar(self, caracteristicas, dias_minimos, riesgo_maximo, ponderaciones=None, avanzado=False,
+                estadisticas=None, control=None, seleccion=None, generador=None, medicion=None):
+        """
+        Aplica los días mínimos, calcula el riesgo con las ponderaciones y
+        ofrece las parejas aceptadas a la selección. Sólo opera sobre los
+        arreglos de 'caracteristicas' (de extraer o de cache_caracteristicas),
+        sin leer datos ni recorrer historiales.
+
+        Returns:
+            list: Resultados conservados por la selección, ordenados por riesgo
+        """
+        if estadisticas is None:
+            estadisticas = self.servicio._nuevas_estadisticas()
+        if seleccion is None:
+            seleccion = SeleccionTopK()
+        if generador is None:
+            generador = GeneradorMontos()
+        if medicion is None:
+            medicion = MedicionEtapas()
+
+        self.servicio._registrar_candidatas(estadisticas, caracteristicas['candidatas'])
+        with medicion.etapa('puntuacion'):
+            evaluado = self._puntuar(caracteristicas, {
+                'dias_minimos': dias_minimos,
+                'riesgo_maximo': riesgo_maximo,
+                'pesos': self._normalizar_ponderaciones(ponderaciones or {}) if avanzado else None,
+                'avanzado': avanzado,
+            })
+        estadisticas['evaluadas'] += evaluado['evaluadas']
+        estadisticas['descartadas']['dias_minimos'] += evaluado['descartadas_dias']
+        estadisticas['descartadas']['riesgo_maximo'] += evaluado['evaluadas'] - len(evaluado['i'])
+        with medicion.etapa('serializacion'):
+            self._construir_resultados(evaluado, caracteristicas, avanzado, seleccion, generador)
+            resultados = seleccion.resultados()
+
+        if caracteristicas['pendientes']:
+            self.servicio._agotar_presupuesto(estadisticas, caracteristicas['pendientes'], control)
+
+        if avanzado:
+            current_app.logger.info(
+                f"Emparejamiento completado: {seleccion.total} resultados de {estadisticas['combinaciones']} combinaciones posibles"
+            )
+        return resultados
+
+    def _arreglos_afiliados(self, rangos_consolidados, avanzado):
+        """
+        Matrices (N x K) de inicio/fin de rangos, perfil de canales (máscaras
+        envia << 2 | recibe) y bandera Izipay por afiliado
+        """
+        n = len(rangos_consolidados)
+        k = max(len(info['rangos']) for info in rangos_consolidados.values())
+
+        # Relleno con un rango vacío (inicio > fin) que nunca se superpone
+        inicios = np.full((n, k), np.inf)
+        fines = np.full((n, k), -np.inf)
+        recibe = np.zeros(n, dtype=np.uint8)
+        envia = np.zeros(n, dtype=np.uint8)
+        izipay = np.zeros(n, dtype=bool)
+
+        canales_izipay = {'Izipay', 'Ambos'} if avanzado else {'Izipay'}
+        for pos, info in enumerate(rangos_consolidados.values()):
+            for r, rango in enumerate(info['rangos']):
+                inicios[pos, r] = rango['inicio']
+                fines[pos, r] = rango['fin']
+            recibe[pos] = mascara_canales(info['recibe_en'])
+            envia[pos] = mascara_canales(info['envia_a'])
+            izipay[pos] = bool(canales_izipay & info['recibe_en'])
+
+        return {'inicios': inicios, 'fines': fines, 'perfiles': (envia << 2) | recibe, 'izipay': izipay}
+
+    def _indexar_operaciones(self, operaciones, numeros, avanzado=False):
+        """
+        Construye en una pasada las características por afiliado y por pareja.
+
+        - diversidad: contrapartes distintas por afiliado (IndiceDiversidad)
+        - línea de tiempo: vista CSR de LineaTiempoAfiliados (fecha_completa
+          ordenada y total de operaciones por afiliado)
+        - historial: por pareja (i < j) la entrada de IndiceParejas, leída en
+          tiempo lineal sobre las parejas con historial
+        - patron_pareja: en modo avanzado, el riesgo de patrón de cada pareja con
+          historial (IndiceParejas.riesgos_patron)
+        """
+        n = len(numeros)
+        codigos = self.servicio.codificador.codificar(numeros)
+
+        indices = self.servicio.obtener_indices(operaciones)
+        diversidad = indices.diversidad.contar(codigos)
+        linea_tiempo = indices.linea_tiempo.vista(codigos)
+
+        # Historial por pareja: se traducen los códigos de cada entrada del
+        # índice a posiciones de afiliado con clave canónica menor*N + mayor
+        parejas = indices.parejas
+        arreglos = parejas.arreglos()
+        posiciones = np.full(len(self.servicio.codificador), -1, dtype=np.int64)
+        posiciones[codigos] = np.arange(n)
+        p1 = posiciones[arreglos['menores']]
+        p2 = posiciones[arreglos['mayores']]
+        entradas = np.flatnonzero((p1 >= 0) & (p2 >= 0))
+        claves = (np.minimum(p1[entradas], p2[entradas]).astype(np.int64) * n +
+                  np.maximum(p1[entradas], p2[entradas]))
+        orden = np.argsort(claves)
+        entradas = entradas[orden]
+
+        if avanzado:
+            patron = parejas.riesgos_patron()[entradas]
+        else:
+            patron = np.full(len(entradas), 50.0)
+
+        return {
+            'diversidad': diversidad,
+            'linea_tiempo': linea_tiempo,
+            'parejas': parejas,
+            'claves_pareja': claves[orden],
+            'entrada_pareja': entradas,
+            'ultima_fecha': arreglos['ultimas_fechas'][entradas],
+            'ultima_completa': arreglos['ultimas_completas'][entradas],
+            'patron_pareja': patron,
+        }
+
+    def parejas_candidatas(self, rangos_consolidados, avanzado=False, monto_minimo=0, monto_maximo=0):
+        """
+        Lista, con un barrido por inicio de rango, sólo las parejas (i < j) cuyos
+        rangos se superponen y cuyos canales son compatibles (TABLA_COMPATIBILIDAD),
+        con el rango efectivo ya resuelto: la superposición más amplia, el
+        límite de Izipay y (en modo avanzado) los montos mínimo y máximo. Todo
+        se resuelve con arreglos antes de consultar historiales; las parejas
+        quedan en el orden del doble bucle.
+
+        Returns:
+            dict: i, j, inicio, fin (arreglos) y los conteos total,
+            sin_superposicion, canal_incompatible y rango_invalido
+        """
+        n = len(rangos_consolidados)
+        total = n * (n - 1) // 2
+        if not n:
+            vacio = np.empty(0, dtype=np.int64)
+            return {'i': vacio, 'j': vacio, 'inicio': np.empty(0), 'fin': np.empty(0),
+                    'total': 0, 'sin_superposicion': 0, 'canal_incompatible': 0, 'rango_invalido': 0}
+
+        afiliados = self._arreglos_afiliados(rangos_consolidados, avanzado)
+        i, j, inicio, fin = self._superposiciones(afiliados['inicios'], afiliados['fines'])
+        return self._rango_efectivo(afiliados, i, j, inicio, fin, total, avanzado, monto_minimo, monto_maximo)
+
+    def _rango_efectivo(self, afiliados, i, j, inicio, fin, total, avanzado=False, monto_minimo=0, monto_maximo=0):
+        """
+        Aplica a las parejas con rangos superpuestos la compatibilidad de
+        canales, el límite de Izipay y los montos mínimo y máximo, con los
+        conteos de parejas_candidatas ('total' = parejas consideradas)
+        """
+        superpuestas = len(i)
+
+        # Compatibilidad de canales por perfil de cada afiliado
+        perfiles = afiliados['perfiles']
+        compatibles = TABLA_COMPATIBILIDAD[perfiles[i], perfiles[j]]
+        i, j, inicio, fin = i[compatibles], j[compatibles], inicio[compatibles], fin[compatibles]
+
+        # Límite de Izipay
+        izipay = afiliados['izipay'][i] | afiliados['izipay'][j]
+        fin = np.where(izipay, np.minimum(fin, LIMITE_IZIPAY), fin)
+
+        if avanzado:
+            if monto_minimo and monto_minimo > 0:
+                inicio = np.maximum(inicio, monto_minimo)
+            if monto_maximo and monto_maximo > 0:
+                fin = np.minimum(fin, monto_maximo)
+
+        valido = fin > inicio
+        return {
+            'i': i[valido], 'j': j[valido], 'inicio': inicio[valido], 'fin': fin[valido],
+            'total': total,
+            'sin_superposicion': total - superpuestas,
+            'canal_incompatible': superpuestas - len(i),
+            'rango_invalido': len(i) - int(valido.sum()),
+        }
+
+    def parejas_de(self, afiliados, x, avanzado=False, monto_minimo=0, monto_maximo=0):
+        """
+        parejas_candidatas restringida a las parejas del afiliado en la
+        posición x: compara sus rangos con los de cada otro afiliado en
+        O(N * K²), con la misma superposición más amplia y los mismos
+        desempates que _superposiciones. Las parejas quedan como (i < j) y en
+        el orden del doble bucle.
+
+        Args:
+            afiliados: arreglos de _arreglos_afiliados
+        """
+        inicios, fines = afiliados['inicios'], afiliados['fines']
+        n, k = inicios.shape
+        otros = np.delete(np.arange(n, dtype=np.int64), x)
+
+        # (otros, rango de x, rango del otro); los rangos vacíos o de relleno no cuentan
+        inicio = np.maximum(inicios[x][None, :, None], inicios[otros][:, None, :])
+        fin = np.minimum(fines[x][None, :, None], fines[otros][:, None, :])
+        validos = (fines[x] > inicios[x])[None, :, None] & (fines[otros] > inicios[otros])[:, None, :]
+        ancho = np.where(validos & (fin > inicio), fin - inicio, -np.inf)
+
+        # A igual ancho gana el primer rango del afiliado de menor posición,
+        # luego el del otro: se recorre en ese orden y se toma el primer máximo
+        antes = otros < x
+        ancho = np.where(antes[:, None, None], ancho.transpose(0, 2, 1), ancho).reshape(len(otros), k * k)
+        mejor = np.argmax(ancho, axis=1)
+        filas = np.arange(len(otros))
+        superpuesta = np.isfinite(ancho[filas, mejor])
+        menor, mayor = mejor // k, mejor % k
+        rango_x = np.where(antes, mayor, menor)
+        rango_otro = np.where(antes, menor, mayor)
+        inicio = inicio[filas, rango_x, rango_otro][superpuesta]
+        fin = fin[filas, rango_x, rango_otro][superpuesta]
+
+        otros = otros[superpuesta]
+        i, j = np.minimum(otros, x), np.maximum(otros, x)
+        return self._rango_efectivo(afiliados, i, j, inicio, fin, n - 1, avanzado, monto_minimo, monto_maximo)
+
+    @staticmethod
+    def _superposiciones(inicios, fines):
+        """
+        Superposición más amplia de cada pareja de afiliados con rangos que se
+        cruzan, sin recorrer las N² parejas.
+
+        Los rangos se ordenan por inicio; cada rango sólo puede cruzarse con los
+        que empiezan después de él y antes de su fin, que forman un tramo
+        contiguo del orden. Los empates de ancho se resuelven como
+        _calcular_rango_efectivo (primer rango del afiliado i, luego de j).
+
+        Returns:
+            tuple: (i, j, inicio, fin) ordenados por (i, j)
+        """
+        n, k = inicios.shape
+        duenos = np.repeat(np.arange(n, dtype=np.int64), k)
+        numero_rango = np.tile(np.arange(k, dtype=np.int64), n)
+        inicios, fines = inicios.ravel(), fines.ravel()
+
+        # Un rango vacío (o el relleno) no se superpone con ninguno
+        orden = np.flatnonzero(fines > inicios)
+        orden = orden[np.argsort(inicios[orden], kind='stable')]
+        duenos, numero_rango = duenos[orden], numero_rango[orden]
+        inicios, fines = inicios[orden], fines[orden]
+
+        m = len(inicios)
+        hasta = np.searchsorted(inicios, fines, side='left')
+        cantidades = hasta - np.arange(m) - 1
+        desplazamientos = np.cumsum(cantidades) - cantidades
+        a = np.repeat(np.arange(m, dtype=np.int64), cantidades)
+        b = np.arange(int(cantidades.sum()), dtype=np.int64) - np.repeat(desplazamientos, cantidades) + a + 1
+
+        distintos = duenos[a] != duenos[b]
+        a, b = a[distintos], b[distintos]
+        intercambiar = duenos[a] > duenos[b]
+        a, b = np.where(intercambiar, b, a), np.where(intercambiar, a, b)
+
+        inicio = np.maximum(inicios[a], inicios[b])
+        fin = np.minimum(fines[a], fines[b])
+        claves = duenos[a] * n + duenos[b]
+
+        # Por pareja: mayor ancho y, a igual ancho, el primer par de rangos
+        orden = np.lexsort((numero_rango[b], numero_rango[a], -(fin - inicio), claves))
+        claves = claves[orden]
+        primeras = orden[np.r_[True, claves[1:] != claves[:-1]]] if len(claves) else orden
+        return duenos[a][primeras], duenos[b][primeras], inicio[primeras], fin[primeras]
+
+    @staticmethod
+    def _normalizar_ponderaciones(ponderaciones):
+        """Replica la normalización de ponderaciones de _calcular_riesgo_mejorado"""
+        pesos = [
+            max(0, min(1, ponderaciones.get('dias', 0.4))),
+            max(0, min(1, ponderaciones.get('diversidad', 0.25))),
+            max(0, min(1, ponderaciones.get('operaciones', 0.25))),
+            max(0, min(1, ponderaciones.get('patron', 0.1))),
+        ]
+        suma = pesos[0] + pesos[1] + pesos[2] + pesos[3]
+        if suma > 0:
+            return [p / suma for p in pesos]
+        return [0.4, 0.25, 0.25, 0.1]
+
+    def _bloques_en_serie(self, candidatas, indices, parametros, control=None):
+        """Extrae las características de los bloques en orden hasta agotar el control"""
+        for desde in range(0, len(candidatas['i']), self.tam_bloque):
+            if control is not None and control.agotado():
+                return
+            bloque = slice(desde, desde + self.tam_bloque)
+            yield self._caracteristicas_bloque(
+                candidatas['i'][bloque], candidatas['j'][bloque],
+                candidatas['inicio'][bloque], candidatas['fin'][bloque],
+                indices, parametros
+            )
+
+    def _caracteristicas_bloque(self, i, j, inicio, fin, indices, parametros):
+        """
+        Características de un bloque de parejas candidatas (sin filtrar). Sólo
+        usa arreglos de 'indices', por lo que también corre en los procesos de
+        EvaluadorParalelo.
+        """
+        # Historial mutuo
+        con_historial, pos = self._buscar_parejas(i * parametros['n'] + j, indices)
+        ultima_fecha = np.full(len(i), NAT, dtype=np.int64)
+        ultima_fecha[con_historial] = indices['ultima_fecha'][pos[con_historial]]
+        con_fecha = ultima_fecha != NAT
+        dias = np.zeros(len(i), dtype=np.int64)
+        dias[con_fecha] = (parametros['hoy'] - ultima_fecha[con_fecha].astype('datetime64[ns]').astype('datetime64[D]')).astype(np.int64)
+
+        # Diversidad
+        diversidad_1 = indices['diversidad'][i]
+        diversidad_2 = indices['diversidad'][j]
+        diversidad_minima = np.minimum(diversidad_1, diversidad_2)
+        menor_diversidad = np.where(diversidad_1 < diversidad_2, i, j)
+
+        # Operaciones desde la última operación mutua
+        ops_1, ops_2 = self._operaciones_desde(i, j, con_historial, pos, indices)
+        operaciones_minimas = np.minimum(ops_1, ops_2)
+        menor_ops = np.where(ops_1 <= ops_2, i, j)
+
+        return {
+            'i': i, 'j': j, 'inicio': inicio, 'fin': fin,
+            'con_historial': con_historial, 'con_fecha': con_fecha, 'pos': pos, 'dias': dias,
+            'diversidad_minima': diversidad_minima, 'menor_diversidad': menor_diversidad,
+            'operaciones_minimas': operaciones_minimas, 'menor_ops': menor_ops,
+            'patron': self._patrones(con_historial, pos, indices) if parametros['avanzado'] else None,
+        }
+
+    def _puntuar(self, caracteristicas, parametros):
+        """
+        Filtra por días mínimos y riesgo máximo y devuelve las parejas
+        aceptadas con su riesgo
+        """
+        con_fecha, dias = caracteristicas['con_fecha'], caracteristicas['dias']
+        valido = ~(con_fecha & (dias < parametros['dias_minimos']))
+        sel = np.flatnonzero(valido)
+
+        dias_riesgo = np.where(con_fecha[sel], dias[sel], 1000).astype(np.float64)
+        diversidad_minima = caracteristicas['diversidad_minima'][sel]
+        operaciones_minimas = caracteristicas['operaciones_minimas'][sel]
+
+        if parametros['avanzado']:
+            riesgo = self._riesgo_mejorado(
+                dias_riesgo, diversidad_minima, operaciones_minimas,
+                caracteristicas['patron'][sel], parametros['pesos']
+            )
+        else:
+            riesgo = (
+                (100 / (dias_riesgo + 1)) * 0.4 +
+                (100 / (diversidad_minima + 1)) * 0.3 +
+                (100 / (operaciones_minimas + 1)) * 0.3
+            )
+
+        aceptada = riesgo <= parametros['riesgo_maximo']
+        filas = sel[aceptada]
+        evaluado = {
+            clave: caracteristicas[clave][filas] for clave in CARACTERISTICAS
+            if caracteristicas.get(clave) is not None
+        }
+        evaluado.update({
+            'riesgo': riesgo[aceptada],
+            'evaluadas': len(riesgo),
+            'descartadas_dias': len(con_fecha) - len(sel),
+        })
+        return evaluado
+
+    @staticmethod
+    def _buscar_parejas(claves, indices):
+        """Ubica cada clave de pareja en el historial; devuelve (encontrada, posición)"""
+        claves_pareja = indices['claves_pareja']
+        if not len(claves_pareja):
+            return np.zeros(len(claves), dtype=bool), np.zeros(len(claves), dtype=np.int64)
+        pos = np.minimum(np.searchsorted(claves_pareja, claves), len(claves_pareja) - 1)
+        return claves_pareja[pos] == claves, pos
+
+    def _operaciones_desde(self, i, j, con_historial, pos, indices):
+        """Operaciones de cada afiliado posteriores a la última operación mutua"""
+        linea_tiempo = indices['linea_tiempo']
+        ops_1 = linea_tiempo['total_ops'][i]
+        ops_2 = linea_tiempo['total_ops'][j]
+        if not con_historial.any():
+            return ops_1, ops_2
+
+        ultima = indices['ultima_completa'][pos[con_historial]]
+        ops_1[con_historial] = LineaTiempoAfiliados.contar_posteriores(linea_tiempo, i[con_historial], ultima)
+        ops_2[con_historial] = LineaTiempoAfiliados.contar_posteriores(linea_tiempo, j[con_historial], ultima)
+        # Sin fecha_completa válida ninguna operación es posterior
+        sin_fecha = np.flatnonzero(con_historial)[ultima == NAT]
+        ops_1[sin_fecha] = 0
+        ops_2[sin_fecha] = 0
+        return ops_1, ops_2
+
+    @staticmethod
+    def _patrones(con_historial, pos, indices):
+        """Riesgo de patrón por pareja (50 sin historial)"""
+        patron = np.full(len(con_historial), 50.0)
+        patron[con_historial] = indices['patron_pareja'][pos[con_historial]]
+        return patron
+
+    @staticmethod
+    def _riesgo_mejorado(dias, diversidad_minima, operaciones_minimas, patron, pesos):
+        """Versión vectorizada de _calcular_riesgo_mejorado"""
+        pond_dias, pond_diversidad, pond_operaciones, pond_patron = pesos
+        riesgo_dias = (1.0 / (1.0 + 0.1 * np.maximum(0, dias))) * 100
+        riesgo_diversidad = (1.0 / (1.0 + 0.2 * np.maximum(0, diversidad_minima))) * 100
+        riesgo_operaciones = (1.0 / (1.0 + 0.15 * np.maximum(0, operaciones_minimas))) * 100
+        riesgo_patron = np.maximum(0, np.minimum(100, patron))
+        riesgo = (
+            (riesgo_dias * pond_dias) +
+            (riesgo_diversidad * pond_diversidad) +
+            (riesgo_operaciones * pond_operaciones) +
+            (riesgo_patron * pond_patron)
+        )
+        return np.minimum(100, np.maximum(0, riesgo))
+
+    def _construir_resultados(self, evaluado, caracteristicas, avanzado, seleccion, generador):
+        """
+        Ofrece las parejas aceptadas a la selección en lote: sólo se
+        serializan las que pueden quedar entre las k de menor riesgo
+        (SeleccionTopK.agregar_lote). Los números aleatorios de los montos se
+        reservan para todas en el orden del doble bucle, así los montos que
+        se sugieren son los mismos que si se sugirieran todos.
+        """
+        numeros, nombres = caracteristicas['numeros'], caracteristicas['nombres']
+        aleatorios = generador.reservar(len(evaluado['i']))
+
+        def sugerir_montos(posiciones):
+            inicios, fines = evaluado['inicio'][posiciones], evaluado['fin'][posiciones]
+            if not avanzado:
+                return generador.sugerir(inicios, fines, aleatorios=aleatorios[posiciones])
+            montos, entradas = caracteristicas['montos_pareja'], caracteristicas['entrada_pareja']
+            montos_pareja = [
+                montos[entradas[pos]] if con_historial else []
+                for con_historial, pos in zip(evaluado['con_historial'][posiciones].tolist(),
+                                              evaluado['pos'][posiciones].tolist())
+            ]
+            return generador.sugerir(inicios, fines, montos_pareja, evaluado['patron'][posiciones],
+                                     aleatorios=aleatorios[posiciones])
+
+        def resultado(k, monto_sugerido):
+            i, j = int(evaluado['i'][k]), int(evaluado['j'][k])
+            dias = int(evaluado['dias'][k]) if evaluado['con_fecha'][k] else "Sin operaciones previas"
+            diversidad_minima = int(evaluado['diversidad_minima'][k])
+            operaciones_minimas = int(evaluado['operaciones_minimas'][k])
+            return {
+                "afiliado1": nombres[i],
+                "afiliado2": nombres[j],
+                "dias_desde_ultima": dias,
+                "diversidad_minima": f"{diversidad_minima} ({nombres[evaluado['menor_diversidad'][k]]})",
+                "operaciones_intermedias_minimas": f"{operaciones_minimas} ({nombres[evaluado['menor_ops'][k]]})",
+                "monto_asignado": monto_sugerido,
+                "riesgo": round(float(evaluado['riesgo'][k]), 2),
+                "pareja": [numeros[i], numeros[j]]
+            }
+
+        seleccion.agregar_lote(evaluado['riesgo'], sugerir_montos, resultado,
+                               parejas=(evaluado['i'], evaluado['j'], numeros))
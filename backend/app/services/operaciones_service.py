@@ -9,6 +9,7 @@ from sqlalchemy import text
 from app import db
 from app.models.operacion import Operacion
 from app.services.base_service import BaseService
+from app.utils import version_datos
 from app.utils.exceptions import ValidationError, ProcessingError
 
 class OperacionesService(BaseService):
@@ -61,13 +62,28 @@ class OperacionesService(BaseService):
                 'nombre2': record[3],
                 'monto': record[4]
             } for record in records])
+            # Antes del commit y con el lock de escritura tomado: la versión que
+            # reemplaza y la que deja esta transacción, sin cargas de otros en el medio
+            version_previa = version_datos.version_previa('operaciones')
+            version_nueva = version_datos.version('operaciones')
             db.session.commit()
-            return len(records)
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Database insert error: {str(e)}")
             raise ProcessingError(f"Error insertando registros: {str(e)}")
 
+        # Mantener al día los índices del emparejador sin reconstruirlos
+        try:
+            from app.services import emparejamiento_service
+            emparejamiento_service.registrar_operaciones(
+                pd.DataFrame(records, columns=['fecha', 'hora', 'nombre1', 'nombre2', 'monto']),
+                version_previa,
+                version_nueva
+            )
+        except Exception as e:
+            current_app.logger.error(f"Error actualizando índices del emparejador: {str(e)}")
+        return len(records)
+
     def procesar_archivos(self, files):
         upload_id = f"upload_{int(time.time())}"
         current_app.logger.info(f"Iniciando carga con ID: {upload_id}")
@@ -0,0 +1,119 @@
+# app/services/patrones_operaciones.py
+from datetime import date, datetime
+import numpy as np
+
+DIA_NS = 86400 * 10**9
+
+# Diferencia máxima (escala 0-100) con el cálculo por pareja en Python puro:
+# las sumas por grupo de np.bincount y np.sqrt redondean distinto de sum() y
+# ** 0.5 en el último bit
+TOLERANCIA_PATRON = 1e-9
+
+
+def _coeficientes_variacion(valores, grupo, cantidad):
+    """
+    Coeficiente de variación (desviación poblacional / media) por grupo en
+    una pasada de np.bincount por momento. Devuelve (cv, media) con NaN en
+    los grupos sin valores.
+    """
+    largos = np.bincount(grupo, minlength=cantidad)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.bincount(grupo, weights=valores, minlength=cantidad) / largos
+        varianza = np.bincount(grupo, weights=np.square(valores - media[grupo]), minlength=cantidad) / largos
+        return np.sqrt(varianza) / media, media
+
+
+def riesgo_patron_parejas(montos, fechas):
+    """
+    Riesgo de patrón de cada pareja en una sola pasada agrupada.
+
+    60% regularidad de montos (coeficiente de variación de los montos
+    positivos) y 40% regularidad temporal (coeficiente de variación de los
+    días entre fechas distintas consecutivas); 50 cuando no hay datos
+    suficientes. Es la única implementación de la fórmula: la usan los
+    índices, los motores y las consultas de detalle (ver riesgo_patron).
+
+    Args:
+        montos: lista con el arreglo de montos de cada pareja (orden de registro)
+        fechas: lista con el arreglo datetime64 de fechas de cada pareja
+
+    Returns:
+        np.ndarray: riesgo de patrón (0-100) por pareja
+    """
+    cantidad = len(montos)
+    if cantidad == 0:
+        return np.full(0, 50.0)
+    largos = np.fromiter(map(len, montos), dtype=np.int64, count=cantidad)
+    return riesgo_patron_segmentos(np.concatenate(montos), np.concatenate(fechas), largos)
+
+
+def riesgo_patron_segmentos(montos, fechas, largos):
+    """
+    riesgo_patron_parejas sobre los historiales ya concatenados: la pareja k
+    ocupa largos[k] posiciones consecutivas de 'montos' y 'fechas' (así los
+    guarda IndiceParejas).
+    """
+    cantidad = len(largos)
+    riesgo = np.full(cantidad, 50.0)
+    if cantidad == 0:
+        return riesgo
+    pareja = np.repeat(np.arange(cantidad), largos)
+
+    # Regularidad de montos: sólo montos positivos
+    todos = np.asarray(montos, dtype=np.float64)
+    positivos = todos > 0
+    grupo_montos = pareja[positivos]
+    montos_validos = np.bincount(grupo_montos, minlength=cantidad)
+    cv_montos, _ = _coeficientes_variacion(todos[positivos], grupo_montos, cantidad)
+    riesgo_variacion = 100 * (1 - np.minimum(1, cv_montos))
+
+    # Regularidad temporal: días (fecha sin hora) ordenados, sólo saltos positivos
+    ns = np.asarray(fechas).astype('datetime64[ns]').view(np.int64)
+    con_fecha = ns != np.iinfo(np.int64).min
+    grupo_fechas = pareja[con_fecha]
+    dias = ns[con_fecha] // DIA_NS
+    orden = np.lexsort((dias, grupo_fechas))
+    dias, grupo_fechas = dias[orden], grupo_fechas[orden]
+    saltos = np.diff(dias)
+    validos = (grupo_fechas[1:] == grupo_fechas[:-1]) & (saltos > 0)
+    saltos, grupo_saltos = saltos[validos], grupo_fechas[1:][validos]
+
+    fechas_validas = np.bincount(grupo_fechas, minlength=cantidad)
+    cv_temporal, media_saltos = _coeficientes_variacion(saltos.astype(np.float64), grupo_saltos, cantidad)
+    riesgo_temporal = np.where(
+        (fechas_validas >= 2) & (media_saltos > 0),
+        100 * (1 - np.minimum(1, cv_temporal / 2)),
+        50.0
+    )
+
+    con_patron = (largos >= 2) & (montos_validos >= 2)
+    riesgo[con_patron] = (riesgo_variacion[con_patron] * 0.6) + (riesgo_temporal[con_patron] * 0.4)
+    return riesgo
+
+
+def _a_fecha(valor):
+    """Fecha de un registro del historial (date, datetime o texto) como datetime64; NaT si no se reconoce"""
+    if isinstance(valor, date):
+        return np.datetime64(valor, 'D')
+    if isinstance(valor, str):
+        for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                return np.datetime64(datetime.strptime(valor, formato).date(), 'D')
+            except ValueError:
+                continue
+    return np.datetime64('NaT', 'D')
+
+
+def riesgo_patron(historial):
+    """
+    Riesgo de patrón de un historial [{fecha, monto}, ...] (consulta de una
+    pareja) con riesgo_patron_parejas. Los montos no numéricos y las fechas
+    que no se reconocen se ignoran.
+    """
+    registros = [op for op in historial if isinstance(op, dict)] if historial else []
+    montos = np.array([
+        op['monto'] if isinstance(op.get('monto'), (int, float)) else np.nan
+        for op in registros
+    ], dtype=np.float64)
+    fechas = np.array([_a_fecha(op.get('fecha')) for op in registros], dtype='datetime64[D]')
+    return float(riesgo_patron_parejas([montos], [fechas])[0])
@@ -0,0 +1,221 @@
+# app/services/planificacion_diaria.py
+import numpy as np
+from app.services.seleccion_resultados import SeleccionTopK
+
+# Parejas por bloque: las del motor clásico se pasan a arreglo de a bloques y
+# el recorrido voraz descarta con arreglos las de afiliados sin cupo
+TAMANO_BLOQUE = 8192
+
+# Pareja candidata del plan, en el orden de llegada
+CANDIDATA = np.dtype([
+    ('riesgo', np.float64), ('id1', np.int64), ('id2', np.int64), ('lote', np.int64), ('posicion', np.int64)
+])
+
+
+class SeleccionPlan(SeleccionTopK):
+    """
+    Plan diario de emparejamientos: en lugar de los k de menor riesgo elige
+    un conjunto de parejas en el que cada afiliado aparece a lo sumo 'cupo'
+    veces, buscando el menor riesgo total.
+
+    Recibe las parejas igual que SeleccionTopK (agregar, agregar_pareja y
+    agregar_lote, con el filtro de monto asignado) pero sólo guarda riesgo y
+    afiliados en un arreglo estructurado. Al pedir los resultados lo ordena
+    por (riesgo a 2 decimales, llegada), el orden del ranking de
+    /emparejador/calcular, y lo recorre una vez aceptando cada pareja si a
+    los dos afiliados les queda cupo. Sólo se construyen (con su monto y
+    round(riesgo, 2)) las parejas elegidas.
+
+    El orden de los lotes vectorizados usa np.round, que sólo difiere de
+    round en los riesgos que quedan exactamente a mitad de camino; a lo sumo
+    cambia el orden entre esas parejas empatadas.
+    """
+
+    def __init__(self, monto_minimo=0, monto_maximo=0, cupo_diario=1, cupos=None, maximo_parejas=None):
+        super().__init__(None, monto_minimo, monto_maximo)
+        self.cupo_diario = cupo_diario
+        self.cupos = cupos or {}
+        self.maximo_parejas = maximo_parejas
+        self._numeros = []
+        self._ids = {}
+        self._mapas = {}
+        self._lotes = []
+        self._abierto = None
+        self._sueltos = []
+        # Un solo objeto para que los resultados de agregar compartan lote
+        self._construir_suelto = lambda pareja, riesgo, monto, datos: self._sueltos[datos[0]]
+        self._plan = {'riesgo_total': 0.0, 'cupos': np.zeros(0, dtype=np.int64), 'restante': np.zeros(0, dtype=np.int64)}
+
+    def _id(self, numero):
+        codigo = self._ids.get(numero)
+        if codigo is None:
+            codigo = len(self._numeros)
+            self._ids[numero] = codigo
+            self._numeros.append(numero)
+        return codigo
+
+    def _mapa(self, numeros):
+        """Ids de una lista de números (se reutiliza para los lotes que la comparten)"""
+        guardado = self._mapas.get(id(numeros))
+        if guardado is None or guardado[0] is not numeros:
+            guardado = (numeros, np.array([self._id(numero) for numero in numeros], dtype=np.int64))
+            self._mapas[id(numeros)] = guardado
+        return guardado[1]
+
+    def agregar(self, resultado):
+        """Guarda un resultado ya construido (motor clásico)"""
+        if not self._pasa_monto(resultado.get('monto_asignado', 0)):
+            return False
+        self.total += 1
+        self._guardar(resultado['pareja'], resultado['riesgo'], None, (len(self._sueltos),), self._construir_suelto)
+        self._sueltos.append(resultado)
+        return True
+
+    def agregar_pareja(self, pareja, riesgo, monto, datos, construir):
+        """Guarda la pareja sin construir el resultado (motor clásico)"""
+        if monto is not None and not self._pasa_monto(monto):
+            return False
+        self.total += 1
+        self._guardar(pareja, riesgo, monto, datos, construir)
+        return True
+
+    def _guardar(self, pareja, riesgo, monto, datos, construir):
+        """Suma una pareja al lote abierto del motor clásico (uno por 'construir')"""
+        abierto = self._abierto
+        if abierto is None or abierto['construir'] is not construir:
+            self._cerrar_lote()
+            abierto = self._abierto = {
+                'construir': construir, 'montos': [], 'filas': [], 'bloques': [],
+                'campos': np.dtype([('riesgo', np.float64), ('id1', np.int64), ('id2', np.int64),
+                                    ('datos', np.int64, (len(datos),))]),
+            }
+        abierto['filas'].append((riesgo, self._id(pareja[0]), self._id(pareja[1]), datos))
+        abierto['montos'].append(monto)
+        if len(abierto['filas']) >= TAMANO_BLOQUE:
+            abierto['bloques'].append(np.array(abierto['filas'], dtype=abierto['campos']))
+            abierto['filas'] = []
+
+    def _cerrar_lote(self):
+        """Pasa el lote abierto del motor clásico a self._lotes"""
+        abierto, self._abierto = self._abierto, None
+        if abierto is None:
+            return
+        filas = np.concatenate(abierto['bloques'] + [np.array(abierto['filas'], dtype=abierto['campos'])])
+        numeros = self._numeros
+        construir = abierto['construir']
+
+        def construir_posicion(posicion, monto):
+            fila = filas[posicion]
+            pareja = [numeros[fila['id1']], numeros[fila['id2']]]
+            return construir(pareja, float(fila['riesgo']), monto, tuple(fila['datos'].tolist()))
+
+        self._lotes.append({
+            'riesgos': filas['riesgo'], 'ids1': filas['id1'], 'ids2': filas['id2'],
+            'posiciones': np.arange(len(filas)), 'montos': abierto['montos'],
+            'sugerir_montos': None, 'construir': construir_posicion,
+        })
+
+    def agregar_lote(self, riesgos, sugerir_montos, construir, parejas=None):
+        """Guarda riesgo y afiliados de un lote (motores vectorizados); requiere 'parejas'"""
+        if parejas is None:
+            raise ValueError("SeleccionPlan necesita los afiliados de cada pareja del lote")
+        indices1, indices2, numeros = parejas
+        aceptadas, montos = self._filtrar_montos(len(riesgos), sugerir_montos)
+        self.total += len(aceptadas)
+        if not len(aceptadas):
+            return
+        mapa = self._mapa(numeros)
+        self._cerrar_lote()
+        self._lotes.append({
+            'riesgos': np.round(np.asarray(riesgos, dtype=np.float64)[aceptadas], 2),
+            'ids1': mapa[np.asarray(indices1)[aceptadas]],
+            'ids2': mapa[np.asarray(indices2)[aceptadas]],
+            'posiciones': aceptadas, 'montos': montos,
+            'sugerir_montos': sugerir_montos, 'construir': construir,
+        })
+
+    def _cupos_afiliados(self):
+        """Cupo de cada id (cupo_diario salvo los indicados en 'cupos')"""
+        cupos = np.full(len(self._numeros), self.cupo_diario, dtype=np.int64)
+        for numero, cupo in self.cupos.items():
+            codigo = self._ids.get(numero)
+            if codigo is not None:
+                cupos[codigo] = cupo
+        return cupos
+
+    def _candidatas(self):
+        """Todas las parejas guardadas en un arreglo CANDIDATA, en orden de llegada"""
+        candidatas = np.empty(sum(len(lote['riesgos']) for lote in self._lotes), dtype=CANDIDATA)
+        desde = 0
+        for k, lote in enumerate(self._lotes):
+            hasta = desde + len(lote['riesgos'])
+            tramo = candidatas[desde:hasta]
+            tramo['riesgo'], tramo['id1'], tramo['id2'] = lote['riesgos'], lote['ids1'], lote['ids2']
+            tramo['lote'], tramo['posicion'] = k, lote['posiciones']
+            desde = hasta
+        return candidatas
+
+    def _asignar(self, ids1, ids2, cupos):
+        """Recorrido voraz en el orden dado; devuelve las posiciones elegidas y el cupo restante"""
+        restante = cupos.copy()
+        disponibles = int((restante > 0).sum())
+        maximo = self.maximo_parejas
+        elegidas = []
+        for desde in range(0, len(ids1), TAMANO_BLOQUE):
+            if disponibles < 2 or (maximo is not None and len(elegidas) >= maximo):
+                break
+            bloque = np.arange(desde, min(desde + TAMANO_BLOQUE, len(ids1)))
+            bloque = bloque[(restante[ids1[bloque]] > 0) & (restante[ids2[bloque]] > 0)]
+            for posicion, a, b in zip(bloque.tolist(), ids1[bloque].tolist(), ids2[bloque].tolist()):
+                if restante[a] > 0 and restante[b] > 0:
+                    restante[a] -= 1
+                    restante[b] -= 1
+                    disponibles -= int(restante[a] == 0) + int(restante[b] == 0)
+                    elegidas.append(posicion)
+                    if disponibles < 2 or (maximo is not None and len(elegidas) >= maximo):
+                        break
+        return np.array(elegidas, dtype=np.int64), restante
+
+    def resultados(self):
+        """Parejas del plan ordenadas por riesgo (estable)"""
+        self._cerrar_lote()
+        candidatas = self._candidatas()
+        candidatas = candidatas[np.argsort(candidatas['riesgo'], kind='stable')]
+        cupos = self._cupos_afiliados()
+        elegidas, restante = self._asignar(candidatas['id1'], candidatas['id2'], cupos)
+        plan = candidatas[elegidas]
+
+        # Se construyen sólo las elegidas, agrupadas por lote para pedir sus montos juntos
+        resultados = [None] * len(plan)
+        for k in np.unique(plan['lote']).tolist():
+            lote = self._lotes[k]
+            orden = np.flatnonzero(plan['lote'] == k)
+            posiciones = plan['posicion'][orden]
+            if lote['montos'] is not None:
+                montos = [lote['montos'][p] for p in posiciones.tolist()]
+            else:
+                montos = lote['sugerir_montos'](posiciones)
+            for g, posicion, monto in zip(orden.tolist(), posiciones.tolist(), montos):
+                resultados[g] = lote['construir'](posicion, monto)
+
+        self._plan = {
+            'riesgo_total': float(sum(resultado['riesgo'] for resultado in resultados)),
+            'cupos': cupos, 'restante': restante,
+        }
+        return resultados
+
+    def resumen(self):
+        """Totales del plan (se completan al pedir los resultados)"""
+        plan = self._plan
+        usados = plan['cupos'] - plan['restante']
+        asignados = int((usados > 0).sum())
+        parejas = int(usados.sum()) // 2
+        return {
+            'parejas': parejas,
+            'riesgo_total': round(plan['riesgo_total'], 2),
+            'riesgo_promedio': round(plan['riesgo_total'] / parejas, 2) if parejas else None,
+            'afiliados_candidatos': len(self._numeros),
+            'afiliados_asignados': asignados,
+            'afiliados_sin_pareja': int(((usados == 0) & (plan['cupos'] > 0)).sum()),
+            'cupo_diario': self.cupo_diario,
+        }
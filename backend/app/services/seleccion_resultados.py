@@ -0,0 +1,137 @@
+# app/services/seleccion_resultados.py
+import heapq
+import numpy as np
+
+# Margen de la preselección por riesgo: el riesgo se compara redondeado a 2
+# decimales, así que el redondeo mueve cada valor a lo sumo 0.005
+MARGEN_REDONDEO = 0.011
+
+
+class SeleccionTopK:
+    """
+    Selección acotada de los k emparejamientos de menor riesgo.
+
+    Mantiene un heap de a lo sumo k resultados mientras se evalúan las
+    parejas, de modo que la memoria es proporcional a k y no a N². El orden
+    final equivale a ordenar la lista completa por 'riesgo' de forma estable
+    (a igual riesgo, primero el que llegó antes). También aplica el filtro de
+    monto asignado, que debe ir antes del recorte para no perder resultados.
+    """
+
+    def __init__(self, k=None, monto_minimo=0, monto_maximo=0):
+        self.k = k
+        self.monto_minimo = monto_minimo or 0
+        self.monto_maximo = monto_maximo or 0
+        self.total = 0
+        self.descartadas_monto = 0
+        self._heap = []
+        self._llegada = 0
+
+    def agregar(self, resultado):
+        """Ofrece un resultado; devuelve False si el filtro de monto lo descarta"""
+        if not self._pasa_monto(resultado.get('monto_asignado', 0)):
+            return False
+
+        self.total += 1
+        # Heap de máximos por (riesgo, llegada): la raíz es el peor conservado
+        entrada = (-resultado['riesgo'], -self._llegada, resultado)
+        self._llegada += 1
+        if self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, entrada)
+        elif self._heap and entrada > self._heap[0]:
+            heapq.heapreplace(self._heap, entrada)
+        return True
+
+    def agregar_pareja(self, pareja, riesgo, monto, datos, construir):
+        """
+        Ofrece un resultado sin construirlo (motor clásico). Equivale a
+        agregar(construir(pareja, riesgo, monto, datos)), pero sólo se
+        construye si entra a la selección.
+
+        Args:
+            pareja: (numero1, numero2) de los afiliados
+            riesgo: riesgo ya redondeado a 2 decimales
+            monto: monto asignado
+            datos: tupla de enteros con el resto de lo que necesita 'construir'
+            construir: (pareja, riesgo, monto, datos) -> resultado
+        """
+        # Sin monto (None) pasa el filtro, igual que en _filtrar_montos
+        if monto is not None and not self._pasa_monto(monto):
+            return False
+
+        self.total += 1
+        clave = (-riesgo, -self._llegada)
+        self._llegada += 1
+        if self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, clave + (construir(pareja, riesgo, monto, datos),))
+        elif self._heap and clave > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, clave + (construir(pareja, riesgo, monto, datos),))
+        return True
+
+    def agregar_lote(self, riesgos, sugerir_montos, construir, parejas=None):
+        """
+        Ofrece un lote de resultados en el orden de llegada sin construirlos
+        todos. Equivale a llamar a agregar con cada uno, pero sólo se
+        construyen los que pueden quedar entre los k de menor riesgo, y sus
+        montos sólo se piden para todo el lote si hay filtro de monto.
+
+        Args:
+            riesgos: riesgo (sin redondear) de cada resultado
+            sugerir_montos: posiciones -> montos asignados de esos resultados
+            construir: (posicion, monto) -> resultado
+            parejas: (indices1, indices2, numeros) con los afiliados de cada
+                resultado como posiciones en 'numeros'; aquí no se usa (lo
+                necesita SeleccionPlan para no construir los resultados)
+        """
+        riesgos = np.asarray(riesgos, dtype=np.float64)
+        aceptadas, montos = self._filtrar_montos(len(riesgos), sugerir_montos)
+
+        self.total += len(aceptadas)
+        if self.k is not None and len(aceptadas) > self.k:
+            if self.k == 0:
+                return
+            # Fuera de los k menores del lote (con el margen del redondeo) no
+            # se puede entrar a la selección
+            corte = np.partition(riesgos[aceptadas], self.k - 1)[self.k - 1]
+            aceptadas = aceptadas[riesgos[aceptadas] <= corte + MARGEN_REDONDEO]
+
+        aceptadas = aceptadas.tolist()
+        montos = [montos[k] for k in aceptadas] if montos is not None else sugerir_montos(np.array(aceptadas, dtype=np.int64))
+        for posicion, monto in zip(aceptadas, montos):
+            resultado = construir(posicion, monto)
+            entrada = (-resultado['riesgo'], -self._llegada, resultado)
+            self._llegada += 1
+            if self.k is None or len(self._heap) < self.k:
+                heapq.heappush(self._heap, entrada)
+            elif self._heap and entrada > self._heap[0]:
+                heapq.heapreplace(self._heap, entrada)
+
+    def _pasa_monto(self, monto):
+        """Aplica el filtro de monto asignado a un resultado (cuenta los descartados)"""
+        if (self.monto_minimo > 0 and monto < self.monto_minimo) or \
+                (self.monto_maximo > 0 and monto > self.monto_maximo):
+            self.descartadas_monto += 1
+            return False
+        return True
+
+    def _filtrar_montos(self, cantidad, sugerir_montos):
+        """
+        Posiciones del lote que pasan el filtro de monto asignado y, si hubo
+        filtro, los montos de todo el lote (None si no se pidieron)
+        """
+        aceptadas = np.arange(cantidad)
+        if self.monto_minimo <= 0 and self.monto_maximo <= 0:
+            return aceptadas, None
+        montos = sugerir_montos(aceptadas)
+        valores = np.array([np.nan if monto is None else monto for monto in montos], dtype=np.float64)
+        descartadas = np.zeros(cantidad, dtype=bool)
+        if self.monto_minimo > 0:
+            descartadas |= valores < self.monto_minimo
+        if self.monto_maximo > 0:
+            descartadas |= valores > self.monto_maximo
+        self.descartadas_monto += int(descartadas.sum())
+        return np.flatnonzero(~descartadas), montos
+
+    def resultados(self):
+        """Resultados conservados ordenados por riesgo (estable)"""
+        return [entrada[2] for entrada in sorted(self._heap, reverse=True)]
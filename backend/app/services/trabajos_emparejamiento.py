@@ -0,0 +1,167 @@
+# app/services/trabajos_emparejamiento.py
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.services.control_ejecucion import ControlEjecucion
+from app.utils.exceptions import ValidationError
+
+ESTADOS_ACTIVOS = ('pendiente', 'en_curso')
+
+
+class TrabajoEmparejamiento:
+    """Cálculo de emparejamientos en segundo plano y su estado"""
+
+    def __init__(self, clave, filtros, control):
+        self.id = uuid.uuid4().hex
+        self.clave = clave
+        self.filtros = filtros
+        self.control = control
+        self.estado = 'pendiente'
+        self.estadisticas = {}
+        self.resultado = None
+        self.error = None
+        self.solicitudes = 1
+        self.creado = datetime.now()
+        self.iniciado = None
+        self.finalizado = None
+
+    @property
+    def activo(self):
+        return self.estado in ESTADOS_ACTIVOS
+
+    def avance(self):
+        """Fracción de las combinaciones ya resueltas (descartadas o evaluadas)"""
+        if self.estado == 'completado':
+            return 1.0
+        estadisticas = self.estadisticas
+        combinaciones = estadisticas.get('combinaciones', 0)
+        if not combinaciones:
+            return 0.0
+        descartadas = estadisticas['descartadas']
+        resueltas = (
+            descartadas['sin_superposicion'] + descartadas['canal_incompatible'] +
+            descartadas['rango_invalido'] +
+            descartadas['dias_minimos'] + estadisticas['evaluadas']
+        )
+        return round(min(1.0, resueltas / combinaciones), 4)
+
+    def to_dict(self):
+        # Copia de las estadísticas: el hilo del cálculo las sigue modificando
+        estadisticas = dict(self.estadisticas)
+        if 'descartadas' in estadisticas:
+            estadisticas['descartadas'] = dict(estadisticas['descartadas'])
+        if self.resultado is not None:
+            estadisticas = self.resultado['estadisticas']
+
+        return {
+            'id': self.id,
+            'estado': self.estado,
+            'avance': self.avance(),
+            'estadisticas': estadisticas,
+            'solicitudes': self.solicitudes,
+            'creado': self.creado.isoformat(),
+            'iniciado': self.iniciado.isoformat() if self.iniciado else None,
+            'finalizado': self.finalizado.isoformat() if self.finalizado else None,
+            'error': self.error,
+            'resultado': self.resultado
+        }
+
+
+class GestorTrabajos:
+    """
+    Ejecuta cálculos de emparejamiento en un ThreadPoolExecutor.
+
+    Los pedidos con parámetros idénticos (EmparejamientoService.clave_calculo)
+    comparten el trabajo en curso en lugar de lanzar otro cálculo. Los
+    trabajos terminados se conservan, hasta 'retener', para poder consultarlos.
+    """
+
+    def __init__(self, servicio, retener=50):
+        self.servicio = servicio
+        self.retener = retener
+        self._executor = None
+        self._trabajos = OrderedDict()
+        self._activos = {}
+        self._lock = threading.Lock()
+
+    def _obtener_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(1, current_app.config.get('EMPAREJADOR_TRABAJOS_SIMULTANEOS', 2)),
+                thread_name_prefix='emparejador'
+            )
+        return self._executor
+
+    def enviar(self, filtros):
+        """
+        Encola un cálculo o se une al que ya está en curso con los mismos parámetros.
+
+        Returns:
+            tuple: (TrabajoEmparejamiento, True si se creó un trabajo nuevo)
+        """
+        clave = self.servicio.clave_calculo(filtros)
+        app = current_app._get_current_object()
+
+        with self._lock:
+            trabajo = self._activos.get(clave)
+            if trabajo is not None and trabajo.activo and not trabajo.control.cancelado:
+                trabajo.solicitudes += 1
+                return trabajo, False
+
+            presupuesto = float(app.config.get('EMPAREJADOR_PRESUPUESTO_TRABAJO_SEGUNDOS') or 0)
+            trabajo = TrabajoEmparejamiento(clave, dict(filtros), ControlEjecucion(presupuesto))
+            self._activos[clave] = trabajo
+            self._trabajos[trabajo.id] = trabajo
+            self._descartar_terminados()
+            self._obtener_executor().submit(self._ejecutar, app, trabajo)
+        return trabajo, True
+
+    def obtener(self, id_trabajo):
+        trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is None:
+            raise ValidationError(f"No existe el trabajo {id_trabajo}")
+        return trabajo
+
+    def cancelar(self, id_trabajo):
+        """Pide la cancelación; el cálculo se detiene en la siguiente pareja o bloque"""
+        trabajo = self.obtener(id_trabajo)
+        if trabajo.activo:
+            trabajo.control.cancelar()
+            with self._lock:
+                if self._activos.get(trabajo.clave) is trabajo:
+                    del self._activos[trabajo.clave]
+        return trabajo
+
+    def _ejecutar(self, app, trabajo):
+        with app.app_context():
+            try:
+                if trabajo.control.cancelado:
+                    trabajo.estado = 'cancelado'
+                    return
+                trabajo.estado = 'en_curso'
+                trabajo.iniciado = datetime.now()
+                trabajo.resultado = self.servicio.calcular_emparejamientos(
+                    trabajo.filtros, control=trabajo.control, estadisticas=trabajo.estadisticas
+                )
+                cancelado = trabajo.resultado['estadisticas'].get('cancelado')
+                trabajo.estado = 'cancelado' if cancelado else 'completado'
+            except Exception as e:
+                current_app.logger.error(f"Error en trabajo de emparejamiento {trabajo.id}: {str(e)}")
+                trabajo.error = str(e)
+                trabajo.estado = 'error'
+            finally:
+                trabajo.finalizado = datetime.now()
+                with self._lock:
+                    if self._activos.get(trabajo.clave) is trabajo:
+                        del self._activos[trabajo.clave]
+                db.session.remove()
+
+    def _descartar_terminados(self):
+        """Olvida los trabajos terminados más antiguos por encima de 'retener'"""
+        terminados = [id_trabajo for id_trabajo, t in self._trabajos.items() if not t.activo]
+        for id_trabajo in terminados[:max(0, len(terminados) - self.retener)]:
+            del self._trabajos[id_trabajo]
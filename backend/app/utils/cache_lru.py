@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache en memoria de tamaño acotado con expulsión LRU y contadores de
+    aciertos/fallos. Es seguro entre hilos del servidor.
+    """
+
+    def __init__(self, tamano_maximo=32):
+        self.tamano_maximo = tamano_maximo
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, aceptar=None):
+        """
+        Devuelve el valor de 'clave' (o None) y lo marca como usado.
+
+        Args:
+            aceptar: función opcional valor -> bool; si devuelve False la
+                entrada no sirve para esta consulta y cuenta como fallo
+        """
+        with self._lock:
+            valor = self._entradas.get(clave)
+            if valor is None or (aceptar is not None and not aceptar(valor)):
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        """Guarda 'valor' expulsando las entradas menos usadas si hace falta"""
+        if self.tamano_maximo <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.tamano_maximo:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'tamano_maximo': self.tamano_maximo,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0
+            }
@@ -0,0 +1,27 @@
+from flask import current_app
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+
+
+def lineas_ndjson(registros, resumen, registros_por_fragmento=500):
+    """
+    Serializa 'registros' como JSON delimitado por saltos de línea y termina
+    con el registro 'resumen'.
+
+    Los registros se agrupan en fragmentos para no enviar un chunk HTTP por
+    línea; en memoria sólo hay un fragmento serializado a la vez. Lo
+    incremental es la serialización y el envío: si 'registros' es una lista
+    ya calculada (como la página de /emparejador/calcular), el cálculo
+    completo ocurre antes de la primera línea. Usa el
+    proveedor JSON de la aplicación, igual que jsonify, por lo que debe
+    ejecutarse con contexto de aplicación (stream_with_context).
+    """
+    dumps = current_app.json.dumps
+    fragmento = []
+    for registro in registros:
+        fragmento.append(dumps(registro))
+        if len(fragmento) >= registros_por_fragmento:
+            yield '\n'.join(fragmento) + '\n'
+            fragmento = []
+    fragmento.append(dumps(resumen))
+    yield '\n'.join(fragmento) + '\n'
@@ -0,0 +1,111 @@
+import re
+import secrets
+from sqlalchemy import event, text
+
+# Tablas cuyos cambios invalidan los índices y resultados del emparejador
+# (afiliados aporta los nombres que se muestran en los resultados)
+TABLAS_VERSIONADAS = ('operaciones', 'rango_afiliados', 'afiliados')
+
+# Tabla de app.models.version_datos.VersionDatos
+TABLA_VERSIONES = 'versiones_datos'
+
+# Tabla destino de una escritura en SQL textual (text() o exec_driver_sql)
+_DESTINO_ESCRITURA = re.compile(
+    r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE
+)
+
+# Versiones previas a la primera escritura de la transacción en curso, en Connection.info
+_PREVIAS = 'version_datos.previas'
+
+
+def registrar(engine):
+    """
+    Versiona las escrituras que pasan por 'engine' (el de la aplicación, en
+    create_app) y crea la tabla de versiones en bases anteriores a ella
+    """
+    from app.models.version_datos import VersionDatos
+    VersionDatos.__table__.create(engine, checkfirst=True)
+    event.listen(engine, 'after_cursor_execute', _registrar_escritura)
+    event.listen(engine, 'commit', _terminar_transaccion)
+    event.listen(engine, 'rollback', _terminar_transaccion)
+
+
+def _tabla_escrita(statement, context):
+    """Tabla destino de un INSERT, UPDATE o DELETE (None si no es una escritura)"""
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+        tabla = getattr(getattr(context.compiled, 'statement', None), 'table', None)
+        if tabla is not None:
+            return getattr(tabla, 'name', None)
+    coincidencia = _DESTINO_ESCRITURA.match(statement)
+    return coincidencia.group(1).lower() if coincidencia else None
+
+
+def _registrar_escritura(conn, cursor, statement, parameters, context, executemany):
+    """
+    Da una versión nueva a la tabla versionada destino de una escritura.
+
+    La versión se guarda en TABLA_VERSIONES dentro de la misma transacción
+    que la escritura: los demás la ven recién con el commit y un rollback la
+    descarta junto con los datos. Es un valor aleatorio y no un contador,
+    para que una versión descartada no se repita en otra escritura. La
+    primera escritura de la transacción anota la versión que reemplaza (ver
+    version_previa); como se lee después de la escritura, que ya tomó el
+    lock de la base, ninguna otra transacción pudo confirmarse en el medio.
+    """
+    tabla = _tabla_escrita(statement, context)
+    if tabla not in TABLAS_VERSIONADAS:
+        return
+
+    previas = conn.info.setdefault(_PREVIAS, {})
+    if tabla not in previas:
+        previas[tabla] = conn.execute(
+            text(f"SELECT version FROM {TABLA_VERSIONES} WHERE tabla = :tabla"), {'tabla': tabla}
+        ).scalar() or 0
+    version = secrets.randbits(62)
+    actualizada = conn.execute(
+        text(f"UPDATE {TABLA_VERSIONES} SET version = :version WHERE tabla = :tabla"),
+        {'version': version, 'tabla': tabla}
+    )
+    if actualizada.rowcount == 0:
+        conn.execute(
+            text(f"INSERT INTO {TABLA_VERSIONES} (tabla, version) VALUES (:tabla, :version)"),
+            {'tabla': tabla, 'version': version}
+        )
+
+
+def _terminar_transaccion(conn):
+    conn.info.pop(_PREVIAS, None)
+
+
+def _leer_versiones():
+    """Versiones guardadas, leídas en la conexión de la sesión actual"""
+    from app import db
+    return dict(db.session.execute(text(f"SELECT tabla, version FROM {TABLA_VERSIONES}")).all())
+
+
+def version(tabla):
+    """
+    Versión actual de una tabla (0 si nunca se escribió): cambia con cada
+    escritura confirmada sobre ella, la haga este proceso u otro que use la
+    misma base. Dentro de una transacción con escrituras propias ya incluye
+    esas escrituras.
+    """
+    return versiones()[tabla]
+
+
+def versiones():
+    """Versiones actuales de todas las tablas versionadas"""
+    guardadas = _leer_versiones()
+    return {tabla: guardadas.get(tabla, 0) for tabla in TABLAS_VERSIONADAS}
+
+
+def version_previa(tabla):
+    """
+    Versión de la tabla antes de la primera escritura de la transacción en
+    curso de la sesión (la actual si la transacción no la escribió). Junto
+    con version(tabla) delimita exactamente las filas de esta transacción.
+    """
+    from app import db
+    previas = db.session.connection().info.get(_PREVIAS, {})
+    return previas[tabla] if tabla in previas else version(tabla)
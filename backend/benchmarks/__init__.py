@@ -0,0 +1,7 @@
+# backend/benchmarks/__init__.py
+"""
+Benchmarks del emparejador sobre datos sintéticos.
+
+    python -m benchmarks.emparejador --escalas 100 1000 5000 --salida actual.json
+    python -m benchmarks.emparejador --comparar base.json --salida actual.json
+"""
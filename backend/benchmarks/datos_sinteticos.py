@@ -0,0 +1,104 @@
+# backend/benchmarks/datos_sinteticos.py
+from datetime import date, time, timedelta
+import numpy as np
+from sqlalchemy import insert
+from app.models.afiliado import Afiliado
+from app.models.operacion import Operacion
+from app.models.rango_afiliado import RangoAfiliado
+
+CANALES = ('Izipay', 'Iziya', 'Ambos')
+RANGOS = ((0, 500), (100, 800), (300, 900), (500, 1000), (700, 1500))
+MONTOS = (150.0, 300.0, 450.0, 600.0, 750.0, 820.0, 1200.0)
+
+# Filas por INSERT (executemany)
+FILAS_POR_LOTE = 10000
+
+
+def numero_afiliado(posicion):
+    return f"9{posicion:08d}"
+
+
+def generar_datos(db, afiliados=100, operaciones_por_afiliado=20, dias=180, semilla=1,
+                  proporcion_externos=0.05, fecha_referencia=None):
+    """
+    Inserta afiliados, rangos y operaciones sintéticos deterministas.
+
+    Con la misma semilla y la misma fecha de referencia se generan
+    exactamente las mismas filas. Las fechas se cuentan hacia atrás desde
+    fecha_referencia (hoy por defecto) para que los días desde la última
+    operación y la ventana de días tengan sentido.
+
+    Args:
+        afiliados: cantidad de afiliados (cada uno con 1 o 2 rangos)
+        operaciones_por_afiliado: operaciones totales = afiliados * este valor
+        dias: antigüedad máxima de las operaciones
+        proporcion_externos: números que operan sin ser afiliados
+
+    Returns:
+        dict: cantidades insertadas (afiliados, rangos, operaciones)
+    """
+    rng = np.random.default_rng(semilla)
+    fecha_referencia = fecha_referencia or date.today()
+    numeros = [numero_afiliado(k) for k in range(afiliados)]
+    externos = [f"8{k:08d}" for k in range(max(1, int(afiliados * proporcion_externos)))]
+
+    filas_afiliados = [{
+        'numero': numero,
+        'nombre': f"Nombre{k}",
+        'apellido_paterno': f"Paterno{k}",
+        'apellido_materno': f"Materno{k}",
+        'dni': f"{k:08d}",
+        'estado': 'Activo',
+    } for k, numero in enumerate(numeros)]
+
+    filas_rangos = []
+    cantidades = rng.integers(1, 3, size=afiliados)
+    for numero, cantidad in zip(numeros, cantidades.tolist()):
+        for r in rng.choice(len(RANGOS), size=cantidad, replace=False).tolist():
+            inicio, fin = RANGOS[r]
+            filas_rangos.append({
+                'numero_afiliado': numero,
+                'rango_inicio': inicio,
+                'rango_fin': fin,
+                'recibe_en': CANALES[int(rng.integers(len(CANALES)))],
+                'envia_a': CANALES[int(rng.integers(len(CANALES)))],
+            })
+
+    total = afiliados * operaciones_por_afiliado
+    participantes = np.array(numeros + externos, dtype=object)
+    origen = rng.integers(len(participantes), size=total)
+    # Destino distinto del origen
+    destino = (origen + rng.integers(1, len(participantes), size=total)) % len(participantes)
+    antiguedad = rng.integers(0, dias + 1, size=total)
+    minutos = rng.integers(0, 24 * 60, size=total)
+    montos = rng.choice(np.array(MONTOS), size=total)
+
+    filas_operaciones = [{
+        'fecha': fecha_referencia - timedelta(days=d),
+        'hora': time(m // 60, m % 60),
+        'nombre1': participantes[o],
+        'nombre2': participantes[t],
+        'monto': float(monto),
+    } for o, t, d, m, monto in zip(origen.tolist(), destino.tolist(), antiguedad.tolist(),
+                                   minutos.tolist(), montos.tolist())]
+
+    for modelo, filas in ((Afiliado, filas_afiliados), (RangoAfiliado, filas_rangos),
+                          (Operacion, filas_operaciones)):
+        for desde in range(0, len(filas), FILAS_POR_LOTE):
+            db.session.execute(insert(modelo), filas[desde:desde + FILAS_POR_LOTE])
+    db.session.commit()
+
+    return {'afiliados': afiliados, 'rangos': len(filas_rangos), 'operaciones': total}
+
+
+def parejas_con_historial(db, cantidad, semilla=1):
+    """Parejas de afiliados (ordenadas) que ya operaron entre sí, elegidas de forma determinista"""
+    filas = db.session.query(Operacion.nombre1, Operacion.nombre2).filter(
+        Operacion.nombre1.like('9%'), Operacion.nombre2.like('9%')
+    ).order_by(Operacion.id).all()
+    parejas = sorted({tuple(sorted(fila)) for fila in filas})
+    if not parejas:
+        return []
+    rng = np.random.default_rng(semilla)
+    elegidas = rng.choice(len(parejas), size=min(cantidad, len(parejas)), replace=False)
+    return [list(parejas[k]) for k in sorted(elegidas.tolist())]
@@ -0,0 +1,288 @@
+# backend/benchmarks/emparejador.py
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from app import create_app, db
+from app.services.emparejamiento_service import EmparejamientoService
+from app.services.operaciones_service import OperacionesService
+from benchmarks.datos_sinteticos import generar_datos, numero_afiliado, parejas_con_historial
+from config import Config
+
+# Versión del formato del JSON de resultados
+VERSION_FORMATO = 1
+
+ESCALAS = (100, 1000, 5000)
+MOTORES = ('clasico', 'vectorizado', 'paralelo')
+
+# El motor clásico evalúa pareja por pareja (decenas de segundos con 1000
+# afiliados); por encima de esta escala se omite salvo --max-clasico
+MAX_AFILIADOS_CLASICO = 100
+
+
+class ConfigBenchmark(Config):
+    TESTING = True
+    # Cada repetición mide un cálculo real, sin límite de tiempo ni instantánea
+    EMPAREJADOR_CACHE_TAMANO = 0
+    EMPAREJADOR_CACHE_CARACTERISTICAS = 0
+    EMPAREJADOR_INSTANTANEA_DIR = ''
+    EMPAREJADOR_PRESUPUESTO_SEGUNDOS = 0
+
+
+def medir(funcion, repeticiones):
+    """
+    Ejecuta 'funcion' 'repeticiones' veces.
+
+    Returns:
+        (dict, object): tiempos en segundos (la primera ejecución aparte, ya
+            que construye los índices del servicio) y el último resultado
+    """
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        desde = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - desde)
+    return {
+        'primera_s': round(tiempos[0], 6),
+        'min_s': round(min(tiempos), 6),
+        'mediana_s': round(statistics.median(tiempos), 6),
+        'media_s': round(statistics.fmean(tiempos), 6),
+        'max_s': round(max(tiempos), 6),
+        'repeticiones': repeticiones,
+    }, resultado
+
+
+def casos_escala(afiliados, repeticiones, motores, max_clasico, parejas_detalle):
+    """
+    Mide los casos del benchmark sobre los datos ya cargados en la base. El
+    motor paralelo reparte el trabajo sólo desde EvaluadorParalelo.min_parejas
+    candidatas; por debajo evalúa en serie, igual que en la aplicación.
+    """
+    emparejamiento = EmparejamientoService()
+    operaciones = OperacionesService()
+    casos = {}
+    try:
+        _medir_casos(emparejamiento, operaciones, casos, afiliados, repeticiones, motores, max_clasico,
+                     parejas_detalle)
+    finally:
+        emparejamiento.motor_vectorizado.paralelo.cerrar()
+    return casos
+
+
+def _medir_casos(emparejamiento, operaciones, casos, afiliados, repeticiones, motores, max_clasico,
+                 parejas_detalle):
+    """Agrega a 'casos' las medidas de cada caso"""
+    for motor in motores:
+        if motor == 'clasico' and afiliados > max_clasico:
+            continue
+        for modo, avanzado in (('estandar', False), ('avanzado', True)):
+            filtros = {
+                'dias_minimos': 1,
+                'riesgo_maximo': 50,
+                'usar_algoritmo_avanzado': avanzado,
+                'motor': motor,
+                'limite': 100,
+                'semilla': 1,
+            }
+            tiempos, respuesta = medir(lambda: emparejamiento.calcular_emparejamientos(filtros), repeticiones)
+            casos[f"calcular_{modo}[{motor}]"] = dict(
+                tiempos,
+                resultados=respuesta['paginacion']['total'],
+                perf=respuesta['perf'],
+            )
+
+        if motor == 'vectorizado':
+            filtros = {'dias_minimos': 1, 'riesgo_maximo': 50, 'motor': motor, 'cupo_diario': 2, 'semilla': 1}
+            tiempos, respuesta = medir(lambda: emparejamiento.planificar_emparejamientos(filtros), repeticiones)
+            casos[f"planificar[{motor}]"] = dict(tiempos, plan=respuesta['plan'], perf=respuesta['perf'])
+
+    if 'vectorizado' in motores:
+        # Primera consulta: arma el perfil por afiliado; las siguientes lo reutilizan
+        afiliados_consulta = [numero_afiliado(k) for k in range(0, afiliados, max(1, afiliados // 10))]
+        def mejores():
+            for numero in afiliados_consulta:
+                emparejamiento.mejores_parejas(numero, {'riesgo_maximo': 50, 'limite': 10, 'semilla': 1})
+        emparejamiento.motor_vectorizado.cache_afiliados.limpiar()
+        tiempos, _ = medir(mejores, repeticiones)
+        casos['mejores_parejas'] = dict(tiempos, afiliados=len(afiliados_consulta))
+
+    parejas = parejas_con_historial(db, parejas_detalle)
+    if parejas:
+        def detalles():
+            for afiliado1, afiliado2 in parejas:
+                emparejamiento.obtener_detalles_emparejamiento(afiliado1, afiliado2, {'semilla': 1})
+        tiempos, _ = medir(detalles, repeticiones)
+        casos['detalles_emparejamiento'] = dict(tiempos, parejas=len(parejas))
+
+    tiempos, respuesta = medir(lambda: emparejamiento.analizar_patrones({'vista': 'clusters'}), repeticiones)
+    casos['analizar_patrones'] = dict(tiempos, resumen=respuesta['resumen'], perf=respuesta['perf'])
+
+    for nombre, filtros in (
+        ('historico', {'page': 1, 'per_page': 50}),
+        ('historico[nombre1]', {'nombre1': numero_afiliado(0), 'page': 1, 'per_page': 50}),
+    ):
+        tiempos, respuesta = medir(lambda: operaciones.get_historico(filtros), repeticiones)
+        casos[nombre] = dict(tiempos, total=respuesta['total'])
+
+
+def ejecutar_escala(afiliados, args, directorio):
+    """Crea una base con los datos sintéticos de la escala y mide los casos"""
+    ruta = os.path.join(directorio, f"emparejador_{afiliados}.db")
+    config = type('ConfigEscala', (ConfigBenchmark,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + ruta,
+        'EMPAREJADOR_PROCESOS': args.procesos,
+    })
+    app = create_app(config)
+    app.logger.setLevel(logging.WARNING)
+
+    with app.app_context():
+        db.create_all()
+        try:
+            desde = time.perf_counter()
+            cantidades = generar_datos(
+                db,
+                afiliados=afiliados,
+                operaciones_por_afiliado=args.operaciones_por_afiliado,
+                dias=args.dias,
+                semilla=args.semilla,
+                fecha_referencia=args.fecha_referencia,
+            )
+            generacion = time.perf_counter() - desde
+            casos = casos_escala(afiliados, args.repeticiones, args.motores, args.max_clasico,
+                                 args.parejas_detalle)
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+            os.remove(ruta)
+
+    return dict(cantidades, generacion_s=round(generacion, 3), casos=casos)
+
+
+def _commit():
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() or None
+
+
+def ejecutar(args):
+    """Corre todas las escalas y devuelve el documento de resultados"""
+    directorio = tempfile.mkdtemp(prefix='benchmark_emparejador_')
+    try:
+        escalas = []
+        for afiliados in args.escalas:
+            print(f"Escala {afiliados} afiliados...", file=sys.stderr)
+            escalas.append(ejecutar_escala(afiliados, args, directorio))
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        'version_formato': VERSION_FORMATO,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'entorno': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': {
+            'operaciones_por_afiliado': args.operaciones_por_afiliado,
+            'dias': args.dias,
+            'semilla': args.semilla,
+            'fecha_referencia': args.fecha_referencia.isoformat(),
+            'repeticiones': args.repeticiones,
+            'parejas_detalle': args.parejas_detalle,
+            'procesos': args.procesos,
+        },
+        'escalas': escalas,
+    }
+
+
+def comparar(actual, base):
+    """
+    Cociente actual/base de la mediana de cada caso presente en ambos
+    resultados (menor que 1 es una mejora).
+
+    Returns:
+        list: filas (afiliados, caso, mediana base, mediana actual, cociente)
+    """
+    anteriores = {escala['afiliados']: escala['casos'] for escala in base['escalas']}
+    filas = []
+    for escala in actual['escalas']:
+        casos_base = anteriores.get(escala['afiliados'], {})
+        for caso, medida in escala['casos'].items():
+            if caso not in casos_base:
+                continue
+            previa = casos_base[caso]['mediana_s']
+            filas.append((escala['afiliados'], caso, previa, medida['mediana_s'],
+                          round(medida['mediana_s'] / previa, 3) if previa else None))
+    return filas
+
+
+def _leer_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark del emparejador sobre datos sintéticos')
+    parser.add_argument('--escalas', type=int, nargs='+', default=list(ESCALAS),
+                        help='cantidades de afiliados')
+    parser.add_argument('--operaciones-por-afiliado', type=int, default=20)
+    parser.add_argument('--dias', type=int, default=180, help='antigüedad máxima de las operaciones')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--fecha-referencia', type=date.fromisoformat, default=date.today(),
+                        help='fecha (AAAA-MM-DD) desde la que se generan las operaciones')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--motores', nargs='+', choices=MOTORES, default=list(MOTORES))
+    parser.add_argument('--procesos', type=int, default=0,
+                        help='procesos del motor paralelo (0 = todos los núcleos)')
+    parser.add_argument('--max-clasico', type=int, default=MAX_AFILIADOS_CLASICO,
+                        help='escala máxima en la que se mide el motor clásico')
+    parser.add_argument('--parejas-detalle', type=int, default=20,
+                        help='parejas consultadas en obtener_detalles_emparejamiento')
+    parser.add_argument('--salida', default='benchmark_emparejador.json', help='archivo JSON de resultados')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _leer_argumentos(argv)
+    if args.repeticiones < 1:
+        raise SystemExit('--repeticiones debe ser al menos 1')
+
+    resultados = ejecutar(args)
+    if args.comparar:
+        with open(args.comparar) as archivo:
+            base = json.load(archivo)
+        resultados['comparacion'] = {'base': base.get('commit'), 'casos': [
+            dict(zip(('afiliados', 'caso', 'base_s', 'actual_s', 'cociente'), fila))
+            for fila in comparar(resultados, base)
+        ]}
+
+    with open(args.salida, 'w') as archivo:
+        json.dump(resultados, archivo, indent=2)
+
+    for escala in resultados['escalas']:
+        for caso, medida in escala['casos'].items():
+            print(f"{escala['afiliados']:>6} {caso:<36} mediana={medida['mediana_s']:.4f}s "
+                  f"primera={medida['primera_s']:.4f}s")
+    for fila in resultados.get('comparacion', {}).get('casos', []):
+        print(f"{fila['afiliados']:>6} {fila['caso']:<36} {fila['base_s']:.4f}s -> "
+              f"{fila['actual_s']:.4f}s (x{fila['cociente']})")
+    print(f"Resultados en {args.salida}", file=sys.stderr)
+    return resultados
+
+
+if __name__ == '__main__':
+    main()
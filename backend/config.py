@@ -13,4 +13,48 @@ class Config:
     # Configuración de carga de archivos
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
-    ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+    
+    # Emparejador: 'clasico' (bucle por pareja), 'vectorizado' (NumPy por bloques)
+    # o 'paralelo' (bloques vectorizados repartidos en EMPAREJADOR_PROCESOS procesos)
+    EMPAREJADOR_MOTOR = os.environ.get('EMPAREJADOR_MOTOR') or 'clasico'
+
+    # Tiempo máximo (segundos) para evaluar parejas; 0 desactiva el límite.
+    # Si se agota, la respuesta lo indica en estadisticas.completo
+    EMPAREJADOR_PRESUPUESTO_SEGUNDOS = float(os.environ.get('EMPAREJADOR_PRESUPUESTO_SEGUNDOS') or 60)
+
+    # Días de historial que lee el emparejador cuando el pedido no indica
+    # ventana_dias; 0 usa todo el historial
+    EMPAREJADOR_VENTANA_DIAS = int(os.environ.get('EMPAREJADOR_VENTANA_DIAS') or 0)
+
+    # Procesos del motor 'paralelo'; 0 usa todos los núcleos disponibles
+    EMPAREJADOR_PROCESOS = int(os.environ.get('EMPAREJADOR_PROCESOS') or 0)
+
+    # Directorio de la instantánea columnar de operaciones (archivos .npy que
+    # el emparejador abre con mmap), por ejemplo backend/instantaneas; vacío
+    # (por defecto) la desactiva
+    EMPAREJADOR_INSTANTANEA_DIR = os.environ.get('EMPAREJADOR_INSTANTANEA_DIR') or ''
+
+    # Cálculos de emparejamiento guardados en la cache LRU; 0 la desactiva
+    EMPAREJADOR_CACHE_TAMANO = int(os.environ.get('EMPAREJADOR_CACHE_TAMANO') or 32)
+
+    # Conjuntos de índices de operaciones (uno por versión de los datos y
+    # ventana de días) que conserva el emparejador
+    EMPAREJADOR_CACHE_INDICES = int(os.environ.get('EMPAREJADOR_CACHE_INDICES') or 2)
+
+    # Conjuntos de características por pareja que conservan los motores
+    # vectorizados para volver a puntuar sin leer los datos; 0 lo desactiva
+    EMPAREJADOR_CACHE_CARACTERISTICAS = int(os.environ.get('EMPAREJADOR_CACHE_CARACTERISTICAS') or 2)
+
+    # Perfiles por afiliado (rangos, diversidad, historial) que conserva
+    # /emparejador/mejores para evaluar a un afiliado contra todos; 0 lo desactiva
+    EMPAREJADOR_CACHE_AFILIADOS = int(os.environ.get('EMPAREJADOR_CACHE_AFILIADOS') or 2)
+
+    # Veces por día que un afiliado puede aparecer en el plan de
+    # /emparejador/planificar cuando el pedido no indica cupo_diario
+    EMPAREJADOR_CUPO_DIARIO = int(os.environ.get('EMPAREJADOR_CUPO_DIARIO') or 1)
+
+    # Trabajos de emparejamiento en segundo plano (/emparejador/trabajos):
+    # cálculos simultáneos y tiempo máximo de cada uno (0 = sólo se cortan al cancelarlos)
+    EMPAREJADOR_TRABAJOS_SIMULTANEOS = int(os.environ.get('EMPAREJADOR_TRABAJOS_SIMULTANEOS') or 2)
+    EMPAREJADOR_PRESUPUESTO_TRABAJO_SEGUNDOS = float(os.environ.get('EMPAREJADOR_PRESUPUESTO_TRABAJO_SEGUNDOS') or 600)
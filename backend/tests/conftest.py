@@ -9,6 +9,11 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     SERVER_NAME = 'localhost.localdomain'
+    # Cada prueba compara cálculos reales; las de cache la activan explícitamente
+    EMPAREJADOR_CACHE_TAMANO = 0
+    EMPAREJADOR_CACHE_CARACTERISTICAS = 0
+    # Sin instantánea en disco salvo en sus pruebas
+    EMPAREJADOR_INSTANTANEA_DIR = ''
 
 @pytest.fixture
 def app():
@@ -0,0 +1,46 @@
+import json
+from datetime import date
+from app.models.operacion import Operacion
+from app.models.rango_afiliado import RangoAfiliado
+from benchmarks import emparejador
+from benchmarks.datos_sinteticos import generar_datos
+
+def filas_generadas(db):
+    operaciones = [(op.fecha, op.hora, op.nombre1, op.nombre2, op.monto)
+                   for op in Operacion.query.order_by(Operacion.id)]
+    rangos = [(r.numero_afiliado, r.rango_inicio, r.rango_fin, r.recibe_en, r.envia_a)
+              for r in RangoAfiliado.query.order_by(RangoAfiliado.id)]
+    return operaciones, rangos
+
+def test_datos_sinteticos_deterministas(app, with_db_context):
+    """La misma semilla y fecha de referencia generan las mismas filas"""
+    db = with_db_context
+    fecha = date(2024, 6, 30)
+    cantidades = generar_datos(db, afiliados=10, operaciones_por_afiliado=5, semilla=3, fecha_referencia=fecha)
+    assert cantidades['operaciones'] == 50 and Operacion.query.count() == 50
+    primeras = filas_generadas(db)
+    assert all(nombre1 != nombre2 for _, _, nombre1, nombre2, _ in primeras[0])
+
+    db.session.query(Operacion).delete()
+    db.session.query(RangoAfiliado).delete()
+    db.session.execute(db.text("DELETE FROM afiliados"))
+    db.session.commit()
+    generar_datos(db, afiliados=10, operaciones_por_afiliado=5, semilla=3, fecha_referencia=fecha)
+    assert filas_generadas(db) == primeras
+
+def test_benchmark_emparejador_escribe_json(app, tmp_path):
+    """Una corrida mínima escribe el JSON con los casos y la comparación"""
+    salida = tmp_path / 'actual.json'
+    argumentos = ['--escalas', '12', '--operaciones-por-afiliado', '4', '--repeticiones', '1',
+                  '--parejas-detalle', '2', '--salida', str(salida)]
+    emparejador.main(argumentos)
+    resultados = json.loads(salida.read_text())
+    escala, = resultados['escalas']
+    assert escala['afiliados'] == 12 and escala['operaciones'] == 48
+    assert {'calcular_estandar[clasico]', 'calcular_avanzado[clasico]', 'calcular_estandar[vectorizado]',
+            'calcular_avanzado[vectorizado]', 'detalles_emparejamiento', 'historico'} <= set(escala['casos'])
+    assert 'etapas_ms' in escala['casos']['calcular_estandar[vectorizado]']['perf']
+
+    comparada = emparejador.main(argumentos + ['--comparar', str(salida)])
+    casos = comparada['comparacion']['casos']
+    assert len(casos) == len(escala['casos']) and all(fila['afiliados'] == 12 for fila in casos)
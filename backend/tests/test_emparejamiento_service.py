@@ -0,0 +1,781 @@
+import random
+import pandas as pd
+import pytest
+from datetime import datetime, timedelta, time
+from app.services import emparejamiento_service
+from app.models.operacion import Operacion
+from app.models.afiliado import Afiliado
+from app.models.rango_afiliado import RangoAfiliado
+
+CANALES = ['Izipay', 'Iziya', 'Ambos']
+RANGOS = [(0, 500), (500, 700), (700, 1000), (300, 900)]
+
+def poblar_datos(db, num_afiliados=12, num_operaciones=300, semilla=7):
+    """Genera afiliados, rangos y operaciones deterministas para las pruebas"""
+    rnd = random.Random(semilla)
+    numeros = [f"9{i:08d}" for i in range(num_afiliados)]
+    externos = [f"8{i:08d}" for i in range(3)]
+
+    for pos, numero in enumerate(numeros):
+        db.session.add(Afiliado(
+            numero=numero,
+            nombre=f"Nombre{pos}",
+            apellido_paterno=f"Paterno{pos}",
+            apellido_materno=f"Materno{pos}",
+            dni=f"{pos:08d}",
+            estado='Activo'
+        ))
+        for inicio, fin in rnd.sample(RANGOS, rnd.randint(1, 2)):
+            db.session.add(RangoAfiliado(
+                numero_afiliado=numero,
+                rango_inicio=inicio,
+                rango_fin=fin,
+                recibe_en=rnd.choice(CANALES),
+                envia_a=rnd.choice(CANALES)
+            ))
+
+    ahora = datetime.now()
+    participantes = numeros + externos
+    for _ in range(num_operaciones):
+        nombre1, nombre2 = rnd.sample(participantes, 2)
+        instante = ahora - timedelta(days=rnd.randint(0, 90), minutes=rnd.randint(0, 1439))
+        db.session.add(Operacion(
+            fecha=instante.date(),
+            hora=time(instante.hour, instante.minute),
+            nombre1=nombre1,
+            nombre2=nombre2,
+            monto=float(rnd.choice([150, 300, 450, 600, 750, 820]))
+        ))
+    db.session.commit()
+    return numeros
+
+def calcular(filtros, semilla=11):
+    """Ejecuta el cálculo con una semilla fija para los montos sugeridos"""
+    return emparejamiento_service.calcular_emparejamientos({'semilla': semilla, **filtros})['data']
+
+@pytest.mark.parametrize('filtros', [
+    {'dias_minimos': 1, 'riesgo_maximo': 100},
+    {'dias_minimos': 5, 'riesgo_maximo': 40},
+    {'dias_minimos': 1, 'riesgo_maximo': 100, 'usar_algoritmo_avanzado': True},
+    {'dias_minimos': 3, 'riesgo_maximo': 60, 'usar_algoritmo_avanzado': True,
+     'monto_minimo': 200, 'monto_maximo': 750,
+     'ponderaciones': {'dias': 0.1, 'diversidad': 0.5, 'operaciones': 0.2, 'patron': 0.2}},
+])
+def test_motor_vectorizado_equivale_al_clasico(with_db_context, filtros):
+    """El motor vectorizado devuelve los mismos resultados que el bucle por pareja"""
+    poblar_datos(with_db_context)
+
+    clasico = calcular({**filtros, 'motor': 'clasico'})
+    vectorizado = calcular({**filtros, 'motor': 'vectorizado'})
+
+    assert len(clasico) > 0
+    assert vectorizado == clasico
+
+@pytest.mark.parametrize('filtros', [
+    {'dias_minimos': 1, 'riesgo_maximo': 100},
+    {'dias_minimos': 3, 'riesgo_maximo': 60, 'usar_algoritmo_avanzado': True,
+     'monto_minimo': 200, 'monto_maximo': 750},
+])
+def test_motor_paralelo_equivale_al_vectorizado(with_db_context, monkeypatch, filtros):
+    """Repartir los bloques entre procesos no cambia los resultados ni las estadísticas"""
+    from flask import current_app
+
+    poblar_datos(with_db_context, num_afiliados=40, num_operaciones=600)
+    motor = emparejamiento_service.motor_vectorizado
+    monkeypatch.setattr(motor, 'tam_bloque', 64)
+    monkeypatch.setattr(motor.paralelo, 'min_parejas', 0)
+    current_app.config['EMPAREJADOR_PROCESOS'] = 2
+
+    serie = emparejamiento_service.calcular_emparejamientos({**filtros, 'motor': 'vectorizado', 'limite': None, 'semilla': 11})
+    paralelo = emparejamiento_service.calcular_emparejamientos({**filtros, 'motor': 'paralelo', 'limite': None, 'semilla': 11})
+
+    assert len(paralelo['data']) > 0
+    assert paralelo['data'] == serie['data']
+    assert paralelo['estadisticas'] == serie['estadisticas']
+
+def test_pool_paralelo_compartido():
+    """El pool no se reemplaza ni se cierra mientras un cálculo lo usa"""
+    from app.services.evaluacion_paralela import EvaluadorParalelo
+
+    evaluador = EvaluadorParalelo()
+    primero = evaluador._tomar_executor(2)
+    # Otra cantidad de procesos con el pool en uso: se comparte el mismo
+    segundo = evaluador._tomar_executor(3)
+    assert segundo is primero
+
+    evaluador.cerrar()
+    assert evaluador._executor is primero
+    evaluador._liberar_executor(primero)
+    assert evaluador._executor is primero
+    evaluador._liberar_executor(segundo)
+    assert evaluador._executor is None
+
+    tercero = evaluador._tomar_executor(3)
+    assert tercero is not primero
+    evaluador._liberar_executor(tercero)
+    evaluador.cerrar()
+
+def test_motor_invalido(with_db_context):
+    """Un motor desconocido se rechaza como error de validación"""
+    from app.utils.exceptions import ValidationError
+
+    with pytest.raises(ValidationError):
+        emparejamiento_service.calcular_emparejamientos({'motor': 'cuantico'})
+
+def test_parejas_candidatas_equivalen_al_rango_efectivo(app):
+    """El barrido lista exactamente las parejas superpuestas con su rango más amplio"""
+    rnd = random.Random(5)
+    rangos_consolidados = {}
+    for pos in range(40):
+        rangos = []
+        for _ in range(rnd.randint(1, 3)):
+            inicio = rnd.choice([0, 100, 200, 300, 500, 700])
+            rangos.append({'inicio': inicio, 'fin': inicio + rnd.choice([0, 100, 200, 400])})
+        rangos_consolidados[f"9{pos:08d}"] = {
+            'nombre_completo': f"Nombre{pos}", 'rangos': rangos,
+            'recibe_en': {rnd.choice(CANALES)}, 'envia_a': set()
+        }
+
+    with app.app_context():
+        candidatas = emparejamiento_service.motor_vectorizado.parejas_candidatas(rangos_consolidados)
+
+    esperadas = []
+    afiliados_list = list(rangos_consolidados.values())
+    for i, info1 in enumerate(afiliados_list):
+        for j in range(i + 1, len(afiliados_list)):
+            info2 = afiliados_list[j]
+            rango = emparejamiento_service._calcular_rango_efectivo(info1['rangos'], info2['rangos'])
+            if rango is None:
+                continue
+            if 'Izipay' in info1['recibe_en'] or 'Izipay' in info2['recibe_en']:
+                rango['fin'] = min(rango['fin'], 800)
+            if rango['fin'] > rango['inicio']:
+                esperadas.append((i, j, rango['inicio'], rango['fin']))
+
+    obtenidas = list(zip(candidatas['i'].tolist(), candidatas['j'].tolist(),
+                         candidatas['inicio'].tolist(), candidatas['fin'].tolist()))
+    assert obtenidas == esperadas
+    assert candidatas['total'] == 40 * 39 // 2
+    assert candidatas['total'] - candidatas['sin_superposicion'] - candidatas['rango_invalido'] == len(esperadas)
+
+def test_parejas_candidatas_descartan_canales_incompatibles(app):
+    """Sólo quedan las parejas en que cada afiliado envía a un canal en que el otro recibe"""
+    rnd = random.Random(11)
+    rangos_consolidados = {
+        f"9{pos:08d}": {
+            'nombre_completo': f"Nombre{pos}", 'rangos': [{'inicio': 100, 'fin': 500}],
+            'recibe_en': {rnd.choice(CANALES)}, 'envia_a': {rnd.choice(CANALES)}
+        }
+        for pos in range(30)
+    }
+
+    with app.app_context():
+        candidatas = emparejamiento_service.motor_vectorizado.parejas_candidatas(rangos_consolidados)
+
+    def alcance(canales):
+        return {'Izipay', 'Iziya'} if 'Ambos' in canales else set(canales)
+
+    afiliados_list = list(rangos_consolidados.values())
+    esperadas = [
+        (i, j) for i in range(30) for j in range(i + 1, 30)
+        if alcance(afiliados_list[i]['envia_a']) & alcance(afiliados_list[j]['recibe_en'])
+        and alcance(afiliados_list[j]['envia_a']) & alcance(afiliados_list[i]['recibe_en'])
+    ]
+    assert list(zip(candidatas['i'].tolist(), candidatas['j'].tolist())) == esperadas
+    assert candidatas['canal_incompatible'] == 30 * 29 // 2 - len(esperadas) > 0
+    assert candidatas['sin_superposicion'] == candidatas['rango_invalido'] == 0
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_avanzado_evalua_todas_las_parejas(with_db_context, motor):
+    """Sin tope de 10.000 parejas: las estadísticas cubren todas las combinaciones"""
+    poblar_datos(with_db_context, num_afiliados=150, num_operaciones=400)
+
+    respuesta = emparejamiento_service.calcular_emparejamientos({
+        'dias_minimos': 2, 'riesgo_maximo': 60, 'usar_algoritmo_avanzado': True, 'motor': motor
+    })
+    estadisticas = respuesta['estadisticas']
+    descartadas = estadisticas['descartadas']
+
+    assert estadisticas['combinaciones'] == 150 * 149 // 2
+    assert estadisticas['completo'] and estadisticas['sin_evaluar'] == 0
+    assert estadisticas['combinaciones'] == (
+        descartadas['sin_superposicion'] + descartadas['canal_incompatible'] + descartadas['rango_invalido'] +
+        descartadas['dias_minimos'] + estadisticas['evaluadas']
+    )
+    assert estadisticas['evaluadas'] - descartadas['riesgo_maximo'] == respuesta['paginacion']['total']
+
+def test_estadisticas_iguales_en_ambos_motores(with_db_context):
+    """Ambos motores reportan los mismos descartes por etapa"""
+    poblar_datos(with_db_context)
+    filtros = {'dias_minimos': 3, 'riesgo_maximo': 60, 'monto_minimo': 200, 'monto_maximo': 600}
+
+    clasico = emparejamiento_service.calcular_emparejamientos({**filtros, 'motor': 'clasico', 'semilla': 11})
+    vectorizado = emparejamiento_service.calcular_emparejamientos({**filtros, 'motor': 'vectorizado', 'semilla': 11})
+
+    assert clasico['estadisticas'] == vectorizado['estadisticas']
+    assert clasico['estadisticas']['descartadas']['dias_minimos'] > 0
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_presupuesto_agotado(with_db_context, motor):
+    """Al agotarse el presupuesto se informa cuántas parejas quedaron sin evaluar"""
+    from flask import current_app
+
+    poblar_datos(with_db_context)
+    current_app.config['EMPAREJADOR_PRESUPUESTO_SEGUNDOS'] = 1e-9
+
+    estadisticas = emparejamiento_service.calcular_emparejamientos({
+        'dias_minimos': 1, 'riesgo_maximo': 100, 'motor': motor
+    })['estadisticas']
+
+    assert not estadisticas['completo']
+    assert estadisticas['sin_evaluar'] > 0
+    assert estadisticas['evaluadas'] == 0
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_calculo_cancelado(with_db_context, motor):
+    """Un control cancelado deja todas las parejas sin evaluar y lo informa"""
+    from app.services.control_ejecucion import ControlEjecucion
+
+    poblar_datos(with_db_context)
+    control = ControlEjecucion()
+    control.cancelar()
+
+    estadisticas = emparejamiento_service.calcular_emparejamientos(
+        {'dias_minimos': 1, 'riesgo_maximo': 100, 'motor': motor}, control=control
+    )['estadisticas']
+
+    assert estadisticas['cancelado'] and not estadisticas['completo']
+    assert estadisticas['evaluadas'] == 0
+    assert estadisticas['sin_evaluar'] > 0
+
+def test_seleccion_top_k_estable():
+    """El heap conserva los k de menor riesgo en el orden de un sort estable"""
+    from app.services.seleccion_resultados import SeleccionTopK
+
+    rnd = random.Random(3)
+    resultados = [{'riesgo': rnd.choice([10.0, 20.5, 30.0, 40.25]), 'monto_asignado': rnd.randint(100, 900), 'id': n}
+                  for n in range(200)]
+    seleccion = SeleccionTopK(25, monto_minimo=200, monto_maximo=800)
+    for resultado in resultados:
+        seleccion.agregar(resultado)
+
+    esperados = sorted((r for r in resultados if 200 <= r['monto_asignado'] <= 800), key=lambda r: r['riesgo'])
+    assert seleccion.resultados() == esperados[:25]
+    assert seleccion.total == len(esperados)
+    assert seleccion.descartadas_monto == 200 - len(esperados)
+
+def test_seleccion_construye_solo_las_elegidas():
+    """agregar_pareja equivale a agregar, pero sólo construye los resultados conservados"""
+    from app.services.planificacion_diaria import SeleccionPlan
+    from app.services.seleccion_resultados import SeleccionTopK
+
+    rnd = random.Random(5)
+    parejas = [((f"A{rnd.randrange(12)}", f"B{rnd.randrange(12)}"), rnd.choice([10.0, 20.5, 30.0]),
+                rnd.randint(100, 900), (n,)) for n in range(300)]
+    construidos = []
+
+    def construir(pareja, riesgo, monto, datos):
+        construidos.append(datos[0])
+        return {'pareja': list(pareja), 'riesgo': riesgo, 'monto_asignado': monto, 'id': datos[0]}
+
+    for seleccion, referencia in ((SeleccionTopK(10, monto_minimo=200), SeleccionTopK(10, monto_minimo=200)),
+                                  (SeleccionPlan(monto_minimo=200), SeleccionPlan(monto_minimo=200))):
+        construidos.clear()
+        for pareja, riesgo, monto, datos in parejas:
+            seleccion.agregar_pareja(pareja, riesgo, monto, datos, construir)
+            referencia.agregar(construir(pareja, riesgo, monto, datos))
+        construidos.clear()
+
+        resultados = seleccion.resultados()
+        assert resultados == referencia.resultados()
+        assert seleccion.total == referencia.total
+        assert seleccion.descartadas_monto == referencia.descartadas_monto
+        if isinstance(seleccion, SeleccionPlan):
+            assert sorted(construidos) == sorted(r['id'] for r in resultados)
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_paginacion_de_resultados(with_db_context, motor):
+    """limite/offset devuelven la misma página que recortar la lista completa"""
+    poblar_datos(with_db_context)
+    filtros = {'dias_minimos': 1, 'riesgo_maximo': 100, 'monto_minimo': 200, 'motor': motor}
+
+    completo = calcular({**filtros, 'limite': None})
+    respuesta = emparejamiento_service.calcular_emparejamientos({**filtros, 'limite': 7, 'offset': 5, 'semilla': 11})
+
+    assert respuesta['data'] == completo[5:12]
+    assert respuesta['paginacion'] == {'total': len(completo), 'limite': 7, 'offset': 5}
+
+def test_paginacion_invalida(with_db_context):
+    """Un limite u offset inválido se rechaza como error de validación"""
+    from app.utils.exceptions import ValidationError
+
+    for filtros in ({'limite': 0}, {'offset': -1}, {'limite': 'diez'}):
+        with pytest.raises(ValidationError):
+            emparejamiento_service.calcular_emparejamientos(filtros)
+
+def test_cache_de_resultados(with_db_context, monkeypatch):
+    """Repetir un cálculo lo sirve la cache; una escritura en los datos la invalida"""
+    from flask import current_app
+    from app.utils.cache_lru import CacheLRU
+
+    numeros = poblar_datos(with_db_context)
+    current_app.config['EMPAREJADOR_CACHE_TAMANO'] = 3
+    monkeypatch.setattr(emparejamiento_service, 'cache_resultados', CacheLRU())
+    filtros = {'dias_minimos': 1, 'riesgo_maximo': 100, 'limite': 20}
+
+    primero = emparejamiento_service.calcular_emparejamientos(dict(filtros))
+    segundo = emparejamiento_service.calcular_emparejamientos(dict(filtros))
+    assert not primero['desde_cache'] and segundo['desde_cache']
+    assert segundo['data'] == primero['data']
+
+    # Una página dentro de los k guardados se sirve desde la cache; el motor no cuenta
+    pagina = emparejamiento_service.calcular_emparejamientos({**filtros, 'limite': 5, 'offset': 10, 'motor': 'vectorizado'})
+    assert pagina['desde_cache'] and pagina['data'] == primero['data'][10:15]
+    assert not emparejamiento_service.calcular_emparejamientos({**filtros, 'limite': 50})['desde_cache']
+
+    # Agregar y quitar un rango invalida la cache
+    emparejamiento_service.agregar_afiliado_rango({
+        'numero': numeros[0], 'rango_inicio': 900, 'rango_fin': 1200, 'recibe_en': 'Iziya', 'envia_a': 'Iziya'
+    })
+    assert not emparejamiento_service.calcular_emparejamientos(dict(filtros))['desde_cache']
+    rango = RangoAfiliado.query.filter_by(numero_afiliado=numeros[0], rango_inicio=900).first()
+    emparejamiento_service.eliminar_afiliado_rango(rango.id)
+    assert not emparejamiento_service.calcular_emparejamientos(dict(filtros))['desde_cache']
+
+    # También borrar operaciones
+    with_db_context.session.delete(Operacion.query.first())
+    with_db_context.session.commit()
+    assert not emparejamiento_service.calcular_emparejamientos(dict(filtros))['desde_cache']
+
+    estadisticas = emparejamiento_service.estadisticas_cache()
+    assert (estadisticas['aciertos'], estadisticas['fallos']) == (2, 5)
+    assert estadisticas['entradas'] == 3 and estadisticas['expulsiones'] == 1
+
+def test_version_cambia_solo_con_el_commit(with_db_context):
+    """Una escritura descartada no cambia la versión; la de otro proceso sí se ve"""
+    from sqlalchemy import text
+    from app.utils import version_datos
+
+    db = with_db_context
+    inicial = version_datos.version('afiliados')
+    db.session.add(Afiliado(numero='111', nombre='A', apellido_paterno='B', apellido_materno='C', dni='1'))
+    db.session.flush()
+    assert version_datos.version('afiliados') != inicial
+    db.session.rollback()
+    assert version_datos.version('afiliados') == inicial
+
+    db.session.add(Afiliado(numero='111', nombre='A', apellido_paterno='B', apellido_materno='C', dni='1'))
+    db.session.commit()
+    confirmada = version_datos.version('afiliados')
+    assert confirmada != inicial and version_datos.version('operaciones') == 0
+
+    # Otro proceso que escribe en la misma base deja su versión en la tabla
+    db.session.execute(text("UPDATE versiones_datos SET version = 7 WHERE tabla = :tabla"), {'tabla': 'afiliados'})
+    db.session.commit()
+    assert version_datos.version('afiliados') == 7
+
+def test_version_por_tabla_destino(with_db_context):
+    """Sólo cambia la versión de la tabla escrita; la previa es la que reemplaza la transacción"""
+    from sqlalchemy import create_engine, text
+    from app.utils import version_datos
+
+    db = with_db_context
+    antes = version_datos.versiones()
+    db.session.add(RangoAfiliado(numero_afiliado='111', rango_inicio=0, rango_fin=100,
+                                 recibe_en='Izipay', envia_a='Izipay'))
+    db.session.execute(text("SELECT 'operaciones', 'afiliados'")).all()
+    db.session.flush()
+    assert version_datos.version_previa('rango_afiliados') == antes['rango_afiliados']
+    db.session.commit()
+    despues = version_datos.versiones()
+    assert despues['rango_afiliados'] != antes['rango_afiliados']
+    assert despues['afiliados'] == antes['afiliados'] and despues['operaciones'] == antes['operaciones']
+
+    # En SQL textual cuenta la tabla destino exacta
+    db.session.execute(text("UPDATE rango_afiliados SET rango_fin = 200"))
+    assert version_datos.version_previa('rango_afiliados') == despues['rango_afiliados']
+    assert version_datos.version_previa('afiliados') == version_datos.version('afiliados') == despues['afiliados']
+    db.session.commit()
+
+    # Otros engines del proceso no se versionan
+    otro = create_engine('sqlite://')
+    with otro.begin() as conexion:
+        conexion.execute(text("CREATE TABLE operaciones (id INTEGER)"))
+        conexion.execute(text("INSERT INTO operaciones VALUES (1)"))
+    assert version_datos.version('operaciones') == antes['operaciones']
+
+def test_cache_lru_expulsa_la_menos_usada():
+    """Al superar el tamaño se expulsa la entrada usada hace más tiempo"""
+    from app.utils.cache_lru import CacheLRU
+
+    cache = CacheLRU(tamano_maximo=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obtener('a') == 1
+    cache.guardar('c', 3)
+
+    assert cache.obtener('b') is None
+    assert (cache.obtener('a'), cache.obtener('c')) == (1, 3)
+    assert cache.estadisticas()['expulsiones'] == 1
+
+def test_generador_montos_reproducible():
+    """Con semilla los montos se repiten y no dependen del tamaño de los lotes"""
+    from app.services.montos_sugeridos import GeneradorMontos
+
+    inicios = [0, 100, 500, 790, 300, 10]
+    fines = [500, 700, 800, 800, 300.5, 900]
+    montos_pareja = [[], [300.0, 450.0], [600.0], [], [150.0, 150.0], [820.0]]
+    riesgos = [10, 50, 80, 20, 25, 10]
+
+    lote = GeneradorMontos(7).sugerir(inicios, fines, montos_pareja, riesgos)
+    partido = GeneradorMontos(7)
+    por_partes = partido.sugerir(inicios[:2], fines[:2], montos_pareja[:2], riesgos[:2]) + \
+        partido.sugerir(inicios[2:], fines[2:], montos_pareja[2:], riesgos[2:])
+
+    assert lote == por_partes
+    assert lote == GeneradorMontos(7).sugerir(inicios, fines, montos_pareja, riesgos)
+    # Rango sin puntos enteros: respaldo al punto medio
+    assert lote[4] == 300.25
+    for monto, inicio, fin in zip(lote, inicios, fines):
+        assert inicio <= monto <= fin
+
+    tradicionales = GeneradorMontos(3).sugerir([0] * 200, [600] * 200, excluir={600, 599, 598})
+    assert all(400 <= m <= 600 and m not in (598, 599, 600) for m in tradicionales)
+
+def test_generador_montos_distintos():
+    """sugerir_distintos evita repetir montos y respeta las exclusiones por pareja"""
+    from app.services.montos_sugeridos import GeneradorMontos
+
+    generador = GeneradorMontos(1)
+    sugeridos = generador.sugerir_distintos(
+        [0, 400, 100], [800, 403, 700], [[], [], [300.0]], excluir=[{800}, {401}, set()], cantidad=5
+    )
+
+    assert len(sugeridos[0]) == 5 and len(set(sugeridos[0])) == 5 and 800 not in sugeridos[0]
+    # Sólo 3 puntos en la grilla de [400, 403] y uno excluido
+    assert sorted(sugeridos[1]) == [400, 402]
+    assert sugeridos == GeneradorMontos(1).sugerir_distintos(
+        [0, 400, 100], [800, 403, 700], [[], [], [300.0]], excluir=[{800}, {401}, set()], cantidad=5
+    )
+
+def test_semilla_invalida(with_db_context):
+    """Una semilla que no es entera se rechaza como error de validación"""
+    from app.utils.exceptions import ValidationError
+
+    with pytest.raises(ValidationError):
+        emparejamiento_service.calcular_emparejamientos({'semilla': 'abc'})
+
+def test_carga_columnar_de_operaciones(with_db_context):
+    """cargar_operaciones equivale a leer con el ORM y preparar las fechas"""
+    from app.services.carga_operaciones import cargar_operaciones, _horas
+
+    assert cargar_operaciones().empty
+    poblar_datos(with_db_context, num_afiliados=20, num_operaciones=300)
+
+    filas = Operacion.query.with_entities(
+        Operacion.fecha, Operacion.hora, Operacion.nombre1, Operacion.nombre2, Operacion.monto
+    ).all()
+    esperado = pd.DataFrame([fila._asdict() for fila in filas])
+    emparejamiento_service._preparar_fechas(esperado, avanzado=False)
+    cargado = cargar_operaciones()
+
+    for columna in ('fecha', 'fecha_completa'):
+        assert (cargado[columna].to_numpy('datetime64[ns]') == esperado[columna].to_numpy('datetime64[ns]')).all()
+    for columna in ('nombre1', 'nombre2', 'monto'):
+        assert cargado[columna].tolist() == esperado[columna].tolist()
+
+    horas = ['10:15', '10:15:30', '10:15:30.25', '23:59:59.000001']
+    assert (_horas(horas) == pd.to_timedelta(['10:15:00', '10:15:30', '10:15:30.25', '23:59:59.000001'])).all()
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_ventana_de_dias(with_db_context, motor):
+    """Con ventana_dias el resultado es el de un historial que sólo tiene esas operaciones"""
+    from app.utils import version_datos
+    from app.utils.exceptions import ValidationError
+
+    poblar_datos(with_db_context, num_operaciones=400)
+    filtros = {'dias_minimos': 0, 'riesgo_maximo': 100, 'usar_algoritmo_avanzado': True, 'motor': motor}
+
+    ventana = emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': 30, 'semilla': 3})
+    completo = emparejamiento_service.calcular_emparejamientos({**filtros, 'semilla': 3})
+    desde = (datetime.now() - timedelta(days=30)).date()
+    recientes = Operacion.query.filter(Operacion.fecha >= desde).count()
+    assert ventana['estadisticas']['ventana'] == {'dias': 30, 'desde': desde.isoformat(), 'operaciones': recientes}
+    assert completo['estadisticas']['ventana'] == {'dias': 0, 'desde': None, 'operaciones': 400}
+
+    # Alternar ventanas reutiliza los índices de cada una
+    version = version_datos.version('operaciones')
+    indices = emparejamiento_service.cache_indices.obtener((version, desde))
+    assert indices is not None and emparejamiento_service.cache_indices.obtener(version) is not None
+    otra_vez = emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': 30, 'semilla': 3})
+    assert otra_vez['data'] == ventana['data']
+    assert emparejamiento_service.cache_indices.obtener((version, desde)) is indices
+
+    Operacion.query.filter(Operacion.fecha < desde).delete()
+    with_db_context.session.commit()
+    recortado = emparejamiento_service.calcular_emparejamientos({**filtros, 'semilla': 3})
+    assert ventana['data'] == recortado['data']
+    assert ventana['data'] != completo['data']
+
+    with pytest.raises(ValidationError):
+        emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': -1})
+
+def test_instantanea_de_operaciones(with_db_context, app, tmp_path):
+    """Con instantánea en disco el resultado es el mismo, se reutiliza tras reiniciar y se actualiza al cargar"""
+    import io
+    from app.utils import version_datos
+    import numpy as np
+    from werkzeug.datastructures import FileStorage
+    from app.services import operaciones_service
+    from app.services.instantanea_operaciones import ARCHIVO_ACTUAL, InstantaneaOperaciones
+
+    poblar_datos(with_db_context, num_operaciones=400)
+    filtros = {'dias_minimos': 0, 'riesgo_maximo': 100, 'usar_algoritmo_avanzado': True, 'semilla': 3}
+    sin_instantanea = emparejamiento_service.calcular_emparejamientos(filtros)
+    sin_ventana = emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': 30})
+
+    app.config['EMPAREJADOR_INSTANTANEA_DIR'] = str(tmp_path)
+    # Sin instantánea al día, un pedido con ventana sólo lee la ventana de la base
+    ventana = emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': 30})
+    assert ventana['data'] == sin_ventana['data']
+    assert not (tmp_path / ARCHIVO_ACTUAL).exists()
+
+    con_instantanea = emparejamiento_service.calcular_emparejamientos(filtros)
+    assert con_instantanea['data'] == sin_instantanea['data']
+    ventana = emparejamiento_service.calcular_emparejamientos({**filtros, 'ventana_dias': 30})
+    assert ventana['estadisticas']['ventana'] == sin_ventana['estadisticas']['ventana']
+    assert ventana['data'] == sin_ventana['data']
+
+    vigente = tmp_path / (tmp_path / ARCHIVO_ACTUAL).read_text()
+    assert (vigente / 'codigo1.npy').exists() and (vigente / 'meta.json').exists()
+    assert isinstance(emparejamiento_service.instantanea.columnas['monto'], np.memmap)
+
+    # Otro proceso (o un reinicio) abre la misma instantánea sin leer la tabla
+    reiniciada = InstantaneaOperaciones()
+    reiniciada.configurar(str(tmp_path))
+    columnas = reiniciada.vigente(version_datos.version('operaciones'), emparejamiento_service.codificador)
+    assert isinstance(columnas['codigo1'], np.memmap)
+    assert len(columnas['monto']) == 400
+
+    # La carga de un archivo agrega sus filas a una instantánea nueva
+    archivo = FileStorage(
+        stream=io.BytesIO(b"Date,Time,Phone Number 1,Phone Number 2,Amount\n"
+                          b"2023-01-02,10:00,900000000,900000001,200\n"),
+        filename='operaciones.csv'
+    )
+    operaciones_service.procesar_archivos([archivo])
+    actualizada = tmp_path / (tmp_path / ARCHIVO_ACTUAL).read_text()
+    assert actualizada != vigente and not vigente.exists()
+    assert len(emparejamiento_service.instantanea.columnas['monto']) == 401
+
+    app.config['EMPAREJADOR_INSTANTANEA_DIR'] = ''
+    sin_instantanea = emparejamiento_service.calcular_emparejamientos(filtros)
+    app.config['EMPAREJADOR_INSTANTANEA_DIR'] = str(tmp_path)
+    assert emparejamiento_service.calcular_emparejamientos(filtros)['data'] == sin_instantanea['data']
+
+    # Un UPDATE no cambia la cantidad de filas ni el id máximo, pero sí la versión
+    reiniciada = InstantaneaOperaciones()
+    reiniciada.configurar(str(tmp_path))
+    Operacion.query.filter(Operacion.id <= 50).update({'monto': 5000.0})
+    with_db_context.session.commit()
+    assert reiniciada.vigente(version_datos.version('operaciones'), emparejamiento_service.codificador) is None
+    app.config['EMPAREJADOR_INSTANTANEA_DIR'] = ''
+    sin_instantanea = emparejamiento_service.calcular_emparejamientos(filtros)
+    app.config['EMPAREJADOR_INSTANTANEA_DIR'] = str(tmp_path)
+    assert emparejamiento_service.calcular_emparejamientos(filtros)['data'] == sin_instantanea['data']
+    assert emparejamiento_service.instantanea.meta['firma'] == version_datos.version('operaciones')
+
+def test_reponderar_usa_caracteristicas_guardadas(with_db_context, app):
+    """Cambiar las ponderaciones vuelve a puntuar las características guardadas sin leer los datos"""
+    from sqlalchemy import event
+
+    poblar_datos(with_db_context, num_afiliados=40, num_operaciones=600)
+    filtros = {'dias_minimos': 1, 'riesgo_maximo': 60, 'usar_algoritmo_avanzado': True,
+               'motor': 'vectorizado', 'semilla': 9, 'limite': 15}
+    otras = {'dias': 0.1, 'diversidad': 0.5, 'operaciones': 0.2, 'patron': 0.2}
+    esperado = emparejamiento_service.calcular_emparejamientos(
+        {**filtros, 'motor': 'clasico', 'ponderaciones': otras, 'riesgo_maximo': 40}
+    )
+
+    app.config['EMPAREJADOR_CACHE_CARACTERISTICAS'] = 2
+    emparejamiento_service.calcular_emparejamientos(filtros)
+
+    consultas = []
+    def contar(conn, cursor, statement, *args):
+        # Leer la versión de los datos es lo único que se consulta
+        if 'versiones_datos' not in statement:
+            consultas.append(statement)
+
+    event.listen(with_db_context.engine, 'before_cursor_execute', contar)
+    try:
+        reponderado = emparejamiento_service.calcular_emparejamientos(
+            {**filtros, 'ponderaciones': otras, 'riesgo_maximo': 40}
+        )
+    finally:
+        event.remove(with_db_context.engine, 'before_cursor_execute', contar)
+
+    assert consultas == []
+    assert reponderado['data'] == esperado['data']
+    assert reponderado['paginacion'] == esperado['paginacion']
+    assert reponderado['estadisticas']['descartadas'] == esperado['estadisticas']['descartadas']
+    assert emparejamiento_service.motor_vectorizado.cache_caracteristicas.aciertos >= 1
+
+def plan_de_referencia(ranking, cupo_diario, cupos):
+    """Recorrido voraz directo sobre el ranking completo de calcular"""
+    restante = {}
+    plan = []
+    for resultado in ranking:
+        a, b = resultado['pareja']
+        cupo_a = restante.setdefault(a, cupos.get(a, cupo_diario))
+        cupo_b = restante.setdefault(b, cupos.get(b, cupo_diario))
+        if cupo_a > 0 and cupo_b > 0:
+            restante[a] -= 1
+            restante[b] -= 1
+            plan.append(resultado)
+    return plan
+
+@pytest.mark.parametrize('filtros', [
+    {'dias_minimos': 1, 'riesgo_maximo': 100, 'cupo_diario': 1},
+    {'dias_minimos': 1, 'riesgo_maximo': 100, 'cupo_diario': 2, 'cupos': {'900000003': 0, '900000005': 3}},
+    {'dias_minimos': 3, 'riesgo_maximo': 60, 'usar_algoritmo_avanzado': True, 'cupo_diario': 2,
+     'monto_minimo': 200, 'monto_maximo': 750},
+])
+@pytest.mark.parametrize('bloques', [False, True])
+def test_plan_diario_respeta_cupos(with_db_context, monkeypatch, filtros, bloques):
+    """El plan es el recorrido voraz del ranking y no depende del motor ni del tamaño de bloque"""
+    if bloques:
+        from app.services import planificacion_diaria
+        monkeypatch.setattr(planificacion_diaria, 'TAMANO_BLOQUE', 3)
+    poblar_datos(with_db_context, num_afiliados=20)
+    cupos = filtros.get('cupos', {})
+
+    ranking = calcular({**filtros, 'motor': 'clasico', 'limite': None})
+    esperado = plan_de_referencia(ranking, filtros['cupo_diario'], cupos)
+    planes = {
+        motor: emparejamiento_service.planificar_emparejamientos({**filtros, 'motor': motor, 'semilla': 11})
+        for motor in ('clasico', 'vectorizado')
+    }
+
+    assert len(esperado) > 0
+    for respuesta in planes.values():
+        assert respuesta['data'] == esperado
+        apariciones = pd.Series([n for r in respuesta['data'] for n in r['pareja']]).value_counts()
+        assert all(veces <= cupos.get(numero, filtros['cupo_diario']) for numero, veces in apariciones.items())
+        assert respuesta['plan']['parejas'] == len(esperado)
+        assert respuesta['plan']['riesgo_total'] == round(sum(r['riesgo'] for r in esperado), 2)
+    assert planes['clasico']['plan'] == planes['vectorizado']['plan']
+
+    tope = emparejamiento_service.planificar_emparejamientos({**filtros, 'maximo_parejas': 2, 'semilla': 11})
+    assert tope['data'] == esperado[:2]
+
+def test_plan_diario_cupos_invalidos(with_db_context):
+    """cupo_diario positivo y cupos no negativos"""
+    from app.utils.exceptions import ValidationError
+    with pytest.raises(ValidationError):
+        emparejamiento_service.planificar_emparejamientos({'cupo_diario': 0})
+    with pytest.raises(ValidationError):
+        emparejamiento_service.planificar_emparejamientos({'cupos': {'900000001': -1}})
+    with pytest.raises(ValidationError):
+        emparejamiento_service.planificar_emparejamientos({'cupos': ['900000001']})
+
+@pytest.mark.parametrize('filtros', [
+    {'dias_minimos': 1, 'riesgo_maximo': 100},
+    {'dias_minimos': 5, 'riesgo_maximo': 40},
+    {'dias_minimos': 3, 'riesgo_maximo': 80, 'usar_algoritmo_avanzado': True, 'monto_minimo': 200,
+     'monto_maximo': 900, 'ponderaciones': {'dias': 0.1, 'diversidad': 0.5, 'operaciones': 0.2, 'patron': 0.2}},
+])
+def test_mejores_parejas_equivalen_al_calculo_completo(with_db_context, filtros):
+    """Las parejas de un afiliado tienen el mismo riesgo que en el cálculo completo"""
+    numeros = poblar_datos(with_db_context, num_afiliados=20)
+    sin_monto = lambda resultados: [{c: v for c, v in r.items() if c != 'monto_asignado'} for r in resultados]
+    # En modo avanzado los montos acotan el rango (no filtran por monto sugerido)
+    completo = sin_monto(calcular({**filtros, 'limite': None}))
+
+    for numero in numeros:
+        respuesta = emparejamiento_service.mejores_parejas(numero, {**filtros, 'limite': None, 'semilla': 1})
+        esperado = [r for r in completo if numero in r['pareja']]
+        assert sin_monto(respuesta['data']) == esperado
+        assert respuesta['estadisticas']['combinaciones'] == len(numeros) - 1
+
+    primeras = emparejamiento_service.mejores_parejas(numeros[0], {**filtros, 'limite': 3, 'semilla': 1})
+    assert sin_monto(primeras['data']) == [r for r in completo if numeros[0] in r['pareja']][:3]
+
+def test_mejores_parejas_reutiliza_el_perfil(with_db_context, app):
+    """Con el perfil por afiliado en cache una consulta no lee la base"""
+    from sqlalchemy import event
+    from app.utils.exceptions import ValidationError
+    numeros = poblar_datos(with_db_context)
+    emparejamiento_service.motor_vectorizado.cache_afiliados.limpiar()
+
+    primera = emparejamiento_service.mejores_parejas(numeros[0], {'riesgo_maximo': 100})
+    assert not primera['desde_cache']
+
+    consultas = []
+    # Salvo la versión de los datos, que valida el perfil guardado
+    contar = lambda *args: 'versiones_datos' in args[2] or consultas.append(args[2])
+    event.listen(with_db_context.engine, 'before_cursor_execute', contar)
+    try:
+        segunda = emparejamiento_service.mejores_parejas(numeros[1], {'riesgo_maximo': 100})
+    finally:
+        event.remove(with_db_context.engine, 'before_cursor_execute', contar)
+    assert segunda['desde_cache'] and consultas == []
+
+    with pytest.raises(ValidationError):
+        emparejamiento_service.mejores_parejas('000000000', {})
+
+def test_analizar_patrones(with_db_context, monkeypatch):
+    """Vistas paginadas del grafo de contrapartes con ventana de fechas"""
+    from flask import current_app
+    from app.utils.cache_lru import CacheLRU
+    from app.utils.exceptions import ValidationError
+    current_app.config['EMPAREJADOR_CACHE_TAMANO'] = 3
+    monkeypatch.setattr(emparejamiento_service, 'cache_patrones', CacheLRU())
+    hoy = datetime.now().date()
+    filas = [
+        # Ciclo 111 -> 222 -> 333 -> 111 y recíproca 111 <-> 222
+        ('111', '222', 100.0, 1), ('222', '333', 50.0, 2), ('333', '111', 25.0, 3), ('222', '111', 40.0, 4),
+        # Cluster aparte sin ciclo
+        ('444', '555', 10.0, 5),
+        # Fuera de la ventana
+        ('666', '777', 999.0, 60),
+    ]
+    for nombre1, nombre2, monto, dias in filas:
+        with_db_context.session.add(Operacion(fecha=hoy - timedelta(days=dias), hora=time(10, 0),
+                                              nombre1=nombre1, nombre2=nombre2, monto=monto))
+    with_db_context.session.add(Afiliado(numero='111', nombre='Ana', apellido_paterno='Paz',
+                                         apellido_materno='Luna', dni='11111111', estado='Activo'))
+    with_db_context.session.commit()
+    ventana = {'fecha_desde': (hoy - timedelta(days=30)).isoformat()}
+
+    respuesta = emparejamiento_service.analizar_patrones(dict(ventana, per_page=2))
+    assert respuesta['resumen'] == {
+        'afiliados': 5, 'aristas': 5, 'operaciones': 5, 'operaciones_propias': 0, 'volumen': 225.0,
+        'parejas_reciprocas': 1, 'clusters': 2, 'cluster_mayor': 3, 'ciclos': 1, 'afiliados_en_ciclos': 3,
+    }
+    assert respuesta['pagination'] == {'total': 5, 'page': 1, 'per_page': 2, 'pages': 3}
+    # Por volumen total: 222 (190) antes que 111 (165)
+    assert [fila['numero'] for fila in respuesta['data']] == ['222', '111']
+    primero = respuesta['data'][1]
+    assert primero['nombre'] == 'Ana Paz' and respuesta['data'][0]['nombre'] is None
+    assert (primero['volumen_enviado'], primero['volumen_recibido'], primero['contrapartes']) == (100.0, 65.0, 2)
+    assert primero['reciprocas'] == 1 and primero['cluster'] == 1 and primero['ciclo'] == 1
+
+    reciprocos = emparejamiento_service.analizar_patrones(dict(ventana, vista='reciprocos'))
+    assert reciprocos['desde_cache']
+    assert reciprocos['data'] == [{'afiliado1': '111', 'afiliado2': '222', 'operaciones_1a2': 1,
+                                   'operaciones_2a1': 1, 'volumen_1a2': 100.0, 'volumen_2a1': 40.0,
+                                   'balance': 60.0}]
+    clusters = emparejamiento_service.analizar_patrones(dict(ventana, vista='clusters'))['data']
+    assert [(c['id'], c['tamano'], c['volumen']) for c in clusters] == [(1, 3, 215.0), (2, 2, 10.0)]
+    ciclos = emparejamiento_service.analizar_patrones(dict(ventana, vista='ciclos'))['data']
+    assert ciclos[0]['muestra'] == ['222', '111', '333'] and ciclos[0]['aristas'] == 4
+    miembros = emparejamiento_service.analizar_patrones(dict(ventana, cluster=2))['data']
+    assert {fila['numero'] for fila in miembros} == {'444', '555'}
+
+    completo = emparejamiento_service.analizar_patrones({})
+    assert completo['resumen']['afiliados'] == 7 and completo['ventana']['operaciones'] == 6
+
+    for invalido in ({'fecha_desde': '2024-13-01'}, {'vista': 'otra'}, {'per_page': 0},
+                     {'fecha_desde': '2024-02-01', 'fecha_hasta': '2024-01-01'}):
+        with pytest.raises(ValidationError):
+            emparejamiento_service.analizar_patrones(invalido)
@@ -108,4 +108,239 @@ def test_emparejador_endpoint(client, with_db_context):
     # Verificar respuesta
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['success'] == True
\ No newline at end of file
+    assert data['success'] == True
+
+@pytest.mark.parametrize('filtros', [
+    {'offset': -3}, {'limite': 0}, {'motor': 'cuantico'}, {'ventana_dias': -1}, {'semilla': 'abc'},
+])
+def test_emparejador_filtros_invalidos(client, with_db_context, filtros):
+    """Un filtro inválido es un error del cliente (400), no del servidor"""
+    response = client.post('/api/emparejador/calcular', json=filtros)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def esperar_trabajo(client, id_trabajo, limite_segundos=30):
+    """Consulta el trabajo hasta que termine"""
+    import time as reloj
+    fin = reloj.monotonic() + limite_segundos
+    while reloj.monotonic() < fin:
+        trabajo = client.get(f'/api/emparejador/trabajos/{id_trabajo}').get_json()['data']
+        if trabajo['estado'] not in ('pendiente', 'en_curso'):
+            return trabajo
+        reloj.sleep(0.05)
+    raise AssertionError(f"El trabajo {id_trabajo} no terminó")
+
+def test_trabajo_emparejamiento_endpoint(client, with_db_context):
+    """El trabajo en segundo plano devuelve el mismo ranking que /emparejador/calcular"""
+    from tests.test_emparejamiento_service import poblar_datos
+    poblar_datos(with_db_context)
+    filtros = {'dias_minimos': 1, 'riesgo_maximo': 100, 'limite': 20}
+
+    response = client.post('/api/emparejador/trabajos', json=filtros)
+    assert response.status_code == 202
+    enviado = response.get_json()['data']
+    assert enviado['nuevo']
+
+    trabajo = esperar_trabajo(client, enviado['id'])
+    directo = client.post('/api/emparejador/calcular', json=filtros).get_json()
+
+    assert trabajo['estado'] == 'completado'
+    assert trabajo['avance'] == 1.0
+    assert trabajo['estadisticas']['presupuesto_segundos'] == 600
+    assert trabajo['estadisticas']['evaluadas'] == directo['estadisticas']['evaluadas']
+    assert [(r['pareja'], r['riesgo']) for r in trabajo['resultado']['data']] == \
+        [(r['pareja'], r['riesgo']) for r in directo['data']]
+
+    assert client.get('/api/emparejador/trabajos/inexistente').status_code == 400
+    assert client.post('/api/emparejador/trabajos', json={'limite': 0}).status_code == 400
+
+def test_trabajo_compartido_y_cancelado(client, with_db_context, monkeypatch):
+    """Pedidos idénticos comparten el trabajo y cancelarlo detiene el cálculo"""
+    import threading
+    from app.services import emparejamiento_service
+    iniciado = threading.Event()
+
+    def calculo_lento(filtros, control=None, estadisticas=None):
+        estadisticas.update({'combinaciones': 10, 'evaluadas': 0, 'descartadas': {
+            'sin_superposicion': 0, 'canal_incompatible': 0, 'rango_invalido': 0, 'dias_minimos': 0}})
+        while not control.agotado():
+            estadisticas['evaluadas'] = 3
+            iniciado.set()
+        estadisticas.update({'completo': False, 'cancelado': control.cancelado})
+        return {'success': True, 'data': [], 'estadisticas': estadisticas}
+
+    monkeypatch.setattr(emparejamiento_service, 'calcular_emparejamientos', calculo_lento)
+    filtros = {'dias_minimos': 2, 'riesgo_maximo': 70}
+
+    primero = client.post('/api/emparejador/trabajos', json=filtros).get_json()['data']
+    segundo = client.post('/api/emparejador/trabajos', json=filtros).get_json()['data']
+    assert segundo['id'] == primero['id']
+    assert not segundo['nuevo']
+
+    assert iniciado.wait(10)
+    en_curso = client.get(f"/api/emparejador/trabajos/{primero['id']}").get_json()['data']
+    assert en_curso['estado'] == 'en_curso'
+    assert en_curso['avance'] == 0.3
+    assert en_curso['solicitudes'] == 2
+
+    assert client.delete(f"/api/emparejador/trabajos/{primero['id']}").status_code == 200
+    trabajo = esperar_trabajo(client, primero['id'])
+    assert trabajo['estado'] == 'cancelado'
+    assert trabajo['estadisticas']['cancelado']
+
+    # Tras la cancelación, el mismo pedido lanza un trabajo nuevo
+    nuevo = client.post('/api/emparejador/trabajos', json=filtros).get_json()['data']
+    assert nuevo['id'] != primero['id']
+    client.delete(f"/api/emparejador/trabajos/{nuevo['id']}")
+    esperar_trabajo(client, nuevo['id'])
+
+def test_emparejador_ndjson(client, with_db_context):
+    """El modo streaming emite los mismos emparejamientos y cierra con el resumen"""
+    from tests.test_emparejamiento_service import poblar_datos
+    from app.utils.ndjson import lineas_ndjson
+    poblar_datos(with_db_context)
+    filtros = {'dias_minimos': 1, 'riesgo_maximo': 100, 'limite': 30, 'offset': 5}
+
+    response = client.post('/api/emparejador/calcular', json=dict(filtros, formato='ndjson'))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in response.get_data(as_text=True).splitlines()]
+    directo = client.post('/api/emparejador/calcular', json=filtros).get_json()
+
+    *emparejamientos, resumen = lineas
+    assert resumen['tipo'] == 'resumen'
+    assert resumen['paginacion'] == directo['paginacion']
+    assert resumen['estadisticas'] == directo['estadisticas']
+    assert [(r['pareja'], r['riesgo']) for r in emparejamientos] == \
+        [(r['pareja'], r['riesgo']) for r in directo['data']]
+
+    # También se activa con la cabecera Accept
+    response = client.post('/api/emparejador/calcular', json=filtros,
+                           headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+
+    fragmentos = list(lineas_ndjson([{'a': 1}, {'a': 2}, {'a': 3}], {'tipo': 'resumen'}, 2))
+    assert fragmentos == ['{"a": 1}\n{"a": 2}\n', '{"a": 3}\n{"tipo": "resumen"}\n']
+
+@pytest.mark.parametrize('motor', ['clasico', 'vectorizado'])
+def test_emparejador_perf(client, with_db_context, motor):
+    """La respuesta trae los tiempos por etapa y contadores coherentes con las estadísticas"""
+    from tests.test_emparejamiento_service import poblar_datos
+    poblar_datos(with_db_context)
+
+    respuesta = client.post('/api/emparejador/calcular', json={
+        'dias_minimos': 3, 'riesgo_maximo': 40, 'usar_algoritmo_avanzado': True, 'motor': motor
+    }).get_json()
+    perf, estadisticas = respuesta['perf'], respuesta['estadisticas']
+    descartadas = estadisticas['descartadas']
+
+    for etapa in ('carga_rangos', 'carga_operaciones', 'preparacion_fechas', 'consolidacion_rangos',
+                  'filtrado_parejas', 'indices', 'serializacion'):
+        assert perf['etapas_ms'][etapa] >= 0
+    assert perf['total_ms'] >= sum(perf['etapas_ms'].values()) - 1
+    assert perf['contadores'] == {
+        'filas_rangos': RangoAfiliado.query.count(),
+        'filas_operaciones': 300,
+        'parejas_consideradas': estadisticas['combinaciones'],
+        'podadas_rango': descartadas['sin_superposicion'] + descartadas['rango_invalido'],
+        'podadas_canal': descartadas['canal_incompatible'],
+        'podadas_recencia': descartadas['dias_minimos'],
+        'podadas_riesgo': descartadas['riesgo_maximo'],
+        'podadas_monto': descartadas['monto_asignado'],
+        'evaluadas': estadisticas['evaluadas'],
+        'resultados': respuesta['paginacion']['total'],
+    }
+
+def test_planificar_endpoint(client, with_db_context):
+    """El plan diario no repite afiliados con cupo 1 y valida los cupos"""
+    from tests.test_emparejamiento_service import poblar_datos
+    poblar_datos(with_db_context)
+
+    response = client.post('/api/emparejador/planificar', json={'riesgo_maximo': 100, 'semilla': 3})
+    assert response.status_code == 200
+    respuesta = response.get_json()
+    numeros = [numero for resultado in respuesta['data'] for numero in resultado['pareja']]
+    assert numeros and len(numeros) == len(set(numeros))
+    assert respuesta['plan']['parejas'] == len(respuesta['data'])
+    assert respuesta['plan']['afiliados_asignados'] == len(numeros)
+
+    assert client.post('/api/emparejador/planificar', json={'cupo_diario': 'dos'}).status_code == 400
+    assert client.post('/api/emparejador/planificar', json={'maximo_parejas': 0}).status_code == 400
+
+def test_mejores_parejas_endpoint(client, with_db_context):
+    """Las mejores parejas de un afiliado, ordenadas por riesgo y que lo incluyen"""
+    from tests.test_emparejamiento_service import poblar_datos
+    numeros = poblar_datos(with_db_context)
+
+    response = client.post(f'/api/emparejador/mejores/{numeros[0]}', json={'riesgo_maximo': 100, 'limite': 5})
+    assert response.status_code == 200
+    datos = response.get_json()['data']
+    assert 0 < len(datos) <= 5 and all(numeros[0] in r['pareja'] for r in datos)
+    assert [r['riesgo'] for r in datos] == sorted(r['riesgo'] for r in datos)
+
+    assert client.post(f'/api/emparejador/mejores/{numeros[0]}').status_code == 200
+    assert client.post('/api/emparejador/mejores/000000000', json={}).status_code == 400
+
+def test_analizar_patrones_endpoint(client, with_db_context):
+    """El análisis de patrones pagina la vista pedida y valida los filtros"""
+    from tests.test_emparejamiento_service import poblar_datos
+    poblar_datos(with_db_context)
+
+    response = client.post('/api/emparejador/analizar-patrones', json={'vista': 'clusters', 'per_page': 5})
+    assert response.status_code == 200
+    respuesta = response.get_json()
+    assert respuesta['success'] and respuesta['vista'] == 'clusters'
+    assert respuesta['resumen']['operaciones'] == 300
+    assert sum(c['tamano'] for c in respuesta['data']) <= respuesta['resumen']['afiliados']
+
+    assert client.post('/api/emparejador/analizar-patrones', json={'vista': 'afiliados', 'page': 0}).status_code == 400
+    assert client.post('/api/emparejador/analizar-patrones', json={'fecha_hasta': 'ayer'}).status_code == 400
+
+def test_detalles_en_lote(client, with_db_context):
+    """El lote devuelve lo mismo que el endpoint por pareja con un número fijo de consultas"""
+    from sqlalchemy import event
+    from tests.test_emparejamiento_service import poblar_datos
+    poblar_datos(with_db_context, num_afiliados=30, num_operaciones=800)
+
+    operaciones = Operacion.query.limit(60).all()
+    parejas = [[op.nombre1, op.nombre2] for op in operaciones[::2]] + \
+        [[op.nombre2, op.nombre1] for op in operaciones[1::5]] + [['000000000', '999999999']]
+
+    consultas = []
+    contar = lambda *args: consultas.append(args[2])
+    event.listen(with_db_context.engine, 'before_cursor_execute', contar)
+    try:
+        response = client.post('/api/emparejador/detalles', json={'parejas': parejas, 'semilla': 5})
+    finally:
+        event.remove(with_db_context.engine, 'before_cursor_execute', contar)
+    assert response.status_code == 200
+    assert len(consultas) == 2
+    lote = response.get_json()['data']
+    assert len(lote) == len(parejas)
+
+    for (afiliado1, afiliado2), detalle in zip(parejas, lote):
+        individual = client.get(f'/api/emparejador/detalles/{afiliado1}/{afiliado2}').get_json()
+        assert (detalle['afiliado1'], detalle['afiliado2']) == (afiliado1, afiliado2)
+        assert detalle['success'] == individual['success']
+        if not individual['success']:
+            assert detalle['error'] == individual['error']
+            continue
+        assert detalle['historial'] == individual['data']
+        assert detalle['patron_riesgo'] == individual['patron_riesgo']
+        assert detalle['usa_izipay'] == individual['usa_izipay']
+        assert len(set(detalle['montos_sugeridos'])) == len(detalle['montos_sugeridos'])
+
+    # Con la misma semilla los montos sugeridos se repiten
+    repetido = client.post('/api/emparejador/detalles', json={'parejas': parejas, 'semilla': 5}).get_json()
+    assert repetido['data'] == lote
+
+    assert client.post('/api/emparejador/detalles', json={'parejas': []}).status_code == 400
+
+    # Una pareja mal formada tiene su propia entrada de error, sin cortar el lote
+    response = client.post('/api/emparejador/detalles', json={'parejas': [['111111111'], parejas[0], 7]})
+    assert response.status_code == 200
+    incompleta, valida, invalida = response.get_json()['data']
+    assert incompleta == {'afiliado1': '111111111', 'afiliado2': None, 'success': False,
+                          'error': 'Cada pareja debe indicar afiliado1 y afiliado2'}
+    assert valida['success'] == lote[0]['success']
+    assert invalida['success'] is False and invalida['error'] == incompleta['error']
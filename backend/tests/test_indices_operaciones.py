@@ -0,0 +1,298 @@
+import io
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+from app.services import operaciones_service, emparejamiento_service
+import numpy as np
+from app.services.codificacion_numeros import CodificadorNumeros, SIN_CODIGO
+from app.services.indices_operaciones import IndiceDiversidad, IndiceParejas, LineaTiempoAfiliados, HistorialPareja
+from app.services.patrones_operaciones import riesgo_patron_parejas
+from app.utils import version_datos
+
+OPERACIONES = pd.DataFrame({
+    'fecha': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-05', '2023-01-03', '2023-01-04', '2023-01-06']),
+    'fecha_completa': pd.to_datetime([
+        '2023-01-01 10:00', '2023-01-02 09:00', '2023-01-05 08:30',
+        '2023-01-03 12:00', '2023-01-04 18:00', '2023-01-06 07:15'
+    ]),
+    'nombre1': ['111', '111', '222', '333', '111', '444'],
+    'nombre2': ['222', '333', '111', '111', '111', '555'],
+    'monto': [100.0, 200.0, 300.0, 400.0, 500.0, 600.0],
+})
+
+def codigo(indice, numero):
+    """Código de un número en el codificador del índice (SIN_CODIGO si no aparece)"""
+    return int(indice.codificador.buscar([numero])[0])
+
+def test_codificador_numeros():
+    """Códigos densos en orden de aparición, estables y reversibles"""
+    codificador = CodificadorNumeros()
+    codigos = codificador.codificar(['111', '222', '111', '333'])
+    assert codigos.dtype == np.int32 and list(codigos) == [0, 1, 0, 2]
+    assert list(codificador.codificar(['444', '222'])) == [3, 1]
+    assert list(codificador.buscar(['333', '999'])) == [2, SIN_CODIGO]
+    assert list(codificador.decodificar([3, 0, 2])) == ['444', '111', '333']
+    assert len(codificador) == 4
+
+def diversidad_por_fuerza_bruta(operaciones, afiliado):
+    """Contrapartes distintas recorriendo fila por fila"""
+    contrapartes = set()
+    for _, op in operaciones.iterrows():
+        if op['nombre1'] == afiliado:
+            contrapartes.add(op['nombre2'])
+        elif op['nombre2'] == afiliado:
+            contrapartes.add(op['nombre1'])
+    return len(contrapartes)
+
+def test_indice_diversidad_construir():
+    """El índice coincide con el conteo fila por fila"""
+    indice = IndiceDiversidad().construir(OPERACIONES)
+
+    for afiliado in ['111', '222', '333', '444', '555', '999']:
+        assert indice.obtener(codigo(indice, afiliado)) == diversidad_por_fuerza_bruta(OPERACIONES, afiliado)
+    assert list(indice.contar(indice.codificador.buscar(['111', '999']))) == [3, 0]
+
+def test_indice_diversidad_incremental():
+    """Agregar operaciones por partes equivale a reconstruir el índice"""
+    codificador = CodificadorNumeros()
+    incremental = IndiceDiversidad(codificador).construir(OPERACIONES.iloc[:3])
+    incremental.agregar(OPERACIONES.iloc[3:])
+    incremental.agregar(OPERACIONES.iloc[:2])
+
+    completo = IndiceDiversidad(codificador).construir(OPERACIONES)
+    assert list(incremental.conteos) == list(completo.conteos)
+
+def test_indice_parejas_clave_canonica():
+    """El historial de una pareja es el mismo sin importar el orden"""
+    indice = IndiceParejas().construir(OPERACIONES)
+    a, b, c = (codigo(indice, numero) for numero in ('111', '222', '333'))
+
+    historial = indice.obtener(b, a)
+    assert indice.posicion(a, b) == indice.posicion(b, a)
+    assert historial.cantidad == 2
+    assert list(historial.montos) == [100.0, 300.0]
+    assert historial.ultima_fecha == pd.Timestamp('2023-01-05')
+    assert historial.ultima_completa == pd.Timestamp('2023-01-05 08:30')
+    assert [r['monto'] for r in historial.registros()] == [100.0, 300.0]
+
+    # Las auto-operaciones y las parejas sin historial no tienen entrada
+    assert indice.obtener(a, a) is None
+    assert indice.obtener(b, c) is None
+    assert list(indice.codificador.decodificar(indice.arreglos()['menores'])) == ['111', '111', '444']
+
+def test_indice_parejas_incremental():
+    """Agregar operaciones por partes equivale a reconstruir el índice"""
+    codificador = CodificadorNumeros()
+    incremental = IndiceParejas(codificador).construir(OPERACIONES.iloc[:2])
+    incremental.agregar(OPERACIONES.iloc[2:])
+    completo = IndiceParejas(codificador).construir(OPERACIONES)
+
+    assert sorted(incremental.claves) == sorted(completo.claves)
+    arreglos = completo.arreglos()
+    for menor, mayor in zip(arreglos['menores'], arreglos['mayores']):
+        a = incremental.obtener(menor, mayor)
+        b = completo.obtener(menor, mayor)
+        assert (a.cantidad, a.ultima_fecha, a.ultima_completa) == (b.cantidad, b.ultima_fecha, b.ultima_completa)
+        assert list(a.montos) == list(b.montos)
+        assert list(a.fechas) == list(b.fechas)
+
+def test_indice_parejas_fusion_por_partes():
+    """Fusionar varias cargas al azar guarda cada historial en el orden de la tabla"""
+    rng = np.random.default_rng(3)
+    n = 500
+    fechas = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 90 * 1440, n), unit='min')
+    operaciones = pd.DataFrame({
+        'fecha': fechas.normalize(), 'fecha_completa': fechas,
+        'nombre1': rng.choice(['1', '2', '3', '4', '5', '6'], n).astype(object),
+        'nombre2': rng.choice(['1', '2', '3', '4', '5', '6'], n).astype(object),
+        'monto': rng.integers(1, 1000, n).astype(float),
+    })
+    indice = IndiceParejas()
+    for desde, hasta in ((0, 7), (7, 8), (8, 200), (200, 200), (200, n)):
+        indice = indice.copia().agregar(operaciones.iloc[desde:hasta])
+
+    distintas = operaciones[operaciones['nombre1'] != operaciones['nombre2']]
+    par = pd.Series(['-'.join(sorted(p)) for p in zip(distintas['nombre1'], distintas['nombre2'])],
+                    index=distintas.index)
+    esperados = distintas.groupby(par, sort=False)
+    assert len(indice.claves) == esperados.ngroups
+    for pareja, grupo in esperados:
+        uno, otro = pareja.split('-')
+        historial = indice.obtener(codigo(indice, uno), codigo(indice, otro))
+        assert list(historial.montos) == grupo['monto'].tolist()
+        assert historial.cantidad == len(grupo)
+        assert historial.ultima_completa == grupo['fecha_completa'].max()
+    assert list(indice.riesgos_patron()) == list(riesgo_patron_parejas(
+        [indice.montos[k] for k in range(len(indice.claves))], [indice.fechas[k] for k in range(len(indice.claves))]
+    ))
+
+def riesgo_patron_por_pareja(historial):
+    """Fórmula del riesgo de patrón recorriendo el historial en Python (referencia)"""
+    if len(historial) < 2:
+        return 50
+    montos = [op['monto'] for op in historial if op['monto'] > 0]
+    if len(montos) < 2:
+        return 50
+    media = sum(montos) / len(montos)
+    coef_var = (sum((x - media) ** 2 for x in montos) / len(montos)) ** 0.5 / media
+    riesgo_variacion = 100 * (1 - min(1, coef_var))
+
+    fechas = sorted(op['fecha'].date() for op in historial if op['fecha'] is not None)
+    diferencias = [(b - a).days for a, b in zip(fechas, fechas[1:]) if b > a]
+    riesgo_temporal = 50
+    if len(fechas) >= 2 and diferencias:
+        media_dif = sum(diferencias) / len(diferencias)
+        desviacion = (sum((x - media_dif) ** 2 for x in diferencias) / len(diferencias)) ** 0.5
+        riesgo_temporal = 100 * (1 - min(1, desviacion / media_dif / 2))
+    return (riesgo_variacion * 0.6) + (riesgo_temporal * 0.4)
+
+def test_riesgo_patron_agrupado(app):
+    """El cálculo agrupado coincide con la fórmula por pareja dentro de TOLERANCIA_PATRON"""
+    from app.services.patrones_operaciones import TOLERANCIA_PATRON, riesgo_patron
+
+    rng = np.random.default_rng(5)
+    montos, fechas = [], []
+    for _ in range(400):
+        n = int(rng.choice([0, 1, 2, 3, 7, 25]))
+        monto = rng.uniform(-50, 900, n) * rng.choice([1e-3, 1, 1e4])
+        monto[rng.random(n) < 0.1] = np.nan
+        fecha = np.datetime64('2023-01-01', 'ns') + rng.integers(0, 40 * 86400, n).astype('timedelta64[s]')
+        fecha[rng.random(n) < 0.15] = np.datetime64('NaT')
+        montos.append(monto)
+        fechas.append(fecha)
+
+    agrupado = riesgo_patron_parejas(montos, fechas)
+    for k, (monto, fecha) in enumerate(zip(montos, fechas)):
+        historial = HistorialPareja(len(monto), None, None, monto, fecha).registros()
+        assert abs(agrupado[k] - riesgo_patron_por_pareja(historial)) < TOLERANCIA_PATRON
+        # La consulta de una pareja usa la misma implementación
+        assert riesgo_patron(historial) == agrupado[k]
+
+    indice = IndiceParejas().construir(OPERACIONES)
+    a, b = codigo(indice, '111'), codigo(indice, '222')
+    historial = indice.obtener(a, b).registros()
+    assert indice.riesgos_patron()[indice.posicion(a, b)] == riesgo_patron(historial)
+    # Con las fechas como texto, como en la respuesta de detalles
+    assert riesgo_patron([{'fecha': op['fecha'].strftime('%Y-%m-%d'), 'monto': op['monto']} for op in historial]) \
+        == riesgo_patron(historial)
+
+def posteriores_por_fuerza_bruta(operaciones, afiliado, instante):
+    """Operaciones del afiliado posteriores al instante recorriendo el DataFrame"""
+    del_afiliado = (operaciones['nombre1'] == afiliado) | (operaciones['nombre2'] == afiliado)
+    return int((del_afiliado & (operaciones['fecha_completa'] > instante)).sum())
+
+def test_linea_tiempo_contar_desde():
+    """La búsqueda binaria coincide con el filtrado del DataFrame"""
+    linea = LineaTiempoAfiliados().construir(OPERACIONES)
+    instantes = [pd.Timestamp('2022-12-31'), pd.Timestamp('2023-01-02 09:00'), pd.Timestamp('2023-01-04 18:00')]
+
+    for afiliado in ['111', '222', '333', '444', '999']:
+        for instante in instantes:
+            assert linea.contar_desde(codigo(linea, afiliado), instante) == \
+                posteriores_por_fuerza_bruta(OPERACIONES, afiliado, instante)
+
+    # La auto-operación cuenta una sola vez; NaT nunca tiene posteriores
+    assert linea.total(codigo(linea, '111')) == 5
+    assert linea.total(codigo(linea, '999')) == 0
+    assert linea.contar_desde(codigo(linea, '111'), pd.NaT) == 0
+
+    vista = linea.vista(linea.codificador.buscar(['111', '999', '333']))
+    posteriores = LineaTiempoAfiliados.contar_posteriores(
+        vista, np.array([0, 1, 2]), np.full(3, pd.Timestamp('2023-01-02 09:00').value)
+    )
+    assert list(posteriores) == [3, 0, 1]
+    assert list(vista['total_ops']) == [5, 0, 2]
+
+def test_linea_tiempo_incremental():
+    """Agregar operaciones por partes equivale a reconstruir la línea de tiempo"""
+    codificador = CodificadorNumeros()
+    incremental = LineaTiempoAfiliados(codificador).construir(OPERACIONES.iloc[:2])
+    incremental.agregar(OPERACIONES.iloc[2:])
+    completo = LineaTiempoAfiliados(codificador).construir(OPERACIONES)
+
+    assert incremental.totales == completo.totales
+    assert incremental.tiempos.keys() == completo.tiempos.keys()
+    for afiliado, tiempos in completo.tiempos.items():
+        assert list(incremental.tiempos[afiliado]) == list(tiempos)
+
+def test_carga_actualiza_indice_diversidad(with_db_context):
+    """La carga de un archivo actualiza el índice sin reconstruirlo"""
+    def subir(contenido):
+        archivo = FileStorage(stream=io.BytesIO(contenido), filename='operaciones.csv')
+        operaciones_service.procesar_archivos([archivo])
+
+    subir(b"Date,Time,Phone Number 1,Phone Number 2,Amount\n"
+          b"2023-01-01,12:30,111,222,500\n")
+    emparejamiento_service.obtener_indices(pd.DataFrame({
+        'fecha': [pd.Timestamp('2023-01-01')], 'hora': ['12:30:00'], 'monto': [500.0],
+        'nombre1': ['111'], 'nombre2': ['222'], 'fecha_completa': [pd.Timestamp('2023-01-01 12:30')]
+    }))
+    previos = emparejamiento_service.cache_indices.obtener(version_datos.version('operaciones'))
+    assert previos.diversidad.obtener(codigo(emparejamiento_service, '111')) == 1
+
+    subir(b"Date,Time,Phone Number 1,Phone Number 2,Amount\n"
+          b"2023-01-02,10:00,111,333,200\n"
+          b"2023-01-03,11:00,222,111,300\n")
+
+    indices = emparejamiento_service.cache_indices.obtener(version_datos.version('operaciones'))
+    indice = indices.diversidad
+    assert indice.version == indices.version == version_datos.version('operaciones')
+    assert indice.obtener(codigo(indice, '111')) == 2
+    assert indice.obtener(codigo(indice, '333')) == 1
+
+    linea = indices.linea_tiempo
+    assert linea.total(codigo(linea, '111')) == 3
+    assert linea.contar_desde(codigo(linea, '111'), pd.Timestamp('2023-01-02 10:00')) == 1
+    assert indices.parejas.obtener(codigo(linea, '111'), codigo(linea, '222')).cantidad == 2
+
+    # El conjunto anterior, que un cálculo en curso puede estar leyendo, no cambió
+    assert previos.diversidad.obtener(codigo(indice, '111')) == 1
+    assert previos.linea_tiempo.total(codigo(linea, '111')) == 1
+
+def alcanzables(n, aristas, inicio):
+    """Nodos alcanzables desde 'inicio' recorriendo 'aristas' (búsqueda directa)"""
+    vistos, pendientes = {inicio}, [inicio]
+    while pendientes:
+        nodo = pendientes.pop()
+        for u, v in aristas:
+            if u == nodo and v not in vistos:
+                vistos.add(v)
+                pendientes.append(v)
+    return vistos
+
+def test_grafo_contrapartes_componentes():
+    """Clusters, ciclos y recíprocas coinciden con recorridos directos del grafo"""
+    from app.services.grafo_contrapartes import GrafoContrapartes, SIN_CICLO
+    rng = np.random.default_rng(5)
+    codigo1 = rng.integers(0, 40, size=70)
+    codigo2 = rng.integers(0, 40, size=70)
+    montos = rng.choice([100.0, 250.0], size=70)
+    grafo = GrafoContrapartes(codigo1, codigo2, montos)
+
+    nodo = {int(c): k for k, c in enumerate(grafo.codigos)}
+    aristas = {(nodo[a], nodo[b]) for a, b in zip(codigo1.tolist(), codigo2.tolist()) if a != b}
+    assert len(grafo.claves) == len(aristas) and grafo.propias == int((codigo1 == codigo2).sum())
+    assert grafo.volumenes.sum() == montos[codigo1 != codigo2].sum()
+
+    sin_direccion = aristas | {(v, u) for u, v in aristas}
+    cluster, ciclo = grafo.clusters(), grafo.ciclos()
+    for u in range(len(grafo)):
+        conectados = alcanzables(len(grafo), sin_direccion, u)
+        assert set(np.flatnonzero(cluster == cluster[u]).tolist()) == conectados
+        fuertes = {v for v in alcanzables(len(grafo), aristas, u) if u in alcanzables(len(grafo), aristas, v)}
+        if len(fuertes) > 1:
+            assert set(np.flatnonzero(ciclo == ciclo[u]).tolist()) == fuertes
+        else:
+            assert ciclo[u] == SIN_CICLO
+    # Numerados por tamaño decreciente
+    tamanos = np.bincount(cluster)
+    assert list(tamanos) == sorted(tamanos, reverse=True)
+
+    directas, inversas = grafo.reciprocas()
+    esperadas = {(u, v) for u, v in aristas if u < v and (v, u) in aristas}
+    assert {(int(grafo.origenes[d]), int(grafo.indices[d])) for d in directas} == esperadas
+    assert all(grafo.origenes[i] == grafo.indices[d] for d, i in zip(directas, inversas))
+
+    metricas = grafo.metricas()
+    for u in range(len(grafo)):
+        contrapartes = {v for a, v in aristas if a == u} | {a for a, v in aristas if v == u}
+        assert metricas['contrapartes'][u] == len(contrapartes)
@@ -141,6 +141,50 @@ export const api = {
       console.error(`Error en UPLOAD ${endpoint}:`, error);
       throw handleApiError(error);
     }
+  },
+
+  // POST con respuesta NDJSON: llama a onRegistro por cada línea a medida que
+  // llega y devuelve el último registro (el resumen)
+  async stream(endpoint, data = {}, onRegistro = () => {}) {
+    let response;
+    try {
+      response = await fetch(`${apiClient.defaults.baseURL}${endpoint}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'application/x-ndjson' },
+        body: JSON.stringify(data)
+      });
+    } catch (error) {
+      console.error(`Error en STREAM ${endpoint}:`, error);
+      throw handleApiError(error);
+    }
+
+    if (!response.ok) {
+      const cuerpo = await response.json().catch(() => ({}));
+      throw {
+        message: `Error del servidor: ${cuerpo.error || response.statusText}`,
+        originalError: cuerpo,
+        status: response.status
+      };
+    }
+
+    const lector = response.body.getReader();
+    const decodificador = new TextDecoder();
+    let pendiente = '';
+    let ultimo = null;
+
+    for (;;) {
+      const { done, value } = await lector.read();
+      pendiente += decodificador.decode(value || new Uint8Array(), { stream: !done });
+
+      const lineas = pendiente.split('\n');
+      pendiente = done ? '' : lineas.pop();
+      for (const linea of lineas) {
+        if (!linea.trim()) continue;
+        if (ultimo !== null) onRegistro(ultimo);
+        ultimo = JSON.parse(linea);
+      }
+      if (done) return ultimo;
+    }
   }
 };
 
@@ -1,5 +1,11 @@
 import api from './api';
 
+// Las consultas GET iguales se limitan a una cada 2 segundos (api.js)
+const INTERVALO_CONSULTA_TRABAJO = 2500;
+let trabajoEnCurso = null;
+
+const esperar = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
 export default {
   /**
    * Obtiene afiliados para un rango específico
@@ -48,11 +54,14 @@ export default {
   },
   
   /**
-   * Calcula emparejamientos según filtros mejorados
+   * Calcula emparejamientos según filtros mejorados.
+   * El cálculo corre como trabajo en segundo plano en el servidor y se consulta
+   * hasta que termina, así no depende del timeout de las peticiones.
    * @param {Object} filtros - Filtros para el cálculo
+   * @param {Function} onProgreso - Recibe el trabajo en cada consulta (opcional)
    * @returns {Promise} - Promesa con los resultados
    */
-  async calcularEmparejamientos(filtros = {}) {
+  async calcularEmparejamientos(filtros = {}, onProgreso = null) {
     // Versión mejorada que acepta configuración de ponderaciones
     const parametros = {
       dias_minimos: filtros.dias_minimos || 1,
@@ -73,8 +82,55 @@ export default {
       // Indicar si queremos usar el algoritmo mejorado
       usar_algoritmo_avanzado: true
     };
-    
-    return api.post('/emparejador/calcular', parametros);
+
+    // Días de historial a considerar (sin indicar, el valor del servidor)
+    if (filtros.ventana_dias != null) {
+      parametros.ventana_dias = filtros.ventana_dias;
+    }
+
+    // Semilla de los montos sugeridos: con la misma, los detalles los reproducen
+    if (filtros.semilla != null) {
+      parametros.semilla = filtros.semilla;
+    }
+
+    const envio = await api.post('/emparejador/trabajos', parametros);
+    trabajoEnCurso = envio.data.id;
+
+    try {
+      for (;;) {
+        await esperar(INTERVALO_CONSULTA_TRABAJO);
+        const { data: trabajo } = await api.get(`/emparejador/trabajos/${envio.data.id}`);
+        if (onProgreso) onProgreso(trabajo);
+
+        if (trabajo.estado === 'completado') return trabajo.resultado;
+        if (trabajo.estado === 'cancelado') throw new Error('Cálculo de emparejamientos cancelado');
+        if (trabajo.estado === 'error') throw new Error(trabajo.error || 'Error calculando emparejamientos');
+      }
+    } finally {
+      if (trabajoEnCurso === envio.data.id) trabajoEnCurso = null;
+    }
+  },
+
+  /**
+   * Calcula emparejamientos recibiendo los resultados en streaming (NDJSON):
+   * cada emparejamiento se entrega a onResultado apenas llega. El servidor
+   * empieza a enviar cuando terminó el cálculo; lo incremental es la
+   * serialización y la lectura de la respuesta
+   * @param {Object} filtros - Filtros para el cálculo
+   * @param {Function} onResultado - Recibe cada emparejamiento en orden de riesgo
+   * @returns {Promise} - Promesa con el resumen (paginacion, estadisticas)
+   */
+  async calcularEmparejamientosStream(filtros = {}, onResultado = () => {}) {
+    return api.stream('/emparejador/calcular', { ...filtros, formato: 'ndjson' }, onResultado);
+  },
+
+  /**
+   * Cancela el cálculo de emparejamientos en curso, si lo hay
+   * @returns {Promise} - Promesa con el resultado
+   */
+  async cancelarCalculoEmparejamientos() {
+    if (!trabajoEnCurso) return null;
+    return api.delete(`/emparejador/trabajos/${trabajoEnCurso}`);
   }
   
   ,
@@ -83,7 +139,8 @@ export default {
    * Obtiene detalles de un emparejamiento específico con opciones avanzadas
    * @param {String} afiliado1 - Número del primer afiliado
    * @param {String} afiliado2 - Número del segundo afiliado
-   * @param {Object} opciones - Opciones adicionales
+   * @param {Object} opciones - Opciones adicionales (semilla: la usada en
+   *   calcularEmparejamientos, para reproducir sus montos sugeridos)
    * @returns {Promise} - Promesa con los detalles
    */
   async obtenerDetallesEmparejamiento(afiliado1, afiliado2, opciones = {}) {
@@ -98,12 +155,40 @@ export default {
     if (opciones.configuracion) {
       params.append('configuracion', JSON.stringify(opciones.configuracion));
     }
+
+    if (opciones.semilla != null) {
+      params.append('semilla', opciones.semilla);
+    }
     
     // Construir URL con parámetros
     const queryString = params.toString() ? `?${params.toString()}` : '';
     
     return api.get(`/emparejador/detalles/${afiliado1}/${afiliado2}${queryString}`);
   },
+
+  /**
+   * Obtiene los detalles de varias parejas en una sola solicitud
+   * @param {Array} parejas - Lista de [afiliado1, afiliado2]
+   * @param {Object} opciones - Mismas opciones que obtenerDetallesEmparejamiento
+   * @returns {Promise} - Promesa con un detalle por pareja, en el mismo orden
+   */
+  async obtenerDetallesEmparejamientos(parejas, opciones = {}) {
+    const datos = { parejas };
+
+    if (opciones.incluirHistorialCompleto) {
+      datos.incluir_historial_completo = true;
+    }
+
+    if (opciones.configuracion) {
+      datos.configuracion = opciones.configuracion;
+    }
+
+    if (opciones.semilla != null) {
+      datos.semilla = opciones.semilla;
+    }
+
+    return api.post('/emparejador/detalles', datos);
+  },
   
   /**
    * Analiza patrones de comportamiento entre afiliados
@@ -34,6 +34,9 @@ export default {
     // Detalles de pareja
     detallesPareja: null,
     
+    // Semilla de los montos sugeridos del último cálculo (la reutilizan los detalles)
+    semillaCalculo: null,
+    
     // Búsqueda de emparejamiento
     filtroAfiliado1: '',
     filtroAfiliado2: '',
@@ -75,6 +78,11 @@ export default {
       state.historialOperaciones = historial;
     },
     
+    // Actualizar semilla del último cálculo
+    SET_SEMILLA_CALCULO(state, semilla) {
+      state.semillaCalculo = semilla;
+    },
+    
     // Actualizar detalles de pareja
     SET_DETALLES_PAREJA(state, detalles) {
       state.detallesPareja = detalles;
@@ -291,7 +299,8 @@ export default {
             patron: state.configuracion.ponderacionPatron
           },
           usar_algoritmo_avanzado: true,
-          limite: 1000 // Limitar número de resultados para mejor rendimiento
+          limite: 1000, // Limitar número de resultados para mejor rendimiento
+          semilla: Math.floor(Math.random() * 2 ** 31)
         };
         
         // Usar el servicio normal en lugar de API directamente
@@ -300,6 +309,7 @@ export default {
         if (response.success) {
           // Guardar los resultados en el store
           commit('SET_RESULTADOS_EMPAREJAMIENTO', response.data || []);
+          commit('SET_SEMILLA_CALCULO', filtros.semilla);
           
           // Almacenar historial para análisis posterior si está disponible
           if (response.historial) {
@@ -447,7 +457,8 @@ export default {
         // Añadir análisis de historial completo
         const opciones = {
           incluirHistorialCompleto: true,
-          configuracion: state.configuracion
+          configuracion: state.configuracion,
+          semilla: state.semillaCalculo
         };
         
         const response = await emparejadorService.obtenerDetallesEmparejamiento(